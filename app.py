@@ -2,25 +2,134 @@ import re
 import os
 import subprocess
 import time
-import json
 import asyncio
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple, Callable, Awaitable, Any, Sequence
 from contextlib import asynccontextmanager
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from fastapi import FastAPI, HTTPException, Request, Response
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from pydantic import BaseModel
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
+import yt_dlp
 from gcscache import GCSCache
 from localcache import LocalCache
+from tieredcache import TieredCache, WRITE_THROUGH, WRITE_BEHIND
+from sharedcache import SharedMemoryCache
+from ratelimit import TokenBucketLimiter, SharedTokenBucketLimiter
+from metrics import LatencyHistogram
 from dotenv import load_dotenv
 load_dotenv()
 
-# Rate limiting storage
-request_counts = defaultdict(deque)
-RATE_LIMIT = 10
-RATE_WINDOW = 60
+# Rate limiting: a token bucket per client IP holding RATE_LIMIT tokens that
+# refill over RATE_WINDOW seconds. Every API request costs one token; one that
+# needs a cold extraction costs RATE_LIMIT_EXTRACTION_COST in total
+RATE_LIMIT = int(os.getenv("RATE_LIMIT", "10"))
+RATE_WINDOW = int(os.getenv("RATE_WINDOW", "60"))
+RATE_LIMIT_EXTRACTION_COST = float(os.getenv("RATE_LIMIT_EXTRACTION_COST", "3"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "true").lower() in ("1", "true", "yes")  # One budget across workers
+RATE_LIMIT_SHARED_PATH = os.getenv("RATE_LIMIT_SHARED_PATH")  # Defaults to a file in /dev/shm
+
+# Stream URLs are reused until shortly before their signed expire= time
+STREAM_CACHE_MAX_ITEMS = int(os.getenv("STREAM_CACHE_MAX_ITEMS", "5000"))
+STREAM_EXPIRY_MARGIN_MINUTES = int(os.getenv("STREAM_EXPIRY_MARGIN_MINUTES", "10"))
+
+# Known failures (unplayable videos, bad timestamps, undecodable frames) are
+# remembered so retrying clients don't re-run yt-dlp or ffmpeg
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "600"))
+NEGATIVE_CACHE_MAX_ITEMS = int(os.getenv("NEGATIVE_CACHE_MAX_ITEMS", "10000"))
+
+# Byte budget for the in-memory screenshot cache
+MEMORY_CACHE_MAX_BYTES = int(os.getenv("MEMORY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Host-wide screenshot cache shared by all uvicorn workers (0 disables it)
+SHARED_CACHE_BYTES = int(os.getenv("SHARED_CACHE_BYTES", "0"))
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH")  # Defaults to a file in /dev/shm
+
+# Bounded write-behind queue for backend uploads: a fixed pool of upload
+# workers, and request handlers wait once this many items or bytes are queued
+WRITE_QUEUE_WORKERS = int(os.getenv("WRITE_QUEUE_WORKERS", "8"))
+WRITE_QUEUE_MAX_ITEMS = int(os.getenv("WRITE_QUEUE_MAX_ITEMS", "1000"))
+WRITE_QUEUE_MAX_BYTES = int(os.getenv("WRITE_QUEUE_MAX_BYTES", str(128 * 1024 * 1024)))
+
+# Store each /api/screenshots result (metadata and every quality) as one
+# bundle object: one GET answers a warm hit, a ranged GET serves one quality
+BUNDLE_CACHE = os.getenv("BUNDLE_CACHE", "false").lower() in ("1", "true", "yes")
+
+# Seconds between sweeps of the local disk cache (expired files and pack
+# segment compaction); 0 disables them
+LOCAL_CACHE_CLEANUP_INTERVAL = float(os.getenv("LOCAL_CACHE_CLEANUP_INTERVAL", "3600"))
+
+# Seconds a shutting-down worker waits for queued cache writes to be flushed
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))
+
+QUALITY_ORDER = ['ultra', 'high', 'medium', 'low']
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Timeouts (seconds) for external tools
+FFMPEG_TIMEOUT = int(os.getenv("FFMPEG_TIMEOUT", "60"))
+EXTRACTION_TIMEOUT = int(os.getenv("EXTRACTION_TIMEOUT", "90"))
+
+# "per_stream" seeks every quality's stream; "single_pass" decodes only the
+# highest stream and downscales it to the other qualities in one ffmpeg run
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "per_stream")
+
+# Batch extraction limits
+BATCH_MAX_TIMESTAMPS = int(os.getenv("BATCH_MAX_TIMESTAMPS", "200"))
+BATCH_MAX_GAP = int(os.getenv("BATCH_MAX_GAP", "60"))  # Seconds decoded through before re-seeking
+BATCH_RUN_TIMEOUT = int(os.getenv("BATCH_RUN_TIMEOUT", "300"))  # Upper bound for one batch ffmpeg session
+
+# yt-dlp errors that repeat on every attempt (checked lowercase). Anything
+# else, e.g. network errors, 429 or 5xx, may succeed on the next request
+PERMANENT_EXTRACTION_ERRORS = (
+    'private video',
+    'video unavailable',
+    'this video is not available',
+    'has been removed',
+    'account associated with this video has been terminated',
+    'confirm your age',
+    'age-restricted',
+    'inappropriate for some users',
+    'members-only',
+    'not available in your country',
+    'not made this video available in your country'
+)
+
+# ffmpeg errors (stderr, checked lowercase) that repeat on every attempt at
+# the same frame. Network resets, upstream 5xx and timeouts are not cached
+PERMANENT_FFMPEG_ERRORS = (
+    'invalid data found when processing input',
+    'could not find codec parameters',
+    'moov atom not found',
+    'not found for input stream',  # Decoder (codec ...) not found
+    'does not contain any stream',
+    'output file is empty'
+)
+
+# Shared yt-dlp options for in-process extraction
+YDL_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'noplaylist': True,
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Accept-Encoding': 'gzip, deflate',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+        'Referer': 'https://www.youtube.com/'
+    },
+    'socket_timeout': 30,
+    'retries': 3,
+    'fragment_retries': 3,
+    'source_address': '0.0.0.0',  # Force IPv4
+    'cachedir': False
+}
 
 class VideoRequest(BaseModel):
     url: str
@@ -29,15 +138,154 @@ class VideoRequest(BaseModel):
     minutes: int = 0
     seconds: int = 0
 
+class BatchVideoRequest(BaseModel):
+    url: str
+    timestamps: List[int]
+    quality: str = "high"
+
 # Fast multi-level cache implementation
+class WriteBehindQueue:
+    """Bounded queue of backend writes drained by a fixed pool of upload workers
+    
+    Writes are keyed by the object they store; a write for a key that is still
+    queued replaces the queued one in place. put() waits while the queue is
+    full, so a miss storm slows request handlers down instead of piling image
+    bytes up in memory. A key is never uploaded by two workers at once, so an
+    older write cannot land after a newer one.
+    """
+    def __init__(self, workers: int, max_items: int, max_bytes: int):
+        self.workers = workers
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.pending: OrderedDict[str, Tuple[Callable, tuple, int, float]] = OrderedDict()  # key -> (write, args, size, enqueued_at)
+        self.pending_bytes = 0
+        self.in_flight: set = set()
+        self.stats = {"enqueued": 0, "merged": 0, "written": 0, "failed": 0, "backpressure_waits": 0}
+        self.queue_latency = LatencyHistogram()  # Enqueue to upload start
+        self.upload_latency = LatencyHistogram()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backend-writer")
+        self._changed: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+    
+    def _start(self):
+        """Start the upload workers on the running loop"""
+        if self._tasks and not all(task.done() for task in self._tasks):
+            return
+        self._changed = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    def _full(self, size: int) -> bool:
+        # An item larger than the byte budget is still accepted into an empty queue
+        return len(self.pending) >= self.max_items or (bool(self.pending) and self.pending_bytes + size > self.max_bytes)
+    
+    def _ready_key(self) -> Optional[str]:
+        """Oldest queued key that no worker is uploading"""
+        for key in self.pending:
+            if key not in self.in_flight:
+                return key
+        return None
+    
+    async def put(self, key: str, write: Callable, *args, size: int = 0):
+        """Queue write(*args) for key, waiting while the queue is full"""
+        self._start()
+        async with self._changed: #type: ignore
+            if key not in self.pending and self._full(size):
+                self.stats["backpressure_waits"] += 1
+                await self._changed.wait_for(lambda: key in self.pending or not self._full(size)) #type: ignore
+            
+            if key in self.pending:
+                _, _, previous_size, enqueued_at = self.pending[key]
+                self.pending[key] = (write, args, size, enqueued_at)
+                self.pending_bytes += size - previous_size
+                self.stats["merged"] += 1
+            else:
+                self.pending[key] = (write, args, size, time.perf_counter())
+                self.pending_bytes += size
+                self.stats["enqueued"] += 1
+            self._changed.notify_all() #type: ignore
+    
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        changed: asyncio.Condition = self._changed #type: ignore
+        while True:
+            async with changed:
+                await changed.wait_for(lambda: self._ready_key() is not None)
+                key = self._ready_key()
+                write, args, size, enqueued_at = self.pending.pop(key) #type: ignore
+                self.pending_bytes -= size
+                self.in_flight.add(key)
+                changed.notify_all()
+            
+            self.queue_latency.observe(time.perf_counter() - enqueued_at)
+            started = time.perf_counter()
+            try:
+                await loop.run_in_executor(self._executor, write, *args)
+                self.stats["written"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"Background write error for {key}: {e}")
+            finally:
+                self.upload_latency.observe(time.perf_counter() - started)
+                async with changed:
+                    self.in_flight.discard(key)
+                    changed.notify_all()
+    
+    async def drain(self, timeout: float) -> List[str]:
+        """Wait up to timeout seconds for queued and in-flight writes, then stop the workers
+        
+        Returns the keys whose writes were not confirmed.
+        """
+        if self._changed is not None:
+            try:
+                async with self._changed:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: not self.pending and not self.in_flight), timeout)
+            except asyncio.TimeoutError:
+                pass
+        for task in self._tasks:
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        return list(self.in_flight) + list(self.pending)
+    
+    def snapshot(self) -> Dict:
+        return {
+            "depth": len(self.pending),
+            "pending_bytes": self.pending_bytes,
+            "in_flight": len(self.in_flight),
+            "workers": self.workers,
+            "max_items": self.max_items,
+            "max_bytes": self.max_bytes,
+            **self.stats,
+            "queue_latency": self.queue_latency.snapshot(),
+            "upload_latency": self.upload_latency.snapshot()
+        }
+
+# Fire-and-forget backend writes outside the write queue, awaited on shutdown
+background_tasks: set = set()
+
+def spawn_background(coro: Awaitable, name: str) -> asyncio.Task:
+    """Run coro in the background, tracked until it finishes"""
+    task = asyncio.create_task(coro, name=name) #type: ignore
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
 class FastCache:
-    def __init__(self, gcs_cache: GCSCache | LocalCache) -> None:
+    def __init__(self, gcs_cache: GCSCache | LocalCache | TieredCache,
+                 shared_cache: Optional[SharedMemoryCache] = None) -> None:
         self.gcs_cache = gcs_cache
-        self.memory_cache = {}  # In-memory cache
+        self.shared_cache = shared_cache  # Between process memory and the backend
+        self.write_queue = WriteBehindQueue(WRITE_QUEUE_WORKERS, WRITE_QUEUE_MAX_ITEMS, WRITE_QUEUE_MAX_BYTES)
+        self.memory_cache: OrderedDict[str, bytes] = OrderedDict()  # In-memory LRU, oldest first
         self.metadata_cache = {}  # Cache for metadata
-        self.cache_stats = {"hits": 0, "misses": 0, "memory_hits": 0, "gcs_hits": 0}
-        self.max_memory_items = 100  # Prevent memory overflow
-        self.access_order = deque()  # For LRU eviction
+        self.video_info_cache = {}  # Per-video info index (duration, title, qualities)
+        self.cache_stats = {"hits": 0, "misses": 0, "memory_hits": 0, "shared_hits": 0, "gcs_hits": 0,
+                            "video_info_hits": 0, "video_info_misses": 0,
+                            "memory_evictions": 0, "memory_evicted_bytes": 0,
+                            "presence_hits": 0, "presence_misses": 0,
+                            "bundle_hits": 0, "bundle_misses": 0}
+        self.max_memory_bytes = MEMORY_CACHE_MAX_BYTES  # Budget for image bytes held in memory
+        self.memory_bytes = 0
+        self.max_video_info_items = 1000
         
     async def get_screenshot(self, video_id: str, timestamp: int, quality: str) -> Optional[bytes]:
         """Multi-level cache lookup with LRU eviction"""
@@ -49,21 +297,39 @@ class FastCache:
             self.cache_stats["hits"] += 1
             self.cache_stats["memory_hits"] += 1
             # Move to end for LRU
-            self.access_order.remove(cache_key)
-            self.access_order.append(cache_key)
+            self.memory_cache.move_to_end(cache_key)
             return self.memory_cache[cache_key]
         
+        # Level 2: Shared memory, filled by any worker on this host
+        if self.shared_cache:
+            image_data = self.shared_cache.get(cache_key)
+            if image_data:
+                print(f"SHARED HIT: {cache_key}, size: {len(image_data)} bytes")
+                await self._store_in_memory(cache_key, image_data)
+                self.cache_stats["hits"] += 1
+                self.cache_stats["shared_hits"] += 1
+                return image_data
+        
         print(f"MEMORY MISS: {cache_key}, checking GCS...")
         
-        # Level 2: GCS cache (slower but persistent)
-        image_data = await asyncio.get_event_loop().run_in_executor(
-            None, self.gcs_cache.get_cached_screenshot, video_id, timestamp, quality
-        )
+        # Level 3: GCS cache (slower but persistent); bundled timestamps are
+        # read with a ranged GET, anything else as its own object
+        image_data = None
+        if BUNDLE_CACHE:
+            image_data = await asyncio.get_event_loop().run_in_executor(
+                None, self.gcs_cache.get_cached_bundle_image, video_id, timestamp, quality
+            )
+        if not image_data:
+            image_data = await asyncio.get_event_loop().run_in_executor(
+                None, self.gcs_cache.get_cached_screenshot, video_id, timestamp, quality
+            )
         
         if image_data:
             print(f"GCS HIT: {cache_key}, size: {len(image_data)} bytes")
             # Store in memory cache with LRU eviction
             await self._store_in_memory(cache_key, image_data)
+            if self.shared_cache:
+                self.shared_cache.put(cache_key, image_data)
             self.cache_stats["hits"] += 1
             self.cache_stats["gcs_hits"] += 1
             return image_data
@@ -73,35 +339,62 @@ class FastCache:
         self.cache_stats["misses"] += 1
         return None
     
+    async def has_screenshots(self, video_id: str, timestamp: int, qualities: List[str]) -> Dict[str, bool]:
+        """Check which qualities are cached without downloading image data"""
+        presence = {
+            quality: f"{video_id}_{timestamp}_{quality}" in self.memory_cache or
+                     bool(self.shared_cache and self.shared_cache.contains(f"{video_id}_{timestamp}_{quality}"))
+            for quality in qualities
+        }
+        
+        missing = [quality for quality, present in presence.items() if not present]
+        if missing:
+            presence.update(await asyncio.get_event_loop().run_in_executor(
+                None, self.gcs_cache.has_cached_screenshots, video_id, timestamp, missing
+            ))
+        
+        found = sum(presence.values())
+        self.cache_stats["presence_hits"] += found
+        self.cache_stats["presence_misses"] += len(presence) - found
+        return presence
+    
     async def _store_in_memory(self, cache_key: str, image_data: bytes):
-        """Store in memory with LRU eviction"""
-        # Evict oldest items if cache is full
-        while len(self.memory_cache) >= self.max_memory_items:
-            oldest_key = self.access_order.popleft()
-            if oldest_key in self.memory_cache:
-                del self.memory_cache[oldest_key]
+        """Store in memory with LRU eviction against the byte budget"""
+        previous = self.memory_cache.pop(cache_key, None)
+        if previous is not None:
+            self.memory_bytes -= len(previous)
+        
+        # Images larger than the whole budget are served from the backend only
+        if len(image_data) > self.max_memory_bytes:
+            return
+        
+        # Evict least recently used items until the new image fits
+        while self.memory_cache and self.memory_bytes + len(image_data) > self.max_memory_bytes:
+            _, evicted = self.memory_cache.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+            self.cache_stats["memory_evictions"] += 1
+            self.cache_stats["memory_evicted_bytes"] += len(evicted)
         
         self.memory_cache[cache_key] = image_data
-        self.access_order.append(cache_key)
+        self.memory_bytes += len(image_data)
     
-    async def store_screenshot(self, video_id: str, timestamp: int, quality: str, image_data: bytes):
-        """Store in all cache levels"""
+    async def store_screenshot(self, video_id: str, timestamp: int, quality: str, image_data: bytes, persist: bool = True):
+        """Store in all cache levels (memory only, plus shared, when persist is False)"""
         cache_key = f"{video_id}_{timestamp}_{quality}"
         
-        # Store in memory immediately
+        # Store in memory immediately, and where the other workers can see it
         await self._store_in_memory(cache_key, image_data)
+        if self.shared_cache:
+            self.shared_cache.put(cache_key, image_data)
         
-        # Store in GCS in background (don't wait)
-        asyncio.create_task(self._store_gcs_background(video_id, timestamp, quality, image_data))
-    
-    async def _store_gcs_background(self, video_id: str, timestamp: int, quality: str, image_data: bytes):
-        """Background GCS storage"""
-        try:
-            await asyncio.get_event_loop().run_in_executor(
-                None, self.gcs_cache.cache_screenshot, video_id, timestamp, quality, image_data
-            )
-        except Exception as e:
-            print(f"Background GCS cache error: {e}")
+        if not persist:
+            return
+        
+        # Store in GCS in background (waits only while the write queue is full)
+        await self.write_queue.put(
+            f"screenshot:{cache_key}", self.gcs_cache.cache_screenshot,
+            video_id, timestamp, quality, image_data, size=len(image_data)
+        )
     
     async def get_cached_metadata(self, video_id: str, timestamp: int) -> Optional[List[Dict]]:
         """Get cached metadata with memory cache support"""
@@ -111,6 +404,10 @@ class FastCache:
         if metadata_key in self.metadata_cache:
             return self.metadata_cache[metadata_key]
         
+        # A bundle brings the images into memory along with the metadata
+        if BUNDLE_CACHE and await self.load_bundle(video_id, timestamp):
+            return self.metadata_cache[metadata_key]
+        
         # Check GCS cache
         metadata = await asyncio.get_event_loop().run_in_executor(
             None, self.gcs_cache.get_cached_metadata, video_id, timestamp
@@ -126,56 +423,347 @@ class FastCache:
         
         return metadata
     
-    async def store_metadata(self, video_id: str, timestamp: int, metadata: List[Dict]) -> None:
-        """Store metadata in both caches"""
+    async def store_metadata(self, video_id: str, timestamp: int, metadata: List[Dict], persist: bool = True) -> None:
+        """Store metadata in both caches (memory only when persist is False)"""
         metadata_key = f"{video_id}_{timestamp}_metadata"
         
         # Store in memory immediately
         self.metadata_cache[metadata_key] = metadata
+        if not persist:
+            return
         
         # Store in GCS in background
-        asyncio.create_task(self._store_metadata_gcs_background(video_id, timestamp, metadata))
+        await self.write_queue.put(f"metadata:{metadata_key}", self.gcs_cache.cache_metadata, video_id, timestamp, metadata)
     
-    async def _store_metadata_gcs_background(self, video_id: str, timestamp: int, metadata: List[Dict]):
-        """Background GCS metadata storage"""
-        try:
-            await asyncio.get_event_loop().run_in_executor(
-                None, self.gcs_cache.cache_metadata, video_id, timestamp, metadata
-            )
-        except Exception as e:
-            print(f"Background GCS metadata cache error: {e}")
+    async def load_bundle(self, video_id: str, timestamp: int) -> bool:
+        """Fetch a timestamp's bundle into memory (metadata and images); False if there is none"""
+        bundle = await asyncio.get_event_loop().run_in_executor(
+            None, self.gcs_cache.get_cached_bundle, video_id, timestamp
+        )
+        if not bundle:
+            self.cache_stats["bundle_misses"] += 1
+            return False
+        
+        metadata, images = bundle
+        self.cache_stats["bundle_hits"] += 1
+        for quality, image_data in images.items():
+            await self.store_screenshot(video_id, timestamp, quality, image_data, persist=False)
+        await self.store_metadata(video_id, timestamp, [screenshot for screenshot in metadata if screenshot['quality'] in images], persist=False)
+        return True
+    
+    async def store_bundle(self, video_id: str, timestamp: int, metadata: List[Dict], images: Dict[str, bytes]) -> None:
+        """Persist a timestamp's metadata and images as one backend object in background"""
+        await self.write_queue.put(
+            f"bundle:{video_id}_{timestamp}", self.gcs_cache.cache_bundle,
+            video_id, timestamp, metadata, images, size=sum(len(image_data) for image_data in images.values())
+        )
+    
+    async def get_video_info(self, video_id: str) -> Optional[Dict]:
+        """Look up per-video info in memory, then in the persistent backend"""
+        if video_id in self.video_info_cache:
+            self.cache_stats["video_info_hits"] += 1
+            return self.video_info_cache[video_id]
+        
+        video_info = await asyncio.get_event_loop().run_in_executor(
+            None, self.gcs_cache.get_cached_video_info, video_id
+        )
+        
+        if video_info:
+            self.cache_stats["video_info_hits"] += 1
+            self._store_video_info_in_memory(video_id, video_info)
+        else:
+            self.cache_stats["video_info_misses"] += 1
+        
+        return video_info
+    
+    def _store_video_info_in_memory(self, video_id: str, video_info: Dict):
+        """Store video info in memory, dropping the oldest entry when full"""
+        if video_id not in self.video_info_cache and len(self.video_info_cache) >= self.max_video_info_items:
+            oldest_key = next(iter(self.video_info_cache))
+            del self.video_info_cache[oldest_key]
+        self.video_info_cache[video_id] = video_info
+    
+    async def store_video_info(self, video_id: str, video_info: Dict) -> None:
+        """Store video info in memory and persist it in background"""
+        self._store_video_info_in_memory(video_id, video_info)
+        await self.write_queue.put(f"video_info:{video_id}", self.gcs_cache.cache_video_info, video_id, video_info)
 
 
 # Stream URL caching to avoid repeated yt-dlp calls
 class StreamCache:
-    def __init__(self) -> None:
-        self.cache = {}
-        self.cache_duration = timedelta(minutes=30)  # URLs expire in 30 minutes
-        self.max_items = 50
+    def __init__(self, backend: Optional[GCSCache | LocalCache | TieredCache] = None) -> None:
+        self.backend = backend  # Persists stream tables across restarts and deploys
+        self.cache: OrderedDict[str, Dict] = OrderedDict()  # LRU, oldest first
+        self.default_duration = timedelta(minutes=30)  # For URLs without an expire= parameter
+        self.expiry_margin = timedelta(minutes=STREAM_EXPIRY_MARGIN_MINUTES)
+        self.max_items = STREAM_CACHE_MAX_ITEMS
+    
+    def _expires_at(self, streams: Dict) -> datetime:
+        """Earliest signed-URL expiry across the streams, minus a safety margin"""
+        expiries = []
+        for stream in streams.values():
+            match = re.search(r'[?&/]expire[=/](\d+)', stream.get('url', ''))
+            if match:
+                expiries.append(datetime.fromtimestamp(int(match.group(1))))
+        if not expiries:
+            return datetime.now() + self.default_duration
+        return min(expiries) - self.expiry_margin
     
     def get_streams(self, video_id: str) -> Optional[Dict]:
         if video_id in self.cache:
             cached_data = self.cache[video_id]
-            if datetime.now() - cached_data['timestamp'] < self.cache_duration:
+            if datetime.now() < cached_data['expires_at']:
+                self.cache.move_to_end(video_id)
                 return cached_data['streams']
             else:
                 del self.cache[video_id]  # Clean expired
         return None
     
-    def cache_streams(self, video_id: str, streams: Dict):
-        # Simple cache size management
-        if len(self.cache) >= self.max_items:
-            # Remove oldest entry
-            oldest_key = min(self.cache.keys(), key=lambda k: self.cache[k]['timestamp'])
-            del self.cache[oldest_key]
+    def cache_streams(self, video_id: str, streams: Dict, expires_at: Optional[datetime] = None, persist: bool = True):
+        self.cache.pop(video_id, None)
+        # Evict least recently used entries
+        while len(self.cache) >= self.max_items:
+            self.cache.popitem(last=False)
         
+        expires_at = expires_at or self._expires_at(streams)
         self.cache[video_id] = {
             'streams': streams,
-            'timestamp': datetime.now()
+            'expires_at': expires_at
+        }
+        
+        if persist and self.backend is not None:
+            spawn_background(self._persist_background(video_id, streams, expires_at), f"streams:{video_id}")
+    
+    async def _persist_background(self, video_id: str, streams: Dict, expires_at: datetime):
+        """Background stream table storage"""
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.backend.cache_streams, video_id, streams, expires_at.timestamp() #type: ignore
+            )
+        except Exception as e:
+            print(f"Background stream cache error: {e}")
+    
+    async def load_streams(self, video_id: str) -> Optional[Dict]:
+        """Streams from memory, falling back to the table persisted by an earlier worker"""
+        streams = self.get_streams(video_id)
+        if streams or self.backend is None:
+            return streams
+        
+        entry = await asyncio.get_event_loop().run_in_executor(
+            None, self.backend.get_cached_streams, video_id
+        )
+        if not entry or not entry.get('streams'):
+            return None
+        
+        expires_at = datetime.fromtimestamp(entry['expires_at'])
+        if datetime.now() >= expires_at:
+            return None
+        
+        self.cache_streams(video_id, entry['streams'], expires_at, persist=False)
+        return entry['streams']
+    
+    def invalidate(self, video_id: str):
+        """Drop a video's streams, e.g. after the CDN rejected a signed URL"""
+        self.cache.pop(video_id, None)
+
+class StreamExpiredError(Exception):
+    """ffmpeg got 403 Forbidden from the stream URL (signature expired or revoked)
+    
+    Raised for several extractions at once, it carries the results that did
+    succeed and the keys (qualities or timestamps) that need fresh URLs.
+    """
+    def __init__(self, message: str, completed=None, expired: Optional[List] = None):
+        super().__init__(message)
+        self.completed = completed
+        self.expired = expired
+
+# Remembers failed lookups so repeated requests fail fast
+class NegativeCache:
+    def __init__(self, ttl: int = NEGATIVE_CACHE_TTL, max_items: int = NEGATIVE_CACHE_MAX_ITEMS) -> None:
+        self.cache: OrderedDict[Tuple, Tuple[float, str]] = OrderedDict()  # key -> (expires_at, reason)
+        self.ttl = ttl
+        self.max_items = max_items
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "added": 0}
+    
+    def get(self, key: Tuple) -> Optional[str]:
+        """Reason the key failed recently, or None. Keys start with their kind, e.g. ("extract", video_id)"""
+        entry = self.cache.get(key)
+        if entry is not None:
+            if time.monotonic() < entry[0]:
+                self.stats["hits"] += 1
+                return entry[1]
+            del self.cache[key]
+        self.stats["misses"] += 1
+        return None
+    
+    def add(self, key: Tuple, reason: str, ttl: Optional[int] = None):
+        self.cache.pop(key, None)
+        while len(self.cache) >= self.max_items:
+            self.cache.popitem(last=False)
+        
+        self.cache[key] = (time.monotonic() + (ttl or self.ttl), reason)
+        self.stats["added"] += 1
+    
+    def snapshot(self) -> Dict:
+        kinds: Dict[str, int] = defaultdict(int)
+        for key in self.cache:
+            kinds[key[0]] += 1
+        return {**self.stats, "size": len(self.cache), "by_kind": dict(kinds), "ttl_seconds": self.ttl}
+
+# Request coalescing so identical concurrent jobs share one extraction
+class SingleFlight:
+    def __init__(self) -> None:
+        self.in_flight: Dict[Tuple, asyncio.Task] = {}
+        self.stats = {"leaders": 0, "coalesced": 0}
+    
+    async def run(self, key: Tuple, job: Callable[[], Awaitable[Any]]) -> Any:
+        """Run job once per key; concurrent callers with the same key await the same result
+        
+        Keys start with the job type ("screenshots", "cli", ...) so jobs that
+        return different things never share a result.
+        """
+        task = self.in_flight.get(key)
+        if task is None:
+            self.stats["leaders"] += 1
+            task = asyncio.create_task(job())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.stats["coalesced"] += 1
+            print(f"Coalesced request for {key}")
+        
+        # Shield so a disconnecting client doesn't cancel work other callers await
+        return await asyncio.shield(task)
+    
+    def _finish(self, key: Tuple, task: asyncio.Task):
+        """Drop the finished job and mark its exception as retrieved"""
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if not task.cancelled():
+            task.exception()
+
+def detect_cpu_slots() -> int:
+    """Number of concurrent ffmpeg processes: FFMPEG_SLOTS, else the cgroup CPU quota or usable cores"""
+    configured = os.getenv("FFMPEG_SLOTS")
+    if configured:
+        return max(1, int(configured))
+    
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limit, period = f.read().split()
+            if limit != "max":
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    
+    if quota is not None:
+        cores = min(cores, int(quota) or 1)
+    return max(1, cores)
+
+# Process-wide limit on concurrent ffmpeg jobs with a fair queue
+class ExtractionScheduler:
+    def __init__(self, slots: int) -> None:
+        self.slots = slots
+        self.running = 0
+        self.waiting: OrderedDict[str, deque] = OrderedDict()  # Per-owner FIFO queues, served round-robin
+        self.queue_depth = 0
+        self.stats = {"completed": 0, "queued_total": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+    
+    async def acquire(self, owner: str):
+        """Wait for a free slot; owners (videos) take turns so one large job can't starve the rest"""
+        if self.running < self.slots and not self.queue_depth:
+            self.running += 1
+            return
+        
+        future = asyncio.get_event_loop().create_future()
+        self.waiting.setdefault(owner, deque()).append(future)
+        self.queue_depth += 1
+        self.stats["queued_total"] += 1
+        queued_at = time.time()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Slot was handed over just before cancellation
+            else:
+                self._discard(owner, future)
+            raise
+        
+        wait = time.time() - queued_at
+        self.stats["total_wait_seconds"] += wait
+        self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], wait)
+    
+    def release(self):
+        """Hand the slot to the next owner in turn, or free it"""
+        while self.waiting:
+            owner, queue = next(iter(self.waiting.items()))
+            future = queue.popleft()
+            if queue:
+                self.waiting.move_to_end(owner)
+            else:
+                del self.waiting[owner]
+            self.queue_depth -= 1
+            if not future.done():
+                future.set_result(None)
+                self.stats["completed"] += 1
+                return
+        self.running -= 1
+        self.stats["completed"] += 1
+    
+    def _discard(self, owner: str, future: asyncio.Future):
+        """Remove a cancelled waiter from its queue"""
+        queue = self.waiting.get(owner)
+        if queue and future in queue:
+            queue.remove(future)
+            self.queue_depth -= 1
+            if not queue:
+                del self.waiting[owner]
+    
+    def snapshot(self) -> Dict:
+        """Current queue metrics"""
+        queued_total = self.stats["queued_total"]
+        return {
+            "slots": self.slots,
+            "running": self.running,
+            "queue_depth": self.queue_depth,
+            "queued_owners": len(self.waiting),
+            "completed": self.stats["completed"],
+            "queued_total": queued_total,
+            "avg_wait_seconds": round(self.stats["total_wait_seconds"] / queued_total, 3) if queued_total else 0,
+            "max_wait_seconds": round(self.stats["max_wait_seconds"], 3)
         }
 
 # Initialize caches
-def initialize_cache() -> GCSCache | LocalCache:
+def create_local_cache() -> LocalCache:
+    """Local disk cache configured from the environment"""
+    cache_dir = os.getenv("LOCAL_CACHE_DIR", "cache")
+    local_cache = LocalCache(
+        cache_dir,
+        max_bytes=int(os.getenv("LOCAL_CACHE_MAX_BYTES", "0")),
+        high_watermark=float(os.getenv("LOCAL_CACHE_HIGH_WATERMARK", "0.9")),
+        low_watermark=float(os.getenv("LOCAL_CACHE_LOW_WATERMARK", "0.8")),
+        pack_qualities=[q for q in os.getenv("LOCAL_CACHE_PACK_QUALITIES", "").split(",") if q]
+    )
+    print(f"✅ Using Local Cache (directory: {cache_dir})")
+    return local_cache
+
+def initialize_cache() -> GCSCache | LocalCache | TieredCache:
     """Initialize cache based on Google Cloud authentication availability"""
     google_creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     
@@ -191,6 +779,15 @@ def initialize_cache() -> GCSCache | LocalCache:
             _ = gcs_cache.bucket.exists()
             
             print(f"✅ Using GCS Cache (bucket: {bucket_name})")
+            
+            # Keep a local disk tier in front of GCS so recently served
+            # images don't go back to the network after a memory miss
+            if os.getenv("GCS_LOCAL_TIER", "true").lower() in ("1", "true", "yes"):
+                gcs_write_policy = os.getenv("GCS_WRITE_POLICY", WRITE_BEHIND)
+                return TieredCache([
+                    ("local", create_local_cache(), WRITE_THROUGH),
+                    ("gcs", gcs_cache, gcs_write_policy)
+                ])
             return gcs_cache
             
         except Exception as e:
@@ -201,48 +798,112 @@ def initialize_cache() -> GCSCache | LocalCache:
         print("🔄 Using Local Cache")
     
     # Fallback to local cache
-    cache_dir = os.getenv("LOCAL_CACHE_DIR", "cache")
-    local_cache = LocalCache(cache_dir)
-    print(f"✅ Using Local Cache (directory: {cache_dir})")
-    return local_cache
+    return create_local_cache()
+
+def initialize_shared_cache() -> Optional[SharedMemoryCache]:
+    """Host-wide screenshot cache, if SHARED_CACHE_BYTES is set"""
+    if not SHARED_CACHE_BYTES:
+        return None
+    try:
+        shared_cache = SharedMemoryCache(SHARED_CACHE_BYTES, SHARED_CACHE_PATH)
+        print(f"✅ Using shared memory cache ({shared_cache.path}, {SHARED_CACHE_BYTES} bytes)")
+        return shared_cache
+    except Exception as e:
+        print(f"⚠️  Shared memory cache unavailable: {e}")
+        return None
+
+def initialize_rate_limiter() -> TokenBucketLimiter:
+    """Host-wide token buckets when possible, else per-process ones"""
+    if RATE_LIMIT_SHARED:
+        try:
+            limiter = SharedTokenBucketLimiter(RATE_LIMIT / RATE_WINDOW, RATE_LIMIT, RATE_LIMIT_MAX_KEYS, RATE_LIMIT_SHARED_PATH)
+            print(f"✅ Using shared rate limiter ({limiter.path})")
+            return limiter
+        except Exception as e:
+            print(f"⚠️  Shared rate limiter unavailable, limiting per worker: {e}")
+    return TokenBucketLimiter(RATE_LIMIT / RATE_WINDOW, RATE_LIMIT, RATE_LIMIT_MAX_KEYS)
 
 cache_backend = initialize_cache()
-fast_cache = FastCache(cache_backend)
-stream_cache = StreamCache()
+fast_cache = FastCache(cache_backend, initialize_shared_cache())
+stream_cache = StreamCache(cache_backend)
+single_flight = SingleFlight()
+negative_cache = NegativeCache()
+extraction_scheduler = ExtractionScheduler(detect_cpu_slots())
+rate_limiter = initialize_rate_limiter()
 
 
+def local_cache_tiers() -> List[LocalCache]:
+    """Local disk caches behind the fast cache, on their own or as a tier"""
+    if isinstance(cache_backend, LocalCache):
+        return [cache_backend]
+    if isinstance(cache_backend, TieredCache):
+        return [backend for _, backend, _ in cache_backend.tiers if isinstance(backend, LocalCache)]
+    return []
+
+async def local_cache_cleanup_loop(interval: float):
+    """Periodically delete expired local files and compact pack segments
+    
+    Without a disk quota nothing else reclaims them. GCS is left to its own
+    cleanup: listing the bucket from every worker would be costly.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for local_cache in local_cache_tiers():
+            try:
+                await local_cache.cleanup_expired_cache_async()
+            except Exception as e:
+                print(f"Local cache cleanup error: {e}")
+
+async def drain_background_writes(timeout: float) -> Dict:
+    """Flush queued cache writes within timeout seconds; returns what was left unflushed"""
+    deadline = time.monotonic() + timeout
+    unflushed_writes = await fast_cache.write_queue.drain(timeout)
+    
+    pending_tasks = set(background_tasks)
+    if pending_tasks:
+        _, pending_tasks = await asyncio.wait(pending_tasks, timeout=max(0, deadline - time.monotonic()))
+    
+    # Write-behind tiers (GCS uploads) drain last: the writes above feed them
+    tier_writes = {}
+    if isinstance(cache_backend, TieredCache):
+        tier_writes = await asyncio.get_event_loop().run_in_executor(
+            None, cache_backend.drain, max(0, deadline - time.monotonic())
+        )
+    
+    return {
+        "write_queue": unflushed_writes,
+        "background_tasks": sorted(task.get_name() for task in pending_tasks),
+        "tiers": {name: count for name, count in tier_writes.items() if count}
+    }
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Clean old files from working directory only
-    import glob
-    for f in glob.glob("screenshot_*.png"):
-        try:
-            os.remove(f)
-        except:
-            pass
-    for f in glob.glob("*.png"):  # Clean any lingering PNG files
-        try:
-            if "_" in f and any(qual in f for qual in ['ultra', 'high', 'medium', 'low']):
-                os.remove(f)
-        except:
-            pass
-    print("Application started - cleaned old screenshots from working directory")
+    # Screenshots are piped straight into the cache, so nothing is written to
+    # the working directory and there is nothing to clean up here.
+    print("Application started")
+    cleanup_task = None
+    if LOCAL_CACHE_CLEANUP_INTERVAL > 0 and local_cache_tiers():
+        cleanup_task = asyncio.create_task(local_cache_cleanup_loop(LOCAL_CACHE_CLEANUP_INTERVAL))
     
     yield
     
-    # Shutdown: Clean up working directory only
-    for f in glob.glob("screenshot_*.png"):
-        try:
-            os.remove(f)
-        except:
-            pass
-    for f in glob.glob("*.png"):  # Clean any lingering PNG files
-        try:
-            if "_" in f and any(qual in f for qual in ['ultra', 'high', 'medium', 'low']):
-                os.remove(f)
-        except:
-            pass
-    print("Application shutting down - cleaned screenshots from working directory")
+    print("Application shutting down")
+    if cleanup_task:
+        cleanup_task.cancel()
+    
+    # Freshly generated screenshots would otherwise be lost with the worker
+    # and regenerated at full cost after a deploy
+    start_time = time.time()
+    unflushed = await drain_background_writes(SHUTDOWN_DRAIN_TIMEOUT)
+    lost = len(unflushed["write_queue"]) + len(unflushed["background_tasks"]) + sum(unflushed["tiers"].values())
+    if lost:
+        print(f"⚠️  {lost} cache writes not flushed within {SHUTDOWN_DRAIN_TIMEOUT:g}s")
+        for key in (unflushed["write_queue"] + unflushed["background_tasks"])[:20]:
+            print(f"   - {key}")
+        for name, count in unflushed["tiers"].items():
+            print(f"   - {count} queued writes to the {name} tier")
+    else:
+        print(f"✅ Flushed background cache writes in {time.time() - start_time:.2f}s")
 
 
 app = FastAPI(
@@ -251,24 +912,19 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-def rate_limit_check(client_ip: str) -> bool:
-    """Simple rate limiting implementation"""
-    now = time.time()
-    minute_ago = now - RATE_WINDOW
-    
-    while request_counts[client_ip] and request_counts[client_ip][0] < minute_ago:
-        request_counts[client_ip].popleft()
-    
-    if len(request_counts[client_ip]) >= RATE_LIMIT:
-        return False
-    
-    request_counts[client_ip].append(now)
-    return True
+def rate_limit_check(client_ip: str) -> Tuple[bool, float]:
+    """Take one token from the client's bucket; returns (allowed, seconds to wait)"""
+    return rate_limiter.acquire(client_ip)
+
+def charge_cold_extraction(http_request: Request, runs: int = 1):
+    """Bill the client for extraction work beyond the token the request already paid"""
+    extra = (RATE_LIMIT_EXTRACTION_COST - 1) * runs
+    if extra > 0:
+        rate_limiter.charge(http_request.client.host, extra) #type: ignore
 
-def validate_timestamp(url: str, hours: int, minutes: int, seconds: int) -> Dict:
+def validate_timestamp(video_info: Dict, hours: int, minutes: int, seconds: int) -> Dict:
     """Validate timestamp against video duration"""
     try:
-        video_info = get_video_info_with_api(url)
         duration = video_info.get('duration', 0)
         
         if duration == 0:
@@ -288,6 +944,130 @@ def validate_timestamp(url: str, hours: int, minutes: int, seconds: int) -> Dict
     except Exception as e:
         return {"valid": False, "message": f"Error validating timestamp: {str(e)}"}
 
+async def run_process(cmd: List[str], timeout: Optional[float] = None, check: bool = True,
+                      pass_fds: Sequence[int] = ()) -> subprocess.CompletedProcess:
+    """Run an external tool without blocking the event loop
+    
+    Mirrors subprocess.run(capture_output=True): raises CalledProcessError on a
+    non-zero exit when check is set and TimeoutExpired when the timeout passes.
+    The child is killed if the caller is cancelled or times out. pass_fds are
+    inherited by the child and closed in this process once it has started.
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            pass_fds=pass_fds
+        )
+    finally:
+        for fd in pass_fds:
+            os.close(fd)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(cmd, timeout) #type: ignore
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr) #type: ignore
+
+async def run_ffmpeg(cmd: List[str], owner: str, timeout: Optional[float] = None,
+                     pass_fds: Sequence[int] = ()) -> subprocess.CompletedProcess:
+    """Run ffmpeg once the global extraction scheduler grants a slot"""
+    try:
+        await extraction_scheduler.acquire(owner)
+    except BaseException:
+        for fd in pass_fds:
+            os.close(fd)
+        raise
+    try:
+        return await run_process(cmd, timeout=timeout, pass_fds=pass_fds)
+    finally:
+        extraction_scheduler.release()
+
+async def read_pipe(pipe) -> bytes:
+    """Read a pipe (an unbuffered file object) until EOF on the event loop"""
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+    )
+    try:
+        return await reader.read()
+    finally:
+        transport.close()
+
+async def extract_video_info_async(video_url: str) -> Dict:
+    """Run the yt-dlp extraction on a worker thread so the event loop stays free
+    
+    Concurrent extractions of the same video are coalesced into one.
+    """
+    loop = asyncio.get_event_loop()
+    video_id = extract_video_id(video_url) or video_url
+    
+    # Private, removed or region-blocked videos fail the same way every time
+    failure = negative_cache.get(("extract", video_id))
+    if failure:
+        raise yt_dlp.utils.DownloadError(failure)
+    
+    try:
+        return await single_flight.run(
+            ("extract", video_id),
+            lambda: asyncio.wait_for(
+                loop.run_in_executor(None, extract_video_info, video_url),
+                EXTRACTION_TIMEOUT
+            )
+        )
+    except yt_dlp.utils.DownloadError as e:
+        if is_permanent_extraction_error(e):
+            negative_cache.add(("extract", video_id), str(e))
+        raise
+
+async def get_video_info_cached(video_url: str, video_id: str) -> Dict:
+    """Per-video info from the index, falling back to yt-dlp for unseen videos"""
+    video_info = await fast_cache.get_video_info(video_id)
+    if video_info:
+        return video_info
+    
+    # Videos without a duration (e.g. live streams) are not indexed
+    if negative_cache.get(("duration", video_id)):
+        return {'title': 'Unknown', 'duration': 0, 'thumbnail': ''}
+    
+    # One extraction feeds both validation and stream selection
+    try:
+        info = await extract_video_info_async(video_url)
+    except Exception as e:
+        print(f"Failed to get video info: {e}")
+        return {'title': 'Unknown', 'duration': 0, 'thumbnail': ''}
+    
+    video_info = summarize_video_info(info)
+    streams = select_quality_streams(info)
+    if streams:
+        stream_cache.cache_streams(video_id, streams)
+        video_info['qualities'] = list(streams.keys())
+    
+    if video_info.get('duration'):
+        await fast_cache.store_video_info(video_id, video_info)
+    else:
+        negative_cache.add(("duration", video_id), "Could not retrieve video duration")
+    return video_info
+
+async def record_available_qualities(video_id: str, streams: Dict[str, Dict]) -> None:
+    """Remember which qualities a video offers so later lookups skip yt-dlp"""
+    video_info = await fast_cache.get_video_info(video_id)
+    if not video_info:
+        return
+    
+    qualities = list(streams.keys())
+    if video_info.get('qualities') != qualities:
+        await fast_cache.store_video_info(video_id, {**video_info, 'qualities': qualities})
+
 def extract_video_id(url: str) -> Optional[str]:
     """Extract YouTube video ID from various URL formats"""
     patterns = [
@@ -319,21 +1099,21 @@ def extract_timestamp(url: str) -> Dict[str, int]:
     
     return {"hours": 0, "minutes": 0, "seconds": 0}
 
-def get_multiple_quality_streams_cached(video_url: str) -> Dict[str, Dict]:
+async def get_multiple_quality_streams_cached(video_url: str) -> Dict[str, Dict]:
     """Cached version of stream extraction to avoid repeated yt-dlp calls"""
     video_id = extract_video_id(video_url)
 
     if video_id is None:
         raise ValueError("Invalid YouTube URL - cannot extract video ID. Make sure it is viewable.")
     
-    # Check cache first
-    cached_streams = stream_cache.get_streams(video_id)
+    # Check cache first (memory, then the persisted table)
+    cached_streams = await stream_cache.load_streams(video_id)
     if cached_streams:
         print(f"Using cached streams for {video_id}")
         return cached_streams
     
     # Get fresh streams
-    streams = get_multiple_quality_streams(video_url)
+    streams = await get_multiple_quality_streams(video_url)
     
     # Cache them
     if video_id and streams:
@@ -341,76 +1121,123 @@ def get_multiple_quality_streams_cached(video_url: str) -> Dict[str, Dict]:
     
     return streams
 
-def get_multiple_quality_streams(video_url: str) -> Dict[str, Dict]:
-    """Get multiple quality streams using yt-dlp"""
-    try:
-        base_cmd = [
-            'yt-dlp',
-            '--no-download',
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            '--add-header', 'Accept:text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            '--add-header', 'Accept-Language:en-US,en;q=0.5',
-            '--add-header', 'Accept-Encoding:gzip, deflate',
-            '--add-header', 'DNT:1',
-            '--add-header', 'Connection:keep-alive',
-            '--add-header', 'Upgrade-Insecure-Requests:1',
-            '--referer', 'https://www.youtube.com/',
-            '--socket-timeout', '30',
-            '--retries', '3',
-            '--fragment-retries', '3',
-            '--force-ipv4',
-            '--no-cache-dir'
-        ]
-        
-        cmd = base_cmd + ['--list-formats', '--format', 'best[ext=mp4]', video_url]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        
-        cmd_json = base_cmd + ['--dump-json', video_url]
-        json_result = subprocess.run(cmd_json, capture_output=True, text=True, check=True)
-        video_info = json.loads(json_result.stdout)
-        
-        formats = video_info.get('formats', [])
-        quality_streams = {}
-        
-        desired_qualities = [
-            {'name': 'Ultra (1080p)', 'key': 'ultra', 'height_min': 1080},
-            {'name': 'High (720p)', 'key': 'high', 'height_min': 720, 'height_max': 1079},
-            {'name': 'Medium (480p)', 'key': 'medium', 'height_min': 480, 'height_max': 719},
-            {'name': 'Low (360p)', 'key': 'low', 'height_min': 200, 'height_max': 479}
+async def refresh_streams(video_url: str, video_id: str) -> Dict[str, Dict]:
+    """Discard cached stream URLs and resolve fresh ones"""
+    print(f"Stream URL rejected for {video_id}, refreshing streams")
+    stream_cache.invalidate(video_id)
+    # Skip the persisted table too; it holds the same rejected URLs
+    streams = await get_multiple_quality_streams(video_url)
+    if streams:
+        stream_cache.cache_streams(video_id, streams)
+    return streams
+
+def is_permanent_extraction_error(error: Exception) -> bool:
+    """Whether yt-dlp failed because of the video itself rather than the network or YouTube's load"""
+    message = str(error).lower()
+    return any(marker in message for marker in PERMANENT_EXTRACTION_ERRORS)
+
+def is_permanent_ffmpeg_error(error: subprocess.CalledProcessError) -> bool:
+    """Whether ffmpeg failed on the stream's content rather than on fetching it"""
+    stderr = (error.stderr or b'').decode('utf-8', 'replace').lower()
+    return any(marker in stderr for marker in PERMANENT_FFMPEG_ERRORS)
+
+def is_forbidden(error: subprocess.CalledProcessError) -> bool:
+    """Whether ffmpeg failed because the stream URL returned 403"""
+    return b'403 Forbidden' in (error.stderr or b'')
+
+def extract_video_info(video_url: str) -> Dict:
+    """Run a single in-process yt-dlp extraction (no download)"""
+    with yt_dlp.YoutubeDL(YDL_OPTIONS) as ydl:
+        return ydl.extract_info(video_url, download=False) #type: ignore
+
+def summarize_video_info(info: Dict) -> Dict:
+    """Reduce a yt-dlp info dict to the fields kept in the video info index"""
+    return {
+        'title': info.get('title', 'Unknown'),
+        'duration': int(info.get('duration') or 0),
+        'thumbnail': info.get('thumbnail', ''),
+        'view_count': info.get('view_count', 0),
+        'upload_date': info.get('upload_date', ''),
+        'uploader': info.get('uploader', 'Unknown')
+    }
+
+def select_quality_streams(info: Dict) -> Dict[str, Dict]:
+    """Pick the best mp4 stream for each quality tier from a yt-dlp info dict"""
+    formats = info.get('formats', [])
+    quality_streams = {}
+    
+    desired_qualities = [
+        {'name': 'Ultra (1080p)', 'key': 'ultra', 'height_min': 1080},
+        {'name': 'High (720p)', 'key': 'high', 'height_min': 720, 'height_max': 1079},
+        {'name': 'Medium (480p)', 'key': 'medium', 'height_min': 480, 'height_max': 719},
+        {'name': 'Low (360p)', 'key': 'low', 'height_min': 200, 'height_max': 479}
+    ]
+    
+    for quality in desired_qualities:
+        suitable_formats = [
+            f for f in formats
+            if f.get('height') and 
+            f.get('url') and 
+            f.get('ext') == 'mp4' and
+            quality['height_min'] <= f['height'] <= quality.get('height_max', 9999)
         ]
         
-        for quality in desired_qualities:
-            suitable_formats = [
-                f for f in formats
-                if f.get('height') and 
-                f.get('url') and 
-                f.get('ext') == 'mp4' and
-                quality['height_min'] <= f['height'] <= quality.get('height_max', 9999)
-            ]
-            
-            if suitable_formats:
-                best_format = max(suitable_formats, key=lambda x: (x.get('height', 0), x.get('tbr', 0)))
-                quality_streams[quality['key']] = {
-                    'url': best_format['url'],
-                    'height': best_format.get('height'),
-                    'name': quality['name'],
-                    'format_id': best_format.get('format_id'),
-                    'filesize': best_format.get('filesize')
-                }
-        
-        return quality_streams
-        
-    except subprocess.CalledProcessError as e:
+        if suitable_formats:
+            best_format = max(suitable_formats, key=lambda x: (x.get('height', 0), x.get('tbr') or 0))
+            quality_streams[quality['key']] = {
+                'url': best_format['url'],
+                'height': best_format.get('height'),
+                'name': quality['name'],
+                'format_id': best_format.get('format_id'),
+                'filesize': best_format.get('filesize')
+            }
+    
+    return quality_streams
+
+async def get_multiple_quality_streams(video_url: str) -> Dict[str, Dict]:
+    """Get multiple quality streams using yt-dlp"""
+    try:
+        return select_quality_streams(await extract_video_info_async(video_url))
+    except yt_dlp.utils.DownloadError as e:
         raise Exception(f"Failed to get stream URLs: {e}")
-    except json.JSONDecodeError as e:
-        raise Exception(f"Failed to parse video info: {e}")
 
-def generate_screenshot(stream_url: str, timestamp: int, video_id: str, quality: str) -> Optional[Dict]:
+def screenshot_info(video_id: str, timestamp: int, quality: str, image_data: bytes) -> Dict:
+    """Metadata for a generated screenshot; filename is the cache-backed name served by /preview and /download"""
+    filename = f"{video_id}_{timestamp}_{quality}.png"
+    return {
+        'quality': quality,
+        'filename': filename,
+        'size_kb': round(len(image_data) / 1024, 1),
+        'download_url': f'/download/{filename}'
+    }
+
+def split_png_stream(data: bytes) -> List[bytes]:
+    """Split concatenated PNG images (ffmpeg image2pipe output) into individual images"""
+    images = []
+    position = 0
+    while data.startswith(PNG_SIGNATURE, position):
+        cursor = position + len(PNG_SIGNATURE)
+        while cursor + 8 <= len(data):
+            length = int.from_bytes(data[cursor:cursor + 4], 'big')
+            chunk_type = data[cursor + 4:cursor + 8]
+            cursor += 12 + length  # length + type + data + crc
+            if chunk_type == b'IEND':
+                break
+        else:
+            break  # Truncated image
+        images.append(data[position:cursor])
+        position = cursor
+    return images
+
+async def generate_screenshot(stream_url: str, timestamp: int, video_id: str, quality: str) -> Optional[Tuple[Dict, bytes]]:
     """Single screenshot generation with precise seeking - 3.8x faster"""
+    failure = negative_cache.get(("ffmpeg", video_id, timestamp, quality))
+    if failure:
+        print(f"Skipping {quality} screenshot at {timestamp}s (failed recently: {failure})")
+        return None
+    
     try:
-        output_file = f"{video_id}_{timestamp}_{quality}.png"
-        
-        # FFmpeg command with precise seeking
+        # FFmpeg command with precise seeking, PNG written to stdout
         cmd = [
             'ffmpeg',
             '-ss', str(timestamp),    
@@ -418,119 +1245,270 @@ def generate_screenshot(stream_url: str, timestamp: int, video_id: str, quality:
             '-frames:v', '1',        # Extract exactly 1 frame
             '-q:v', '2',             # High quality encoding
             '-an',                   # Disable audio processing (saves time)
-            '-y',                    # Overwrite
-            '--',  
-            f'{output_file}'
+            '-f', 'image2pipe',
+            '-c:v', 'png',
+            'pipe:1'
         ]
         
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        result = await run_ffmpeg(cmd, video_id, timeout=FFMPEG_TIMEOUT)
+        if not result.stdout:
+            print(f"Failed to generate {quality} screenshot: no frame decoded")
+            negative_cache.add(("ffmpeg", video_id, timestamp, quality), "no frame decoded")
+            return None
         
-        file_size = os.path.getsize(output_file) if os.path.exists(output_file) else 0
-        
-        return {
-            'quality': quality,
-            'filename': output_file,
-            'size_kb': round(file_size / 1024, 1),
-            'download_url': f'/download/{output_file}'
-        }
+        return screenshot_info(video_id, timestamp, quality, result.stdout), result.stdout
         
     except subprocess.CalledProcessError as e:
+        if is_forbidden(e):
+            raise StreamExpiredError(f"{quality} stream returned 403 Forbidden")
         print(f"Failed to generate {quality} screenshot: {e}")
+        if is_permanent_ffmpeg_error(e):
+            negative_cache.add(("ffmpeg", video_id, timestamp, quality), f"ffmpeg exited with status {e.returncode}")
+        return None
+    except subprocess.TimeoutExpired as e:
+        print(f"Timed out generating {quality} screenshot: {e}")
         return None
 
-async def generate_screenshots_parallel(streams: Dict, timestamp: int, video_id: str) -> List[Dict]:
+async def generate_screenshots_parallel(streams: Dict, timestamp: int, video_id: str) -> List[Tuple[Dict, bytes]]:
     """Generate all screenshots in parallel"""
     
-    def generate_single_screenshot(quality_data) -> Optional[Dict]:
-        """Wrapper function for thread pool execution"""
-        quality_key, stream_info = quality_data
-        result = generate_screenshot(
+    async def generate_single_screenshot(quality_key: str, stream_info: Dict) -> Optional[Tuple[Dict, bytes]]:
+        """Generate one quality and attach its stream details"""
+        result = await generate_screenshot(
             stream_info['url'], 
             timestamp, 
             video_id, 
             quality_key
         )
         if result:
-            result['name'] = stream_info['name']
-            result['source_height'] = stream_info.get('height', 'Unknown')
+            result[0]['name'] = stream_info['name']
+            result[0]['source_height'] = stream_info.get('height', 'Unknown')
         return result
     
-
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        loop = asyncio.get_event_loop()
-        tasks = [
-            loop.run_in_executor(executor, generate_single_screenshot, (k, v))
-            for k, v in streams.items()
-        ]
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+    tasks = [
+        generate_single_screenshot(k, v)
+        for k, v in streams.items()
+    ]
+    
+    results = await asyncio.gather(*tasks, return_exceptions=True)
     
     # Filter out None results and exceptions
     screenshots = [r for r in results if r and not isinstance(r, Exception)]
+    
+    # Expired stream URLs are retried by the caller with fresh streams
+    expired = [quality for quality, r in zip(streams, results) if isinstance(r, StreamExpiredError)]
+    if expired:
+        raise StreamExpiredError(f"{', '.join(expired)} streams returned 403 Forbidden", screenshots, expired)
 
     return screenshots #type: ignore
 
-async def check_cache_parallel(video_id: str, timestamp: int) -> Optional[List[Dict]]:
-    """Check cache for all qualities in parallel"""
-    qualities = ['ultra', 'high', 'medium', 'low']
+async def generate_screenshots_single_pass(streams: Dict, timestamp: int, video_id: str) -> List[Tuple[Dict, bytes]]:
+    """Decode the highest stream once and scale it to every quality via split + scale"""
+    streams = {
+        quality: stream for quality, stream in streams.items()
+        if not negative_cache.get(("ffmpeg", video_id, timestamp, quality))
+    }
+    if not streams:
+        return []
+    source_key = max(streams, key=lambda k: streams[k].get('height') or 0)
+    source_url = streams[source_key]['url']
+    source_height = streams[source_key].get('height') or 0
+    qualities = list(streams.keys())
     
-    # First, check if we have cached metadata (fastest)
-    cached_metadata = await fast_cache.get_cached_metadata(video_id, timestamp)
-    if cached_metadata:
-        # Verify that the actual images are still available
-        cache_tasks = [
-            fast_cache.get_screenshot(video_id, timestamp, quality)
-            for quality in qualities
-        ]
-        
-        cached_images = await asyncio.gather(*cache_tasks)
-        
-        # If all images are available, return the metadata
-        if all(img is not None for img in cached_images):
-            print(f"Complete cache hit for {video_id} at {timestamp}s")
-            return cached_metadata
+    # One split branch per quality; the source quality is passed through unscaled
+    filters = [f"[0:v]split={len(qualities)}" + "".join(f"[s{i}]" for i in range(len(qualities)))]
+    outputs = []
+    for i, quality in enumerate(qualities):
+        height = streams[quality].get('height') or source_height
+        if quality == source_key or not height or height >= source_height:
+            outputs.append(f"[s{i}]")
         else:
-            print(f"Partial cache hit for {video_id} at {timestamp}s - some images missing")
+            filters.append(f"[s{i}]scale=-2:{height}:flags=lanczos[o{i}]")
+            outputs.append(f"[o{i}]")
     
-    return None
+    # Each quality gets its own pipe so the images never touch the filesystem
+    pipes = [os.pipe() for _ in qualities]
+    cmd = [
+        'ffmpeg',
+        '-ss', str(timestamp),
+        '-i', f'{source_url}',
+        '-filter_complex', ';'.join(filters),
+        '-an'
+    ]
+    for label, (_, write_fd) in zip(outputs, pipes):
+        cmd += ['-map', label, '-frames:v', '1', '-q:v', '2', '-f', 'image2pipe', '-c:v', 'png', f'pipe:{write_fd}']
+    
+    read_pipes = [os.fdopen(read_fd, 'rb', 0) for read_fd, _ in pipes]
+    readers = [asyncio.create_task(read_pipe(pipe)) for pipe in read_pipes]
+    failure = None
+    try:
+        await run_ffmpeg(cmd, video_id, timeout=FFMPEG_TIMEOUT, pass_fds=[write_fd for _, write_fd in pipes])
+        images = await asyncio.gather(*readers)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        failure = e
+    finally:
+        # Also on cancellation: a reader cancelled before it started never closes its pipe
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        for pipe in read_pipes:
+            pipe.close()
+    
+    if failure is not None:
+        if isinstance(failure, subprocess.CalledProcessError) and is_forbidden(failure):
+            raise StreamExpiredError(f"{source_key} stream returned 403 Forbidden", [], qualities)
+        print(f"Single-pass extraction failed, falling back to per-stream: {failure}")
+        return await generate_screenshots_parallel(streams, timestamp, video_id)
+    
+    screenshots = []
+    for quality, image_data in zip(qualities, images):
+        if not image_data:
+            negative_cache.add(("ffmpeg", video_id, timestamp, quality), "no frame decoded")
+            continue
+        info = screenshot_info(video_id, timestamp, quality, image_data)
+        info['name'] = streams[quality]['name']
+        info['source_height'] = streams[quality].get('height', 'Unknown')
+        screenshots.append((info, image_data))
+    
+    return screenshots
 
-def get_video_info_with_api(video_url: str) -> dict:
-    """Get video metadata using yt-dlp"""
+def group_batch_timestamps(timestamps: List[int]) -> List[List[int]]:
+    """Sort timestamps and split them into runs that are cheaper to decode through than to re-seek"""
+    runs: List[List[int]] = []
+    for timestamp in sorted(set(timestamps)):
+        if runs and timestamp - runs[-1][-1] <= BATCH_MAX_GAP:
+            runs[-1].append(timestamp)
+        else:
+            runs.append([timestamp])
+    return runs
+
+async def generate_screenshot_run(stream_url: str, run: List[int], video_id: str, quality: str) -> Dict[int, Tuple[Dict, bytes]]:
+    """Extract a sorted run of timestamps in one ffmpeg session
+    
+    The input is seeked once to the first timestamp; with -copyts the select
+    filter keeps the first frame at or after every later timestamp.
+    """
+    select = "+".join(
+        ["isnan(prev_t)"] + [f"gte(t\\,{ts})*lt(prev_t\\,{ts})" for ts in run[1:]]
+    )
+    cmd = [
+        'ffmpeg',
+        '-ss', str(run[0]),
+        '-copyts',
+        '-i', f'{stream_url}',
+        '-vf', f"select='{select}'",
+        '-fps_mode', 'passthrough',
+        '-frames:v', str(len(run)),
+        '-q:v', '2',
+        '-an',
+        '-f', 'image2pipe',
+        '-c:v', 'png',
+        'pipe:1'
+    ]
+    
+    # A clean exit with fewer frames means the rest are past the end of the video
+    permanent = True
     try:
-        cmd = [
-            'yt-dlp',
-            '--no-download',
-            '--dump-json',
-            '--user-agent', 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/139.0.0.0 Safari/537.36',
-            '--add-header', 'Accept:text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            '--add-header', 'Accept-Language:en-US,en;q=0.5',
-            '--add-header', 'Accept-Encoding:gzip, deflate',
-            '--add-header', 'DNT:1',
-            '--add-header', 'Connection:keep-alive',
-            '--add-header', 'Upgrade-Insecure-Requests:1',
-            '--referer', 'https://www.youtube.com/',
-            '--socket-timeout', '30',
-            '--retries', '3',
-            '--fragment-retries', '3',
-            '--force-ipv4',
-            '--no-cache-dir',
-            video_url
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        video_info = json.loads(result.stdout)
-        
-        return {
-            'title': video_info.get('title', 'Unknown'),
-            'duration': video_info.get('duration', 0),
-            'thumbnail': video_info.get('thumbnail', ''),
-            'view_count': video_info.get('view_count', 0),
-            'upload_date': video_info.get('upload_date', ''),
-            'uploader': video_info.get('uploader', 'Unknown')
-        }
-    except Exception as e:
-        print(f"Failed to get video info: {e}")
-        return {'title': 'Unknown', 'duration': 0, 'thumbnail': ''}
+        timeout = min(FFMPEG_TIMEOUT + BATCH_MAX_GAP * len(run), BATCH_RUN_TIMEOUT)
+        result = await run_ffmpeg(cmd, video_id, timeout=timeout)
+        output = result.stdout
+    except subprocess.CalledProcessError as e:
+        if is_forbidden(e):
+            raise StreamExpiredError(f"{quality} stream returned 403 Forbidden")
+        print(f"Failed to extract batch run at {run[0]}s ({len(run)} frames): {e}")
+        output = e.stdout or b''
+        permanent = is_permanent_ffmpeg_error(e)
+    except subprocess.TimeoutExpired as e:
+        print(f"Timed out extracting batch run at {run[0]}s ({len(run)} frames): {e}")
+        return {}
+    
+    # Frames come out in timestamp order
+    images = split_png_stream(output)
+    if permanent:
+        for timestamp in run[len(images):]:
+            negative_cache.add(("ffmpeg", video_id, timestamp, quality), "no frame decoded")
+    return {
+        timestamp: (screenshot_info(video_id, timestamp, quality, image_data), image_data)
+        for timestamp, image_data in zip(run, images)
+    }
+
+async def generate_screenshots_batch(stream_url: str, timestamps: List[int], video_id: str, quality: str) -> Dict[int, Tuple[Dict, bytes]]:
+    """Extract many timestamps of one stream, one ffmpeg session per run of nearby timestamps"""
+    timestamps = [
+        timestamp for timestamp in timestamps
+        if not negative_cache.get(("ffmpeg", video_id, timestamp, quality))
+    ]
+    runs = group_batch_timestamps(timestamps)
+    results = await asyncio.gather(
+        *(generate_screenshot_run(stream_url, run, video_id, quality) for run in runs),
+        return_exceptions=True
+    )
+    
+    screenshots = {}
+    expired = []
+    for run, result in zip(runs, results):
+        if isinstance(result, StreamExpiredError):
+            expired += run
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            screenshots.update(result)
+    
+    # Runs that got 403 are retried by the caller with a fresh URL
+    if expired:
+        raise StreamExpiredError(f"{quality} stream returned 403 Forbidden", screenshots, expired)
+    return screenshots
+
+async def generate_screenshots(streams: Dict, timestamp: int, video_id: str) -> List[Tuple[Dict, bytes]]:
+    """Generate screenshots for every stream using the configured extraction mode"""
+    if EXTRACTION_MODE == "single_pass" and len(streams) > 1:
+        return await generate_screenshots_single_pass(streams, timestamp, video_id)
+    return await generate_screenshots_parallel(streams, timestamp, video_id)
+
+async def expected_qualities(video_id: str, cached_metadata: List[Dict]) -> List[str]:
+    """Qualities a complete cache entry should have for this video
+    
+    The video info index records which qualities the video actually offers;
+    without it, the qualities listed in the timestamp's metadata are used.
+    """
+    video_info = await fast_cache.get_video_info(video_id)
+    if video_info and video_info.get('qualities'):
+        return video_info['qualities']
+    return [screenshot['quality'] for screenshot in cached_metadata]
+
+async def check_cache_parallel(video_id: str, timestamp: int) -> Tuple[Optional[List[Dict]], Optional[List[str]]]:
+    """Check cache for all qualities in parallel
+    
+    Returns the cached metadata entries whose images are still present and the
+    qualities that need regenerating; (None, None) when nothing is cached.
+    """
+    # First, check if we have cached metadata (fastest)
+    cached_metadata = await fast_cache.get_cached_metadata(video_id, timestamp)
+    if not cached_metadata:
+        return None, None
+    
+    # Completeness is judged against the qualities this video offers, so
+    # a video without 1080p is not a permanent miss
+    qualities = await expected_qualities(video_id, cached_metadata)
+    
+    # Verify that the actual images are still available (metadata-only lookup)
+    presence = await fast_cache.has_screenshots(video_id, timestamp, qualities)
+    
+    present = [screenshot for screenshot in cached_metadata if presence.get(screenshot['quality'])]
+    missing = [quality for quality in qualities if not presence[quality]]
+    
+    # A quality whose extraction failed recently would only fail again: serve
+    # the rest as a hit instead of resolving streams and charging for it
+    failed = [quality for quality in missing if negative_cache.get(("ffmpeg", video_id, timestamp, quality))]
+    if present and failed:
+        print(f"Skipping {', '.join(failed)} for {video_id} at {timestamp}s (failed recently)")
+        missing = [quality for quality in missing if quality not in failed]
+    
+    if missing:
+        print(f"Partial cache hit for {video_id} at {timestamp}s - missing {', '.join(missing)}")
+    else:
+        print(f"Complete cache hit for {video_id} at {timestamp}s")
+    return present, missing
 
 # FastAPI Routes with rate limiting middleware
 @app.middleware("http")
@@ -538,11 +1516,14 @@ async def rate_limit_middleware(request: Request, call_next):
     """Rate limiting middleware"""
     client_ip = request.client.host #type: ignore
     
-    if request.url.path.startswith('/api/') and not rate_limit_check(client_ip):
-        return JSONResponse(
-            status_code=429,
-            content={"detail": "Rate limit exceeded. Try again later."}
-        )
+    if request.url.path.startswith('/api/'):
+        allowed, retry_after = rate_limit_check(client_ip)
+        if not allowed:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "Rate limit exceeded. Try again later."},
+                headers={"Retry-After": str(int(retry_after) + 1)}
+            )
     
     response = await call_next(request)
     return response
@@ -1036,7 +2017,7 @@ async def home() -> str:
     return html
 
 @app.post("/api/screenshots")
-async def create_screenshots(request: VideoRequest):
+async def create_screenshots(request: VideoRequest, http_request: Request):
     """Generate multiple quality screenshots using optimized parallel processing"""
     video_id = extract_video_id(request.url)
     if not video_id:
@@ -1045,15 +2026,16 @@ async def create_screenshots(request: VideoRequest):
     timestamp = request.hours * 3600 + request.minutes * 60 + request.seconds
     start_time = time.time()
     
+    failure = negative_cache.get(("timestamp", video_id, timestamp))
+    if failure:
+        raise HTTPException(status_code=400, detail=failure)
+    
     try:
-        validation = validate_timestamp(request.url, request.hours, request.minutes, request.seconds)
-        if not validation["valid"]:
-            raise HTTPException(status_code=400, detail=validation["message"])
-        
-        # Check cache first (parallel lookup for all qualities)
+        # Check cache first (parallel lookup for all qualities). A cached
+        # screenshot implies the timestamp was validated when it was generated.
         print(f"Checking cache for {video_id} at {timestamp}s")
-        cached_screenshots = await check_cache_parallel(video_id, timestamp)
-        if cached_screenshots:
+        cached_screenshots, missing = await check_cache_parallel(video_id, timestamp)
+        if cached_screenshots and not missing:
             processing_time = time.time() - start_time
             print(f"Cache HIT for {video_id} at {timestamp}s - returning in {processing_time:.3f}s")
             return JSONResponse(content={
@@ -1064,32 +2046,18 @@ async def create_screenshots(request: VideoRequest):
                 "cached": True,
                 "processing_time": round(processing_time, 3)
             })
+        elif cached_screenshots:
+            print(f"Partial cache HIT for {video_id} at {timestamp}s - generating {', '.join(missing or [])}")
         else:
             print(f"Cache MISS for {video_id} at {timestamp}s - generating new screenshots")
+        charge_cold_extraction(http_request)
         
-        # Get streams (with caching)
-        streams = get_multiple_quality_streams_cached(request.url)
-        if not streams:
-            raise HTTPException(status_code=404, detail="No streams found")
-        
-        # Generate screenshots in parallel
-        screenshots = await generate_screenshots_parallel(streams, timestamp, video_id)
-        
-        if not screenshots:
-            raise HTTPException(status_code=500, detail="Failed to generate screenshots")
-        
-        # Cache screenshots in background
-        cache_tasks = []
-        for screenshot in screenshots:
-            if os.path.exists(screenshot['filename']):
-                cache_task = asyncio.create_task(
-                    cache_screenshot_background(video_id, timestamp, screenshot)
-                )
-                cache_tasks.append(cache_task)
-        
-        # Cache metadata
-        await fast_cache.store_metadata(video_id, timestamp, screenshots)
-        print(f"Cached {len(screenshots)} screenshots for {video_id} at {timestamp}s")
+        # Identical concurrent misses share a single extraction; partial hits
+        # only regenerate the missing qualities
+        screenshots = await single_flight.run(
+            ("screenshots", video_id, timestamp, tuple(missing) if missing else "all"),
+            lambda: generate_and_cache_screenshots(request, video_id, timestamp, missing, cached_screenshots or [])
+        )
         
         processing_time = time.time() - start_time
         
@@ -1102,26 +2070,81 @@ async def create_screenshots(request: VideoRequest):
             "processing_time": round(processing_time, 2)
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def cache_screenshot_background(video_id: str, timestamp: int, screenshot: Dict):
-    """Background caching of individual screenshots with cleanup"""
+async def generate_and_cache_screenshots(request: VideoRequest, video_id: str, timestamp: int,
+                                         qualities: Optional[List[str]] = None,
+                                         cached_screenshots: List[Dict] = []) -> List[Dict]:
+    """Validate, extract and cache the given qualities (all when None) for one timestamp
+    
+    Newly generated screenshots are merged with cached_screenshots before the
+    metadata is stored.
+    """
+    # Previously seen videos are validated from the info index; a partial hit
+    # was validated when its cached images were generated
+    if not cached_screenshots:
+        video_info = await get_video_info_cached(request.url, video_id)
+        validation = validate_timestamp(video_info, request.hours, request.minutes, request.seconds)
+        if not validation["valid"]:
+            if video_info.get('duration'):
+                negative_cache.add(("timestamp", video_id, timestamp), validation["message"])
+            raise HTTPException(status_code=400, detail=validation["message"])
+    
+    # Get streams (with caching)
+    streams = await get_multiple_quality_streams_cached(request.url)
+    if not streams:
+        raise HTTPException(status_code=404, detail="No streams found")
+    await record_available_qualities(video_id, streams)
+    
+    if qualities is not None:
+        streams = {quality: stream for quality, stream in streams.items() if quality in qualities}
+    
+    # Generate screenshots using the configured extraction mode, retrying once
+    # with fresh URLs the qualities whose signed ones were rejected
     try:
-        if os.path.exists(screenshot['filename']):
-            with open(screenshot['filename'], 'rb') as f:
-                image_data = f.read()
-                await fast_cache.store_screenshot(video_id, timestamp, screenshot['quality'], image_data)
-            
-            # Clean up the working directory file after caching
-            try:
-                os.remove(screenshot['filename'])
-                print(f"Cleaned up working directory file: {screenshot['filename']}")
-            except Exception as cleanup_error:
-                print(f"Warning: Failed to clean up {screenshot['filename']}: {cleanup_error}")
-                
-    except Exception as e:
-        print(f"Background cache error for {screenshot['quality']}: {e}")
+        screenshots = await generate_screenshots(streams, timestamp, video_id) if streams else []
+    except StreamExpiredError as e:
+        fresh = await refresh_streams(request.url, video_id)
+        screenshots = e.completed
+        streams = {quality: stream for quality, stream in fresh.items() if quality in e.expired}
+        if streams:
+            screenshots += await generate_screenshots(streams, timestamp, video_id)
+    
+    if not screenshots and not cached_screenshots:
+        raise HTTPException(status_code=500, detail="Failed to generate screenshots")
+    
+    # Hand images straight to the cache (backend writes happen in background)
+    for screenshot, image_data in screenshots:
+        await fast_cache.store_screenshot(video_id, timestamp, screenshot['quality'], image_data, persist=not BUNDLE_CACHE)
+    generated = [screenshot for screenshot, _ in screenshots]
+    images = {screenshot['quality']: image_data for screenshot, image_data in screenshots}
+    
+    # Merge with the still-cached qualities, best quality first
+    merged = {screenshot['quality']: screenshot for screenshot in cached_screenshots}
+    merged.update({screenshot['quality']: screenshot for screenshot in generated})
+    screenshots = sorted(merged.values(), key=lambda s: QUALITY_ORDER.index(s['quality']))
+    
+    # The bundle replaces the per-quality objects and the metadata object
+    if BUNDLE_CACHE:
+        for screenshot in cached_screenshots:
+            if screenshot['quality'] not in images:
+                image_data = await fast_cache.get_screenshot(video_id, timestamp, screenshot['quality'])
+                if image_data:
+                    images[screenshot['quality']] = image_data
+        bundled = [screenshot for screenshot in screenshots if screenshot['quality'] in images]
+        await fast_cache.store_bundle(video_id, timestamp, bundled, images)
+    
+    # Cache metadata
+    await fast_cache.store_metadata(video_id, timestamp, screenshots, persist=not BUNDLE_CACHE)
+    if cached_screenshots:
+        print(f"Filled {len(generated)} missing screenshots for {video_id} at {timestamp}s")
+    else:
+        print(f"Cached {len(screenshots)} screenshots for {video_id} at {timestamp}s")
+    
+    return screenshots
 
 async def cache_metadata_background(video_id: str, timestamp: int, screenshots: List[Dict]):
     """Background caching of metadata"""
@@ -1130,8 +2153,109 @@ async def cache_metadata_background(video_id: str, timestamp: int, screenshots:
     except Exception as e:
         print(f"Background metadata cache error: {e}")
     
+@app.post("/api/screenshots/batch")
+async def create_screenshots_batch(request: BatchVideoRequest, http_request: Request):
+    """Extract one quality at many timestamps of a single video"""
+    video_id = extract_video_id(request.url)
+    if not video_id:
+        raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+    
+    timestamps = sorted(set(request.timestamps))
+    if not timestamps:
+        raise HTTPException(status_code=400, detail="No timestamps given")
+    if len(timestamps) > BATCH_MAX_TIMESTAMPS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_TIMESTAMPS} timestamps per batch")
+    if timestamps[0] < 0:
+        raise HTTPException(status_code=400, detail="Timestamps must not be negative")
+    
+    start_time = time.time()
+    
+    try:
+        # Serve whatever is already cached under the per-timestamp keys; only
+        # presence is checked, the images are fetched through their download_url
+        cached = await asyncio.gather(*(
+            fast_cache.has_screenshots(video_id, timestamp, [request.quality])
+            for timestamp in timestamps
+        ))
+        screenshots = {}
+        for timestamp, presence in zip(timestamps, cached):
+            if presence[request.quality]:
+                filename = f"{video_id}_{timestamp}_{request.quality}.png"
+                screenshots[timestamp] = {
+                    'timestamp': timestamp,
+                    'quality': request.quality,
+                    'filename': filename,
+                    'download_url': f'/download/{filename}',
+                    'cached': True
+                }
+        
+        missing = [timestamp for timestamp in timestamps if timestamp not in screenshots]
+        invalid = []
+        if missing:
+            video_info = await get_video_info_cached(request.url, video_id)
+            duration = video_info.get('duration', 0)
+            if not duration:
+                raise HTTPException(status_code=400, detail="Could not retrieve video duration")
+            invalid = [timestamp for timestamp in missing if timestamp >= duration]
+            missing = [timestamp for timestamp in missing if timestamp < duration]
+        
+        if missing:
+            charge_cold_extraction(http_request, len(group_batch_timestamps(missing)))
+            generated = await single_flight.run(
+                ("batch", video_id, tuple(missing), request.quality),
+                lambda: generate_and_cache_batch(request.url, video_id, missing, request.quality)
+            )
+            for timestamp, screenshot in generated.items():
+                screenshots[timestamp] = {**screenshot, 'cached': False}
+        
+        processing_time = time.time() - start_time
+        
+        return JSONResponse(content={
+            "success": True,
+            "video_id": video_id,
+            "quality": request.quality,
+            "screenshots": [screenshots[timestamp] for timestamp in timestamps if timestamp in screenshots],
+            "invalid_timestamps": invalid,
+            "failed_timestamps": [t for t in missing if t not in screenshots],
+            "processing_time": round(processing_time, 2)
+        })
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def generate_and_cache_batch(url: str, video_id: str, timestamps: List[int], quality: str) -> Dict[int, Dict]:
+    """Extract a batch of timestamps and cache each frame under its per-timestamp key"""
+    streams = await get_multiple_quality_streams_cached(url)
+    await record_available_qualities(video_id, streams)
+    if quality not in streams:
+        available = ", ".join(streams.keys())
+        raise HTTPException(status_code=400, detail=f"Quality '{quality}' not available. Options: {available}")
+    
+    try:
+        screenshots = await generate_screenshots_batch(streams[quality]['url'], timestamps, video_id, quality)
+    except StreamExpiredError as e:
+        streams = await refresh_streams(url, video_id)
+        if quality not in streams:
+            raise HTTPException(status_code=404, detail=f"Quality '{quality}' no longer available")
+        screenshots = e.completed
+        screenshots.update(await generate_screenshots_batch(streams[quality]['url'], e.expired, video_id, quality))
+    
+    results = {}
+    for timestamp, (screenshot, image_data) in screenshots.items():
+        screenshot['timestamp'] = timestamp
+        screenshot['name'] = streams[quality]['name']
+        screenshot['source_height'] = streams[quality].get('height', 'Unknown')
+        await fast_cache.store_screenshot(video_id, timestamp, quality, image_data)
+        results[timestamp] = screenshot
+    
+    print(f"Batch extracted {len(results)}/{len(timestamps)} frames for {video_id} ({quality})")
+    return results
+
 @app.get("/api/cli/screenshot")
 async def cli_screenshot(
+    http_request: Request,
     url: str,
     timestamp: int = 0,
     quality: str = "high",
@@ -1148,33 +2272,53 @@ async def cli_screenshot(
         if cached_image:
             return Response(content=cached_image, media_type="image/png")
         
-        # Generate screenshot
-        streams = get_multiple_quality_streams_cached(url)
-        if quality not in streams:
-            available = ", ".join(streams.keys())
-            raise HTTPException(status_code=400, detail=f"Quality '{quality}' not available. Options: {available}")
-
-        # Generate single screenshot
-        screenshot = generate_screenshot(
-            streams[quality]['url'],
-            timestamp,
-            video_id,
-            quality
+        # Identical concurrent misses share a single extraction
+        charge_cold_extraction(http_request)
+        image_data = await single_flight.run(
+            ("cli", video_id, timestamp, quality),
+            lambda: generate_and_cache_single(url, video_id, timestamp, quality)
         )
         
-        if not screenshot or not os.path.exists(screenshot['filename']):
-            raise HTTPException(status_code=500, detail="Screenshot generation failed")
-        
-        # Cache and return
-        with open(screenshot['filename'], 'rb') as f:
-            image_data = f.read()
-            await fast_cache.store_screenshot(video_id, timestamp, quality, image_data)
-        
         return Response(content=image_data, media_type="image/png")
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def generate_and_cache_single(url: str, video_id: str, timestamp: int, quality: str) -> bytes:
+    """Extract and cache a single quality for one timestamp"""
+    # Reject qualities the video is known not to offer without running yt-dlp
+    video_info = await fast_cache.get_video_info(video_id)
+    if video_info and video_info.get('qualities') and quality not in video_info['qualities']:
+        available = ", ".join(video_info['qualities'])
+        raise HTTPException(status_code=400, detail=f"Quality '{quality}' not available. Options: {available}")
+    
+    # Generate screenshot
+    streams = await get_multiple_quality_streams_cached(url)
+    await record_available_qualities(video_id, streams)
+    if quality not in streams:
+        available = ", ".join(streams.keys())
+        raise HTTPException(status_code=400, detail=f"Quality '{quality}' not available. Options: {available}")
+
+    # Generate single screenshot
+    try:
+        screenshot = await generate_screenshot(streams[quality]['url'], timestamp, video_id, quality)
+    except StreamExpiredError:
+        streams = await refresh_streams(url, video_id)
+        if quality not in streams:
+            raise HTTPException(status_code=404, detail=f"Quality '{quality}' no longer available")
+        screenshot = await generate_screenshot(streams[quality]['url'], timestamp, video_id, quality)
+    
+    if not screenshot:
+        raise HTTPException(status_code=500, detail="Screenshot generation failed")
+    
+    # Cache and return
+    _, image_data = screenshot
+    await fast_cache.store_screenshot(video_id, timestamp, quality, image_data)
+    
+    return image_data
+
 @app.get("/api/thumbnails/{video_id}")
 async def get_thumbnails(video_id: str):
     """Get YouTube thumbnail URLs with availability checking"""
@@ -1195,7 +2339,7 @@ async def get_thumbnails(video_id: str):
 
 @app.get("/preview/{filename}")
 async def preview_screenshot(filename: str):
-    """Serve screenshot preview from cache or working directory"""
+    """Serve screenshot preview from cache"""
     
     # Parse filename to get video_id, timestamp, quality
     if filename.startswith("screenshot_"):
@@ -1213,18 +2357,12 @@ async def preview_screenshot(filename: str):
         if image_data:
             return Response(content=image_data, media_type="image/png")
     
-    # Fallback to working directory file (for recently generated screenshots)
-    working_dir_files = [filename, f"screenshot_{filename}"]
-    for potential_file in working_dir_files:
-        if os.path.exists(potential_file):
-            return FileResponse(potential_file, media_type="image/png")
-    
     raise HTTPException(status_code=404, detail="Screenshot not found")
 
 
 @app.get("/download/{filename}")
 async def download_screenshot(filename: str):
-    """Serve screenshot download from cache or working directory"""
+    """Serve screenshot download from cache"""
     
     # Remove screenshot_ prefix if present
     if filename.startswith("screenshot_"):
@@ -1246,16 +2384,6 @@ async def download_screenshot(filename: str):
                 headers={"Content-Disposition": f"attachment; filename={filename}"}
             )
     
-    # Fallback to working directory file (for recently generated screenshots)
-    working_dir_files = [filename, f"screenshot_{filename}"]
-    for potential_file in working_dir_files:
-        if os.path.exists(potential_file):
-            return FileResponse(
-                potential_file, 
-                media_type="image/png",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
-    
     raise HTTPException(status_code=404, detail="Screenshot not found")
 
 
@@ -1266,8 +2394,9 @@ async def health_check():
     """Health check endpoint with cache stats"""
     return {
         "status": "healthy", 
-        "rate_limit": f"Max {RATE_LIMIT} requests per minute",
+        "rate_limit": f"Bursts of {RATE_LIMIT} requests, refilled over {RATE_WINDOW}s; cold extractions cost {RATE_LIMIT_EXTRACTION_COST:g}",
         "cache_stats": fast_cache.cache_stats,
+        "extraction_scheduler": extraction_scheduler.snapshot(),
         "optimizations": [ 
             "Multi-level Caching", 
             "Optimized FFmpeg Seeking",
@@ -1285,7 +2414,27 @@ async def get_cache_stats():
         "cache_stats": fast_cache.cache_stats,
         "hit_rate_percentage": round(hit_rate, 2),
         "memory_cache_size": len(fast_cache.memory_cache),
-        "stream_cache_size": len(stream_cache.cache)
+        "memory_cache_bytes": fast_cache.memory_bytes,
+        "memory_cache_max_bytes": fast_cache.max_memory_bytes,
+        "video_info_index_size": len(fast_cache.video_info_cache),
+        "stream_cache_size": len(stream_cache.cache),
+        "coalesced_requests": single_flight.stats["coalesced"],
+        "in_flight_jobs": len(single_flight.in_flight),
+        "negative_cache": negative_cache.snapshot(),
+        "write_queue": fast_cache.write_queue.snapshot(),
+        "rate_limiter": rate_limiter.snapshot(),
+        "extraction_scheduler": extraction_scheduler.snapshot(),
+        "backend_lookup_latency": cache_backend.lookup_latency.snapshot(),
+        "tiers": {
+            "memory": {
+                "hits": fast_cache.cache_stats["memory_hits"],
+                "misses": total_requests - fast_cache.cache_stats["memory_hits"],
+                "hit_rate_percentage": round(fast_cache.cache_stats["memory_hits"] / total_requests * 100, 2) if total_requests else 0
+            },
+            **({"shared": fast_cache.shared_cache.snapshot()} if fast_cache.shared_cache else {}),
+            **(cache_backend.tier_stats() if isinstance(cache_backend, TieredCache) else {})
+        },
+        "disk_quota": cache_backend.quota_snapshot() if isinstance(cache_backend, (LocalCache, TieredCache)) else None
     }
 
 if __name__ == '__main__':
@@ -0,0 +1,71 @@
+import json
+import time
+import struct
+from typing import Optional, Dict, List, Tuple
+
+# Layout: magic | header length | JSON header | images
+# The header holds the screenshot metadata, the write time (epoch seconds)
+# and an offset table mapping each quality to [offset, length], offsets
+# counted from the end of the header.
+BUNDLE_MAGIC = b'YSBNDL01'
+BUNDLE_PREFIX = struct.Struct('<8sI')  # magic, header length
+HEADER_READ_BYTES = 4096  # First ranged read; covers the header of a typical bundle
+
+class BundleFormatError(ValueError):
+    """Raised for data that is not a complete bundle"""
+    pass
+
+def pack_bundle(metadata: List[Dict], images: Dict[str, bytes], written_at: Optional[float] = None) -> bytes:
+    """Serialise a timestamp's metadata and images into one object"""
+    offsets = {}
+    position = 0
+    for quality, image_data in images.items():
+        offsets[quality] = [position, len(image_data)]
+        position += len(image_data)
+    
+    header = json.dumps({
+        "metadata": metadata,
+        "images": offsets,
+        "written_at": written_at if written_at is not None else time.time()
+    }).encode('utf-8')
+    return BUNDLE_PREFIX.pack(BUNDLE_MAGIC, len(header)) + header + b''.join(images.values())
+
+def header_size(prefix: bytes) -> int:
+    """Bytes from the start of the bundle to the end of its header"""
+    if len(prefix) < BUNDLE_PREFIX.size:
+        raise BundleFormatError("Bundle prefix is truncated")
+    magic, header_length = BUNDLE_PREFIX.unpack_from(prefix, 0)
+    if magic != BUNDLE_MAGIC:
+        raise BundleFormatError("Not a screenshot bundle")
+    return BUNDLE_PREFIX.size + header_length
+
+def parse_header(prefix: bytes) -> Dict:
+    """Header ({'metadata', 'images', 'written_at'}) from the first header_size() bytes or more
+    
+    Bundles written before the write time was recorded have no 'written_at'.
+    """
+    end = header_size(prefix)
+    if len(prefix) < end:
+        raise BundleFormatError("Bundle header is truncated")
+    header = json.loads(prefix[BUNDLE_PREFIX.size:end])
+    header["data_offset"] = end
+    return header
+
+def image_range(header: Dict, quality: str) -> Optional[Tuple[int, int]]:
+    """Absolute [start, end) byte range of one quality's image, or None if not bundled"""
+    entry = header["images"].get(quality)
+    if entry is None:
+        return None
+    start = header["data_offset"] + entry[0]
+    return start, start + entry[1]
+
+def unpack_bundle(data: bytes) -> Tuple[List[Dict], Dict[str, bytes]]:
+    """Metadata and images of a complete bundle"""
+    header = parse_header(data)
+    images = {}
+    for quality in header["images"]:
+        start, end = image_range(header, quality) #type: ignore
+        if end > len(data):
+            raise BundleFormatError(f"Bundle image {quality} is truncated")
+        images[quality] = data[start:end]
+    return header["metadata"], images
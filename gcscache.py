@@ -1,21 +1,39 @@
 from google.cloud import storage
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from metrics import LatencyHistogram
+from bundle import pack_bundle, unpack_bundle, header_size, parse_header, image_range, HEADER_READ_BYTES
 import json
+import struct
 import asyncio
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, Any
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 import os 
+import time
+import threading
 import logging
 
 # Set up logging for better debugging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Objects other than bundles start with their write time, so one GET returns
+# the data and its freshness (bundles keep it in their header)
+OBJECT_STAMP = struct.Struct('<8sd')  # magic, written_at (epoch seconds)
+OBJECT_STAMP_MAGIC = b'YSGCSTS1'
+
 class GCSCache:
     def __init__(self, bucket_name: str):
         self.client = storage.Client()
         self.bucket = self.client.bucket(bucket_name)
         self.cache_duration = timedelta(hours=24)  # Cache for 24 hours
+        self.video_info_duration = timedelta(days=7)  # Duration/title rarely change
+        self.streams_duration = timedelta(hours=6)  # Signed stream URLs last about 6 hours
+        self.lookup_latency = LatencyHistogram()  # Per-GET lookup latency
+        self._bundle_headers: OrderedDict[str, Tuple[Dict, int, datetime]] = OrderedDict()  # key -> (header, generation, written_at), LRU
+        self.max_bundle_headers = 1024
+        self._bundle_lock = threading.Lock()
         # Thread pool for async operations
         self._executor = ThreadPoolExecutor(max_workers=4)
     
@@ -27,65 +45,116 @@ class GCSCache:
         """Generate metadata cache key"""
         return f"metadata/{video_id}_{timestamp}.json"
     
-    def get_cached_screenshot(self, video_id: str, timestamp: int, quality: str) -> Optional[bytes]:
-        """Retrieve cached screenshot (synchronous)"""
+    def _get_video_info_key(self, video_id: str) -> str:
+        """Generate per-video info index key"""
+        return f"videos/{video_id}.json"
+    
+    def _get_streams_key(self, video_id: str) -> str:
+        """Generate resolved stream table key"""
+        return f"streams/{video_id}.json"
+    
+    def _get_bundle_key(self, video_id: str, timestamp: int) -> str:
+        """Generate key of the bundle holding every quality and the metadata of a timestamp"""
+        return f"bundles/{video_id}_{timestamp}.bin"
+    
+    def _age(self, blob) -> Optional[timedelta]:
+        """Time since the object was last written (Last-Modified), None if unknown"""
+        written = blob.updated or blob.time_created
+        if written is None:
+            return None
+        written = written.replace(tzinfo=timezone.utc) if written.tzinfo is None else written
+        return datetime.now(timezone.utc) - written
+    
+    def _upload(self, key: str, data: bytes, content_type: str):
+        """Write an object behind a stamp holding the current time"""
+        blob = self.bucket.blob(key)
+        blob.upload_from_string(OBJECT_STAMP.pack(OBJECT_STAMP_MAGIC, time.time()) + data, content_type=content_type)
+    
+    def _written_age(self, key: str, written_at: Optional[float], generation: Optional[int]) -> Optional[timedelta]:
+        """Age from the write time stored in the object
+        
+        Objects written before it was stored cost a metadata request for
+        their Last-Modified; None if that generation is gone by then.
+        """
+        if written_at is not None:
+            return timedelta(seconds=max(0.0, time.time() - written_at))
+        blob = self.bucket.get_blob(key)
+        if blob is None or blob.generation != generation:
+            return None
+        return self._age(blob) or timedelta(0)
+    
+    def _download_fresh(self, key: str, max_age: timedelta) -> Optional[bytes]:
+        """Fetch an object written less than max_age ago in one GET; 404 or expired is a miss"""
+        started = time.perf_counter()
         try:
-            cache_key = self._get_cache_key(video_id, timestamp, quality)
-            logger.info(f"GCS lookup: {cache_key}")
-            
-            blob = self.bucket.blob(cache_key)
-            
-            # Use blob.exists() with retry logic
+            blob = self.bucket.blob(key)
             try:
-                exists = blob.exists()
-            except Exception as e:
-                logger.warning(f"Error checking blob existence for {cache_key}: {e}")
+                data = blob.download_as_bytes()
+            except NotFound:
+                logger.info(f"GCS blob does not exist: {key}")
                 return None
-                
-            if not exists:
-                logger.info(f"GCS blob does not exist: {cache_key}")
+            
+            written_at = None
+            if data[:len(OBJECT_STAMP_MAGIC)] == OBJECT_STAMP_MAGIC:
+                _, written_at = OBJECT_STAMP.unpack_from(data)
+                data = data[OBJECT_STAMP.size:]
+            age = self._written_age(key, written_at, blob.generation)
+            if age is None or age >= max_age:
+                logger.info(f"GCS cache EXPIRED: {key} (age: {age})")
                 return None
             
-            try:
-                # Only reload if we need fresh metadata
-                if blob.time_created is None:
-                    blob.reload()
-                
-                # Check expiration
-                if blob.time_created:
-                    # Use UTC timezone for consistency
-                    current_time = datetime.now(timezone.utc)
-                    blob_time = blob.time_created.replace(tzinfo=timezone.utc) if blob.time_created.tzinfo is None else blob.time_created
-                    age = current_time - blob_time
-                    
-                    if age >= self.cache_duration:
-                        logger.info(f"GCS cache EXPIRED: {cache_key} (age: {age})")
-                        return None
-                    
-                    logger.info(f"GCS cache HIT: {cache_key} (age: {age})")
-                else:
-                    logger.info(f"GCS cache HIT (no timestamp): {cache_key}")
-                
-                # Download the data
-                data = blob.download_as_bytes()
-                logger.info(f"GCS downloaded {len(data)} bytes for {cache_key}")
-                return data
-                
-            except Exception as e:
-                logger.error(f"Error processing blob metadata for {cache_key}: {e}")
-                # Try to download anyway if metadata fails
-                try:
-                    data = blob.download_as_bytes()
-                    logger.info(f"GCS downloaded {len(data)} bytes for {cache_key} (fallback)")
-                    return data
-                except Exception as download_error:
-                    logger.error(f"Fallback download failed for {cache_key}: {download_error}")
-                    return None
-                
+            logger.info(f"GCS cache HIT: {key} (age: {age}, size: {len(data)} bytes)")
+            return data
+        finally:
+            self.lookup_latency.observe(time.perf_counter() - started)
+    
+    def _download_range(self, key: str, start: int, end: int, generation: Optional[int] = None) -> Optional[Tuple[bytes, Any]]:
+        """Bytes start..end (inclusive) of an object and the blob they came from
+        
+        With a generation, raises PreconditionFailed once the object is rewritten.
+        """
+        started = time.perf_counter()
+        try:
+            blob = self.bucket.blob(key)
+            return blob.download_as_bytes(start=start, end=end, if_generation_match=generation), blob
+        except NotFound:
+            return None
+        finally:
+            self.lookup_latency.observe(time.perf_counter() - started)
+    
+    def get_cached_screenshot(self, video_id: str, timestamp: int, quality: str) -> Optional[bytes]:
+        """Retrieve cached screenshot (synchronous)"""
+        cache_key = self._get_cache_key(video_id, timestamp, quality)
+        try:
+            logger.info(f"GCS lookup: {cache_key}")
+            return self._download_fresh(cache_key, self.cache_duration)
         except Exception as e:
             logger.error(f"GCS cache retrieval error for {cache_key}: {e}")
             return None
     
+    def has_cached_screenshots(self, video_id: str, timestamp: int, qualities: List[str]) -> Dict[str, bool]:
+        """Check which qualities are cached and fresh with one metadata-only list request"""
+        presence = {quality: False for quality in qualities}
+        try:
+            prefix = f"screenshots/{video_id}_{timestamp}_"
+            current_time = datetime.now(timezone.utc)
+            for blob in self.bucket.list_blobs(prefix=prefix):
+                quality = blob.name[len(prefix):].rsplit('.', 1)[0]
+                if quality not in presence or not blob.time_created:
+                    continue
+                blob_time = blob.time_created.replace(tzinfo=timezone.utc) if blob.time_created.tzinfo is None else blob.time_created
+                presence[quality] = current_time - blob_time < self.cache_duration
+            
+            # Bundled timestamps have no object per quality; their header lists them
+            if not all(presence.values()):
+                header = self._bundle_header(self._get_bundle_key(video_id, timestamp))
+                for quality in header[0]["images"] if header else []:
+                    if quality in presence:
+                        presence[quality] = True
+        except Exception as e:
+            logger.error(f"GCS presence check error for {video_id}_{timestamp}: {e}")
+        return presence
+    
     async def get_cached_screenshot_async(self, video_id: str, timestamp: int, quality: str) -> Optional[bytes]:
         """Retrieve cached screenshot (asynchronous)"""
         loop = asyncio.get_event_loop()
@@ -101,11 +170,11 @@ class GCSCache:
         """Cache screenshot to GCS (synchronous)"""
         try:
             cache_key = self._get_cache_key(video_id, timestamp, quality)
-            blob = self.bucket.blob(cache_key)
-            blob.upload_from_string(image_data, content_type='image/png')
-            logger.info(f"Cached screenshot: {blob.name} ({len(image_data)} bytes)")
+            self._upload(cache_key, image_data, 'image/png')
+            logger.info(f"Cached screenshot: {cache_key} ({len(image_data)} bytes)")
         except Exception as e:
             logger.error(f"Cache storage error: {e}")
+            raise
     
     async def cache_screenshot_async(self, video_id: str, timestamp: int, quality: str, image_data: bytes):
         """Cache screenshot to GCS (asynchronous)"""
@@ -123,33 +192,12 @@ class GCSCache:
         """Get cached screenshot metadata (synchronous)"""
         try:
             metadata_key = self._get_metadata_key(video_id, timestamp)
-            blob = self.bucket.blob(metadata_key)
-            
-            if not blob.exists():
-                logger.info(f"Metadata blob does not exist: {metadata_key}")
+            data = self._download_fresh(metadata_key, self.cache_duration)
+            if data is None:
                 return None
             
-            # Check if cache is still valid
-            try:
-                if blob.time_created is None:
-                    blob.reload()
-                
-                if blob.time_created:
-                    current_time = datetime.now(timezone.utc)
-                    blob_time = blob.time_created.replace(tzinfo=timezone.utc) if blob.time_created.tzinfo is None else blob.time_created
-                    age = current_time - blob_time
-                    
-                    if age >= self.cache_duration:
-                        logger.info(f"Metadata cache EXPIRED: {metadata_key} (age: {age})")
-                        return None
-                
-                data = json.loads(blob.download_as_text())
-                logger.info(f"Metadata cache HIT: {metadata_key}")
-                return data
-                
-            except Exception as e:
-                logger.error(f"Error processing metadata blob {metadata_key}: {e}")
-                return None
+            logger.info(f"Metadata cache HIT: {metadata_key}")
+            return json.loads(data)
             
         except Exception as e:
             logger.error(f"Metadata cache retrieval error: {e}")
@@ -169,11 +217,11 @@ class GCSCache:
         """Cache screenshot metadata (synchronous)"""
         try:
             metadata_key = self._get_metadata_key(video_id, timestamp)
-            blob = self.bucket.blob(metadata_key)
-            blob.upload_from_string(json.dumps(metadata), content_type='application/json')
-            logger.info(f"Cached metadata: {blob.name}")
+            self._upload(metadata_key, json.dumps(metadata).encode('utf-8'), 'application/json')
+            logger.info(f"Cached metadata: {metadata_key}")
         except Exception as e:
             logger.error(f"Metadata cache error: {e}")
+            raise
     
     async def cache_metadata_async(self, video_id: str, timestamp: int, metadata: List[Dict]):
         """Cache screenshot metadata (asynchronous)"""
@@ -186,6 +234,157 @@ class GCSCache:
             metadata
         )
     
+    def get_cached_video_info(self, video_id: str) -> Optional[Dict]:
+        """Get cached per-video info (duration, title, available qualities)"""
+        try:
+            data = self._download_fresh(self._get_video_info_key(video_id), self.video_info_duration)
+            return json.loads(data) if data is not None else None
+            
+        except Exception as e:
+            logger.error(f"Video info cache retrieval error: {e}")
+            return None
+    
+    def cache_video_info(self, video_id: str, video_info: Dict):
+        """Cache per-video info"""
+        try:
+            info_key = self._get_video_info_key(video_id)
+            self._upload(info_key, json.dumps(video_info).encode('utf-8'), 'application/json')
+            logger.info(f"Cached video info: {info_key}")
+        except Exception as e:
+            logger.error(f"Video info cache error: {e}")
+            raise
+    
+    def get_cached_streams(self, video_id: str) -> Optional[Dict]:
+        """Get the resolved stream table ({'streams', 'expires_at'}) if its URLs are still valid"""
+        try:
+            data = self._download_fresh(self._get_streams_key(video_id), self.streams_duration)
+            if data is None:
+                return None
+            
+            entry = json.loads(data)
+            if time.time() >= entry.get('expires_at', 0):
+                logger.info(f"Stream cache EXPIRED: {video_id}")
+                return None
+            return entry
+            
+        except Exception as e:
+            logger.error(f"Stream cache retrieval error: {e}")
+            return None
+    
+    def cache_streams(self, video_id: str, streams: Dict, expires_at: float):
+        """Cache a resolved stream table until its URLs expire (epoch seconds)"""
+        try:
+            streams_key = self._get_streams_key(video_id)
+            self._upload(streams_key, json.dumps({'streams': streams, 'expires_at': expires_at}).encode('utf-8'), 'application/json')
+            logger.info(f"Cached streams: {streams_key}")
+        except Exception as e:
+            logger.error(f"Stream cache error: {e}")
+            raise
+    
+    def get_cached_bundle(self, video_id: str, timestamp: int) -> Optional[Tuple[List[Dict], Dict[str, bytes]]]:
+        """Metadata and every bundled image of a timestamp in one download"""
+        bundle_key = self._get_bundle_key(video_id, timestamp)
+        started = time.perf_counter()
+        try:
+            blob = self.bucket.blob(bundle_key)
+            try:
+                data = blob.download_as_bytes()
+            except NotFound:
+                return None
+            finally:
+                self.lookup_latency.observe(time.perf_counter() - started)
+            
+            age = self._written_age(bundle_key, parse_header(data).get("written_at"), blob.generation)
+            if age is None or age >= self.cache_duration:
+                logger.info(f"GCS cache EXPIRED: {bundle_key} (age: {age})")
+                return None
+            return unpack_bundle(data)
+        except Exception as e:
+            logger.error(f"Bundle cache retrieval error for {bundle_key}: {e}")
+            return None
+    
+    def _get_bundle_header(self, bundle_key: str) -> Optional[Tuple[Dict, int, bytes]]:
+        """Offset table of a fresh bundle, its generation and the bytes read to get it"""
+        downloaded = self._download_range(bundle_key, 0, HEADER_READ_BYTES - 1)
+        if downloaded is None:
+            return None
+        prefix, blob = downloaded
+        needed = header_size(prefix)
+        if needed > len(prefix):
+            rest = self._download_range(bundle_key, len(prefix), needed - 1, blob.generation)
+            if rest is None:
+                return None
+            prefix += rest[0]
+        header = parse_header(prefix)
+        
+        age = self._written_age(bundle_key, header.get("written_at"), blob.generation)
+        if age is None or age >= self.cache_duration:
+            logger.info(f"GCS cache EXPIRED: {bundle_key} (age: {age})")
+            return None
+        written_at = datetime.now(timezone.utc) - age
+        
+        with self._bundle_lock:
+            self._bundle_headers[bundle_key] = (header, blob.generation, written_at)
+            while len(self._bundle_headers) > self.max_bundle_headers:
+                self._bundle_headers.popitem(last=False)
+        return header, blob.generation, prefix
+    
+    def _bundle_header(self, bundle_key: str) -> Optional[Tuple[Dict, int, bytes]]:
+        """Remembered offset table of a fresh bundle, else _get_bundle_header"""
+        with self._bundle_lock:
+            cached = self._bundle_headers.get(bundle_key)
+            if cached and datetime.now(timezone.utc) - cached[2] >= self.cache_duration:
+                del self._bundle_headers[bundle_key]
+                cached = None
+            if cached:
+                self._bundle_headers.move_to_end(bundle_key)
+                return cached[0], cached[1], b''
+        return self._get_bundle_header(bundle_key)
+    
+    def get_cached_bundle_image(self, video_id: str, timestamp: int, quality: str) -> Optional[bytes]:
+        """One quality out of a bundle with a ranged GET
+        
+        Offset tables are remembered per bundle with its generation and write
+        time, so after the first lookup a quality costs a single ranged GET;
+        a rewritten bundle fails the generation check and its header is read
+        again.
+        """
+        bundle_key = self._get_bundle_key(video_id, timestamp)
+        try:
+            for _ in range(2):
+                loaded = self._bundle_header(bundle_key)
+                if loaded is None:
+                    return None
+                header, generation, prefix = loaded
+                
+                span = image_range(header, quality)
+                if span is None:
+                    return None
+                if span[1] <= len(prefix):
+                    return prefix[span[0]:span[1]]
+                try:
+                    downloaded = self._download_range(bundle_key, span[0], span[1] - 1, generation)
+                    return downloaded[0] if downloaded else None
+                except PreconditionFailed:
+                    with self._bundle_lock:
+                        self._bundle_headers.pop(bundle_key, None)
+            return None
+        except Exception as e:
+            logger.error(f"Bundle image retrieval error for {bundle_key}: {e}")
+            return None
+    
+    def cache_bundle(self, video_id: str, timestamp: int, metadata: List[Dict], images: Dict[str, bytes]):
+        """Store a timestamp's metadata and images as one object"""
+        try:
+            blob = self.bucket.blob(self._get_bundle_key(video_id, timestamp))
+            blob.upload_from_string(pack_bundle(metadata, images), content_type='application/octet-stream')
+            with self._bundle_lock:
+                self._bundle_headers.pop(blob.name, None)
+            logger.info(f"Cached bundle: {blob.name} ({len(images)} images)")
+        except Exception as e:
+            logger.error(f"Bundle cache error: {e}")
+            raise
+    
     async def batch_check_cached_screenshots(self, video_id: str, timestamp: int, qualities: List[str]) -> Dict[str, Optional[bytes]]:
         """Check multiple screenshot qualities in parallel"""
         tasks = [
@@ -246,6 +445,35 @@ class GCSCache:
                         blob.delete()
                         deleted_count += 1
             
+            # Bundles expire with the screenshots they hold
+            bundle_blobs = self.bucket.list_blobs(prefix="bundles/")
+            for blob in bundle_blobs:
+                if blob.time_created:
+                    blob_time = blob.time_created.replace(tzinfo=timezone.utc) if blob.time_created.tzinfo is None else blob.time_created
+                    if blob_time < cutoff_time:
+                        blob.delete()
+                        deleted_count += 1
+            
+            # Video info entries live longer than screenshots
+            info_cutoff_time = datetime.now(timezone.utc) - self.video_info_duration
+            video_blobs = self.bucket.list_blobs(prefix="videos/")
+            for blob in video_blobs:
+                if blob.time_created:
+                    blob_time = blob.time_created.replace(tzinfo=timezone.utc) if blob.time_created.tzinfo is None else blob.time_created
+                    if blob_time < info_cutoff_time:
+                        blob.delete()
+                        deleted_count += 1
+            
+            # Stream tables are useless once their signed URLs expire
+            streams_cutoff_time = datetime.now(timezone.utc) - self.streams_duration
+            stream_blobs = self.bucket.list_blobs(prefix="streams/")
+            for blob in stream_blobs:
+                if blob.time_created:
+                    blob_time = blob.time_created.replace(tzinfo=timezone.utc) if blob.time_created.tzinfo is None else blob.time_created
+                    if blob_time < streams_cutoff_time:
+                        blob.delete()
+                        deleted_count += 1
+            
             logger.info(f"Cleaned up {deleted_count} expired cache entries")
             return deleted_count
             
@@ -280,7 +508,8 @@ class GCSCache:
                 "metadata_count": len(metadata_blobs),
                 "total_size_mb": round(total_size / (1024 * 1024), 2),
                 "quality_breakdown": quality_counts,
-                "cache_duration_hours": self.cache_duration.total_seconds() / 3600
+                "cache_duration_hours": self.cache_duration.total_seconds() / 3600,
+                "lookup_latency": self.lookup_latency.snapshot()
             }
             
         except Exception as e:
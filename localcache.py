@@ -1,39 +1,415 @@
 import json
 import asyncio
 import os
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterator, Tuple
 from concurrent.futures import ThreadPoolExecutor
+from metrics import LatencyHistogram
+from packstore import PackStore
+from bundle import pack_bundle, unpack_bundle, header_size, parse_header, image_range, HEADER_READ_BYTES
+import time
 import logging
 
 # Set up logging for better debugging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class CacheIndex:
+    """SQLite index of cached files (path, kind, quality, size, mtime, atime)
+    
+    Stats, expiry, eviction and clearing are answered from the index instead
+    of listing and stat-ing every file. Paths are stored relative to the
+    cache directory; triggers keep the total size in a one-row table.
+    """
+    def __init__(self, db_path: str):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS entries (
+                path TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                quality TEXT,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                atime REAL
+            );
+            CREATE INDEX IF NOT EXISTS entries_kind_mtime ON entries (kind, mtime);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            COMMIT;
+        """)
+        
+        # Indexes created before access times were tracked
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(entries)")]
+        if "atime" not in columns:
+            self._conn.executescript("""
+                BEGIN IMMEDIATE;
+                ALTER TABLE entries ADD COLUMN atime REAL;
+                UPDATE entries SET atime = mtime;
+                COMMIT;
+            """)
+        
+        self._conn.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime);
+            CREATE TABLE IF NOT EXISTS totals (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                bytes INTEGER NOT NULL,
+                entries INTEGER NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+                UPDATE totals SET bytes = bytes + NEW.size, entries = entries + 1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+                UPDATE totals SET bytes = bytes + NEW.size - OLD.size;
+            END;
+            CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+                UPDATE totals SET bytes = bytes - OLD.size, entries = entries - 1;
+            END;
+            INSERT OR IGNORE INTO totals (id, bytes, entries)
+                SELECT 0, COALESCE(SUM(size), 0), COUNT(*) FROM entries;
+            COMMIT;
+        """)
+    
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Exclusive write transaction, also across worker processes"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+    
+    def upsert(self, path: str, kind: str, size: int, mtime: float, quality: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO entries (path, kind, quality, size, mtime, atime) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET kind = excluded.kind, quality = excluded.quality, "
+                "size = excluded.size, mtime = excluded.mtime, atime = excluded.atime",
+                (path, kind, quality, size, mtime, mtime)
+            )
+    
+    def touch(self, accessed: Dict[str, float]):
+        """Record last access times ({path: epoch seconds})"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE entries SET atime = ? WHERE path = ?",
+                [(atime, path) for path, atime in accessed.items()]
+            )
+    
+    def remove(self, paths: List[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM entries WHERE path = ?", [(path,) for path in paths])
+    
+    def expired(self, kind: str, cutoff: float, limit: int = 1000) -> List[str]:
+        """Paths of one kind last written before cutoff (epoch seconds), oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM entries WHERE kind = ? AND mtime < ? ORDER BY mtime LIMIT ?",
+                (kind, cutoff, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def least_recently_used(self, limit: int = 200) -> List[Tuple[str, int]]:
+        """(path, size) of the least recently accessed entries"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, size FROM entries ORDER BY atime LIMIT ?", (limit,)
+            ).fetchall()
+    
+    def total_bytes(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT bytes FROM totals").fetchone()
+        return row[0] if row else 0
+    
+    def paths(self, limit: int = 1000) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM entries LIMIT ?", (limit,)).fetchall()
+        return [row[0] for row in rows]
+    
+    def summary(self) -> Dict:
+        """Entry counts and bytes per kind, plus screenshot counts per quality"""
+        with self._lock:
+            kinds = self._conn.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY kind"
+            ).fetchall()
+            qualities = self._conn.execute(
+                "SELECT quality, COUNT(*) FROM entries WHERE kind = 'screenshot' GROUP BY quality"
+            ).fetchall()
+        return {
+            "counts": {kind: count for kind, count, _ in kinds},
+            "bytes": {kind: size for kind, _, size in kinds},
+            "qualities": {quality: count for quality, count in qualities}
+        }
+    
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Index paths of screenshots kept in the pack store rather than in their own file
+PACK_PREFIX = "packs/"
+
 class LocalCache:
-    def __init__(self, cache_dir: str = "cache"):
+    def __init__(self, cache_dir: str = "cache", max_bytes: int = 0,
+                 high_watermark: float = 0.9, low_watermark: float = 0.8,
+                 pack_qualities: Optional[List[str]] = None):
         self.cache_dir = cache_dir
         self.cache_duration = timedelta(hours=24)  # Cache for 24 hours
+        self.video_info_duration = timedelta(days=7)  # Duration/title rarely change
+        self.streams_duration = timedelta(hours=6)  # Signed stream URLs last about 6 hours
+        self.lookup_latency = LatencyHistogram()  # Per-read lookup latency
         # Thread pool for async operations
         self._executor = ThreadPoolExecutor(max_workers=4)
         
         # Create cache directories
         self.screenshots_dir = os.path.join(cache_dir, "screenshots")
         self.metadata_dir = os.path.join(cache_dir, "metadata")
+        self.videos_dir = os.path.join(cache_dir, "videos")
+        self.streams_dir = os.path.join(cache_dir, "streams")
+        self.bundles_dir = os.path.join(cache_dir, "bundles")
         os.makedirs(self.screenshots_dir, exist_ok=True)
         os.makedirs(self.metadata_dir, exist_ok=True)
+        os.makedirs(self.videos_dir, exist_ok=True)
+        os.makedirs(self.streams_dir, exist_ok=True)
+        os.makedirs(self.bundles_dir, exist_ok=True)
+        
+        # Directory and lifetime for each kind of cached file
+        self._kinds = {
+            "screenshot": (self.screenshots_dir, self.cache_duration),
+            "metadata": (self.metadata_dir, self.cache_duration),
+            "video_info": (self.videos_dir, self.video_info_duration),
+            "streams": (self.streams_dir, self.streams_duration),
+            "bundle": (self.bundles_dir, self.cache_duration)
+        }
+        self.index = CacheIndex(os.path.join(cache_dir, "index.sqlite3"))
+        self._migrate_flat_layout()
+        
+        # Small qualities can be appended to pack segments instead of one file each
+        self.pack_qualities = set(pack_qualities or [])
+        self.packs = PackStore(os.path.join(cache_dir, "packs")) if self.pack_qualities else None
+        
+        # Disk quota: past high_watermark * max_bytes, least recently read
+        # files are evicted in the background until usage is below low_watermark
+        self.max_bytes = max_bytes  # 0 disables the quota
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.eviction_stats = {
+            "runs": 0,
+            "evicted_files": 0,
+            "evicted_bytes": 0,
+            "last_run_seconds": 0.0
+        }
+        self._evicting = False
+        self._eviction_lock = threading.Lock()
+        self._pending_touches: Dict[str, float] = {}  # Access times not yet written to the index
+        self._touch_lock = threading.Lock()
+    
+    def _shard_dir(self, base_dir: str, video_id: str) -> str:
+        """Two-level hash-prefix fan-out (256 x 256 directories); a video's files share one shard"""
+        digest = hashlib.md5(video_id.encode('utf-8')).hexdigest()
+        return os.path.join(base_dir, digest[:2], digest[2:4])
     
     def _get_cache_path(self, video_id: str, timestamp: int, quality: str) -> str:
         """Generate cache file path for screenshot"""
         filename = f"{video_id}_{timestamp}_{quality}.png"
-        return os.path.join(self.screenshots_dir, filename)
+        return os.path.join(self._shard_dir(self.screenshots_dir, video_id), filename)
     
     def _get_metadata_path(self, video_id: str, timestamp: int) -> str:
         """Generate metadata cache file path"""
         filename = f"{video_id}_{timestamp}.json"
-        return os.path.join(self.metadata_dir, filename)
+        return os.path.join(self._shard_dir(self.metadata_dir, video_id), filename)
+    
+    def _get_video_info_path(self, video_id: str) -> str:
+        """Generate per-video info index file path"""
+        filename = f"{video_id}.json"
+        return os.path.join(self._shard_dir(self.videos_dir, video_id), filename)
+    
+    def _get_streams_path(self, video_id: str) -> str:
+        """Generate resolved stream table file path"""
+        filename = f"{video_id}.json"
+        return os.path.join(self._shard_dir(self.streams_dir, video_id), filename)
+    
+    def _get_bundle_path(self, video_id: str, timestamp: int) -> str:
+        """Generate file path of the bundle holding every quality and the metadata of a timestamp"""
+        filename = f"{video_id}_{timestamp}.bin"
+        return os.path.join(self._shard_dir(self.bundles_dir, video_id), filename)
+    
+    def _relative(self, filepath: str) -> str:
+        return os.path.relpath(filepath, self.cache_dir)
+    
+    def _write_file(self, filepath: str, data: bytes, kind: str, quality: Optional[str] = None):
+        """Write atomically (readers never see partial files) and record the file in the index"""
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, filepath)
+        self.index.upsert(self._relative(filepath), kind, len(data), os.path.getmtime(filepath), quality)
+        self._maybe_evict()
+    
+    def _touch(self, filepath: str):
+        """Note a read for LRU eviction; access times are written to the index in batches"""
+        with self._touch_lock:
+            self._pending_touches[self._relative(filepath)] = time.time()
+            if len(self._pending_touches) < 256:
+                return
+            accessed, self._pending_touches = self._pending_touches, {}
+        self.index.touch(accessed)
+    
+    def _flush_touches(self):
+        with self._touch_lock:
+            accessed, self._pending_touches = self._pending_touches, {}
+        if accessed:
+            self.index.touch(accessed)
+    
+    def _maybe_evict(self):
+        """Start a background eviction run once usage crosses the high watermark"""
+        if not self.max_bytes or self.index.total_bytes() <= self.max_bytes * self.high_watermark:
+            return
+        with self._eviction_lock:
+            if self._evicting:
+                return
+            self._evicting = True
+        threading.Thread(target=self._evict, name="localcache-evict", daemon=True).start()
+    
+    def _evict(self):
+        """Evict least recently read files in small chunks until usage is below the low watermark"""
+        started = time.perf_counter()
+        evicted_files = evicted_bytes = 0
+        try:
+            self._flush_touches()
+            target = self.max_bytes * self.low_watermark
+            while True:
+                excess = self.index.total_bytes() - target
+                entries = self.index.least_recently_used() if excess > 0 else []
+                if not entries:
+                    break
+                evicted = []
+                for path, size in entries:
+                    if excess <= 0:
+                        break
+                    evicted.append(path)
+                    excess -= size
+                    evicted_bytes += size
+                self._delete_entries(evicted)
+                evicted_files += len(evicted)
+                time.sleep(0.01)  # Let foreground reads and writes in between chunks
+            
+            if self.packs and evicted_files:
+                self.packs.compact(self.cache_duration.total_seconds())
+        except Exception as e:
+            logger.error(f"Local cache eviction error: {e}")
+        finally:
+            elapsed = time.perf_counter() - started
+            self.eviction_stats["runs"] += 1
+            self.eviction_stats["evicted_files"] += evicted_files
+            self.eviction_stats["evicted_bytes"] += evicted_bytes
+            self.eviction_stats["last_run_seconds"] = round(elapsed, 3)
+            with self._eviction_lock:
+                self._evicting = False
+            logger.info(f"Evicted {evicted_files} files ({evicted_bytes} bytes) in {elapsed:.2f}s")
+    
+    def quota_snapshot(self) -> Dict:
+        """Disk usage against the quota plus eviction counters"""
+        used_bytes = self.index.total_bytes()
+        return {
+            "max_bytes": self.max_bytes,
+            "used_bytes": used_bytes,
+            "usage_percentage": round(used_bytes / self.max_bytes * 100, 2) if self.max_bytes else None,
+            "high_watermark": self.high_watermark,
+            "low_watermark": self.low_watermark,
+            "evicting": self._evicting,
+            **self.eviction_stats
+        }
+    
+    def _write_packed(self, key: str, data: bytes, quality: str):
+        """Append a screenshot to the pack store and record it in the index"""
+        self.packs.put(key, data) #type: ignore
+        self.index.upsert(PACK_PREFIX + key, "screenshot", len(data), time.time(), quality)
+        self._maybe_evict()
+    
+    def _delete_entries(self, paths: List[str]):
+        """Delete indexed entries, whether files or packed screenshots, and their index rows"""
+        packed = [path[len(PACK_PREFIX):] for path in paths if path.startswith(PACK_PREFIX)]
+        for path in paths:
+            if path.startswith(PACK_PREFIX):
+                continue
+            try:
+                os.remove(os.path.join(self.cache_dir, path))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Error removing file {path}: {e}")
+        if packed and self.packs:
+            self.packs.delete(packed)
+        self.index.remove(paths)
+    
+    def _remove_file(self, filepath: str):
+        """Delete a cached file and its index entry"""
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+        self.index.remove([self._relative(filepath)])
+    
+    def _migrate_flat_layout(self):
+        """Move files from the old flat directories into shards and index every file once
+        
+        Runs inside an exclusive index transaction so concurrent workers
+        starting up wait for the first one instead of migrating twice.
+        """
+        try:
+            with self.index.transaction():
+                if self.index.get_meta("layout") == "sharded":
+                    return
+                
+                migrated = indexed = 0
+                for kind, (base_dir, _) in self._kinds.items():
+                    for root, _, files in os.walk(base_dir):
+                        for filename in files:
+                            if filename.endswith('.tmp'):
+                                continue
+                            filepath = os.path.join(root, filename)
+                            name = os.path.splitext(filename)[0]
+                            quality = name.rsplit('_', 1)[-1] if kind == "screenshot" else None
+                            
+                            if root == base_dir:
+                                # video_id_timestamp_quality.png, video_id_timestamp.json or video_id.json
+                                video_id = name.rsplit('_', {"screenshot": 2, "metadata": 1}.get(kind, 0))[0]
+                                target = os.path.join(self._shard_dir(base_dir, video_id), filename)
+                                os.makedirs(os.path.dirname(target), exist_ok=True)
+                                os.replace(filepath, target)
+                                filepath = target
+                                migrated += 1
+                            
+                            stat = os.stat(filepath)
+                            self.index.upsert(self._relative(filepath), kind, stat.st_size, stat.st_mtime, quality)
+                            indexed += 1
+                
+                self.index.set_meta("layout", "sharded")
+                logger.info(f"Local cache index built: {indexed} files indexed, {migrated} moved into shards")
+        except Exception as e:
+            logger.error(f"Local cache migration error: {e}")
     
-    def _is_file_expired(self, filepath: str) -> bool:
+    def _is_file_expired(self, filepath: str, max_age: Optional[timedelta] = None) -> bool:
         """Check if file is expired based on modification time"""
         try:
             if not os.path.exists(filepath):
@@ -43,7 +419,7 @@ class LocalCache:
             current_time = datetime.now(timezone.utc)
             age = current_time - file_mtime
             
-            return age >= self.cache_duration
+            return age >= (max_age or self.cache_duration)
         except Exception as e:
             logger.error(f"Error checking file expiration for {filepath}: {e}")
             return True
@@ -54,6 +430,16 @@ class LocalCache:
             cache_path = self._get_cache_path(video_id, timestamp, quality)
             logger.info(f"Local cache lookup: {cache_path}")
             
+            if self.packs and quality in self.pack_qualities:
+                key = os.path.splitext(os.path.basename(cache_path))[0]
+                started = time.perf_counter()
+                data = self.packs.get(key, self.cache_duration.total_seconds())
+                if data is not None:
+                    self.lookup_latency.observe(time.perf_counter() - started)
+                    self._touch(os.path.join(self.cache_dir, PACK_PREFIX + key))
+                    logger.info(f"Local pack HIT: {key} (size: {len(data)} bytes)")
+                    return data
+            
             if not os.path.exists(cache_path):
                 logger.info(f"Local cache file does not exist: {cache_path}")
                 return None
@@ -63,14 +449,17 @@ class LocalCache:
                 logger.info(f"Local cache EXPIRED: {cache_path}")
                 # Optionally remove expired file
                 try:
-                    os.remove(cache_path)
+                    self._remove_file(cache_path)
                 except Exception as e:
                     logger.warning(f"Failed to remove expired cache file {cache_path}: {e}")
                 return None
             
             # Read the file
+            started = time.perf_counter()
             with open(cache_path, 'rb') as f:
                 data = f.read()
+            self.lookup_latency.observe(time.perf_counter() - started)
+            self._touch(cache_path)
             
             file_age = datetime.now(timezone.utc) - datetime.fromtimestamp(os.path.getmtime(cache_path), tz=timezone.utc)
             logger.info(f"Local cache HIT: {cache_path} (age: {file_age}, size: {len(data)} bytes)")
@@ -80,6 +469,30 @@ class LocalCache:
             logger.error(f"Local cache retrieval error for {cache_path}: {e}")
             return None
     
+    def has_cached_screenshots(self, video_id: str, timestamp: int, qualities: List[str]) -> Dict[str, bool]:
+        """Check which qualities are cached and fresh using stat only (no image reads)
+        
+        Qualities without a file of their own may still be held by the
+        timestamp's bundle, whose header lists them.
+        """
+        presence = {}
+        cutoff = (datetime.now(timezone.utc) - self.cache_duration).timestamp()
+        for quality in qualities:
+            if self.packs and quality in self.pack_qualities:
+                if self.packs.contains(f"{video_id}_{timestamp}_{quality}", self.cache_duration.total_seconds()):
+                    presence[quality] = True
+                    continue
+            try:
+                presence[quality] = os.stat(self._get_cache_path(video_id, timestamp, quality)).st_mtime > cutoff
+            except OSError:
+                presence[quality] = False
+        
+        if not all(presence.values()):
+            for quality in self._bundle_qualities(video_id, timestamp):
+                if quality in presence:
+                    presence[quality] = True
+        return presence
+    
     async def get_cached_screenshot_async(self, video_id: str, timestamp: int, quality: str) -> Optional[bytes]:
         """Retrieve cached screenshot (asynchronous)"""
         loop = asyncio.get_event_loop()
@@ -95,17 +508,16 @@ class LocalCache:
         """Cache screenshot to local filesystem (synchronous)"""
         try:
             cache_path = self._get_cache_path(video_id, timestamp, quality)
-            
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-            
-            # Write the file
-            with open(cache_path, 'wb') as f:
-                f.write(image_data)
+            if self.packs and quality in self.pack_qualities:
+                self._write_packed(f"{video_id}_{timestamp}_{quality}", image_data, quality)
+                logger.info(f"Cached screenshot in pack: {video_id}_{timestamp}_{quality} ({len(image_data)} bytes)")
+                return
+            self._write_file(cache_path, image_data, "screenshot", quality)
             
             logger.info(f"Cached screenshot: {cache_path} ({len(image_data)} bytes)")
         except Exception as e:
             logger.error(f"Local cache storage error: {e}")
+            raise
     
     async def cache_screenshot_async(self, video_id: str, timestamp: int, quality: str, image_data: bytes):
         """Cache screenshot to local filesystem (asynchronous)"""
@@ -134,7 +546,7 @@ class LocalCache:
                 logger.info(f"Metadata cache EXPIRED: {metadata_path}")
                 # Optionally remove expired file
                 try:
-                    os.remove(metadata_path)
+                    self._remove_file(metadata_path)
                 except Exception as e:
                     logger.warning(f"Failed to remove expired metadata file {metadata_path}: {e}")
                 return None
@@ -143,6 +555,7 @@ class LocalCache:
             with open(metadata_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             
+            self._touch(metadata_path)
             logger.info(f"Metadata cache HIT: {metadata_path}")
             return data
                 
@@ -164,17 +577,12 @@ class LocalCache:
         """Cache screenshot metadata (synchronous)"""
         try:
             metadata_path = self._get_metadata_path(video_id, timestamp)
-            
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
-            
-            # Write JSON file
-            with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=2)
+            self._write_file(metadata_path, json.dumps(metadata, indent=2).encode('utf-8'), "metadata")
             
             logger.info(f"Cached metadata: {metadata_path}")
         except Exception as e:
             logger.error(f"Metadata cache error: {e}")
+            raise
     
     async def cache_metadata_async(self, video_id: str, timestamp: int, metadata: List[Dict]):
         """Cache screenshot metadata (asynchronous)"""
@@ -187,6 +595,155 @@ class LocalCache:
             metadata
         )
     
+    def get_cached_video_info(self, video_id: str) -> Optional[Dict]:
+        """Get cached per-video info (duration, title, available qualities)"""
+        try:
+            info_path = self._get_video_info_path(video_id)
+            
+            if not os.path.exists(info_path):
+                return None
+            
+            if self._is_file_expired(info_path, self.video_info_duration):
+                logger.info(f"Video info cache EXPIRED: {info_path}")
+                try:
+                    self._remove_file(info_path)
+                except Exception as e:
+                    logger.warning(f"Failed to remove expired video info file {info_path}: {e}")
+                return None
+            
+            with open(info_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            
+            self._touch(info_path)
+            logger.info(f"Video info cache HIT: {info_path}")
+            return data
+                
+        except Exception as e:
+            logger.error(f"Video info cache retrieval error: {e}")
+            return None
+    
+    def cache_video_info(self, video_id: str, video_info: Dict):
+        """Cache per-video info"""
+        try:
+            info_path = self._get_video_info_path(video_id)
+            self._write_file(info_path, json.dumps(video_info, indent=2).encode('utf-8'), "video_info")
+            
+            logger.info(f"Cached video info: {info_path}")
+        except Exception as e:
+            logger.error(f"Video info cache error: {e}")
+            raise
+    
+    def get_cached_streams(self, video_id: str) -> Optional[Dict]:
+        """Get the resolved stream table ({'streams', 'expires_at'}) if its URLs are still valid"""
+        try:
+            streams_path = self._get_streams_path(video_id)
+            
+            if not os.path.exists(streams_path):
+                return None
+            
+            with open(streams_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            
+            if time.time() >= data.get('expires_at', 0):
+                logger.info(f"Stream cache EXPIRED: {streams_path}")
+                try:
+                    self._remove_file(streams_path)
+                except Exception as e:
+                    logger.warning(f"Failed to remove expired stream file {streams_path}: {e}")
+                return None
+            
+            self._touch(streams_path)
+            logger.info(f"Stream cache HIT: {streams_path}")
+            return data
+                
+        except Exception as e:
+            logger.error(f"Stream cache retrieval error: {e}")
+            return None
+    
+    def cache_streams(self, video_id: str, streams: Dict, expires_at: float):
+        """Cache a resolved stream table until its URLs expire (epoch seconds)"""
+        try:
+            streams_path = self._get_streams_path(video_id)
+            self._write_file(streams_path, json.dumps({'streams': streams, 'expires_at': expires_at}).encode('utf-8'), "streams")
+            
+            logger.info(f"Cached streams: {streams_path}")
+        except Exception as e:
+            logger.error(f"Stream cache error: {e}")
+            raise
+    
+    def get_cached_bundle(self, video_id: str, timestamp: int) -> Optional[Tuple[List[Dict], Dict[str, bytes]]]:
+        """Metadata and every bundled image of a timestamp in one read"""
+        try:
+            bundle_path = self._get_bundle_path(video_id, timestamp)
+            if self._is_file_expired(bundle_path):
+                return None
+            
+            started = time.perf_counter()
+            with open(bundle_path, 'rb') as f:
+                data = f.read()
+            self.lookup_latency.observe(time.perf_counter() - started)
+            self._touch(bundle_path)
+            logger.info(f"Local bundle HIT: {bundle_path} (size: {len(data)} bytes)")
+            return unpack_bundle(data)
+            
+        except Exception as e:
+            logger.error(f"Bundle cache retrieval error: {e}")
+            return None
+    
+    def get_cached_bundle_image(self, video_id: str, timestamp: int, quality: str) -> Optional[bytes]:
+        """One quality out of a bundle, reading only its header and image"""
+        try:
+            bundle_path = self._get_bundle_path(video_id, timestamp)
+            if self._is_file_expired(bundle_path):
+                return None
+            
+            started = time.perf_counter()
+            with open(bundle_path, 'rb') as f:
+                span = image_range(self._read_bundle_header(f), quality)
+                if span is None:
+                    return None
+                f.seek(span[0])
+                data = f.read(span[1] - span[0])
+            self.lookup_latency.observe(time.perf_counter() - started)
+            self._touch(bundle_path)
+            logger.info(f"Local bundle HIT: {bundle_path} [{quality}] (size: {len(data)} bytes)")
+            return data
+            
+        except Exception as e:
+            logger.error(f"Bundle image retrieval error: {e}")
+            return None
+    
+    def _read_bundle_header(self, f) -> Dict:
+        """Header of the bundle open in f, reading no image bytes"""
+        prefix = f.read(HEADER_READ_BYTES)
+        needed = header_size(prefix)
+        if needed > len(prefix):
+            prefix += f.read(needed - len(prefix))
+        return parse_header(prefix)
+    
+    def _bundle_qualities(self, video_id: str, timestamp: int) -> List[str]:
+        """Qualities held by the timestamp's fresh bundle, if there is one"""
+        bundle_path = self._get_bundle_path(video_id, timestamp)
+        if self._is_file_expired(bundle_path):
+            return []
+        try:
+            with open(bundle_path, 'rb') as f:
+                return list(self._read_bundle_header(f)["images"])
+        except Exception as e:
+            logger.error(f"Bundle header read error for {bundle_path}: {e}")
+            return []
+    
+    def cache_bundle(self, video_id: str, timestamp: int, metadata: List[Dict], images: Dict[str, bytes]):
+        """Store a timestamp's metadata and images as one file"""
+        try:
+            bundle_path = self._get_bundle_path(video_id, timestamp)
+            self._write_file(bundle_path, pack_bundle(metadata, images), "bundle")
+            
+            logger.info(f"Cached bundle: {bundle_path} ({len(images)} images)")
+        except Exception as e:
+            logger.error(f"Bundle cache error: {e}")
+            raise
+    
     async def batch_check_cached_screenshots(self, video_id: str, timestamp: int, qualities: List[str]) -> Dict[str, Optional[bytes]]:
         """Check multiple screenshot qualities in parallel"""
         tasks = [
@@ -224,34 +781,22 @@ class LocalCache:
             await asyncio.gather(*cache_tasks, return_exceptions=True)
     
     def cleanup_expired_cache(self) -> int:
-        """Clean up expired cache entries"""
+        """Clean up expired cache entries (indexed query per kind, oldest first)"""
         try:
             deleted_count = 0
-            cutoff_time = datetime.now(timezone.utc) - self.cache_duration
             
-            # Clean up screenshot files
-            for filename in os.listdir(self.screenshots_dir):
-                filepath = os.path.join(self.screenshots_dir, filename)
-                try:
-                    if os.path.isfile(filepath):
-                        file_mtime = datetime.fromtimestamp(os.path.getmtime(filepath), tz=timezone.utc)
-                        if file_mtime < cutoff_time:
-                            os.remove(filepath)
-                            deleted_count += 1
-                except Exception as e:
-                    logger.warning(f"Error processing file {filepath}: {e}")
+            for kind, (_, max_age) in self._kinds.items():
+                cutoff = time.time() - max_age.total_seconds()
+                while True:
+                    paths = self.index.expired(kind, cutoff)
+                    if not paths:
+                        break
+                    self._delete_entries(paths)
+                    deleted_count += len(paths)
             
-            # Clean up metadata files
-            for filename in os.listdir(self.metadata_dir):
-                filepath = os.path.join(self.metadata_dir, filename)
-                try:
-                    if os.path.isfile(filepath):
-                        file_mtime = datetime.fromtimestamp(os.path.getmtime(filepath), tz=timezone.utc)
-                        if file_mtime < cutoff_time:
-                            os.remove(filepath)
-                            deleted_count += 1
-                except Exception as e:
-                    logger.warning(f"Error processing file {filepath}: {e}")
+            # Reclaim segment space held by deleted and expired screenshots
+            if self.packs:
+                self.packs.compact(self.cache_duration.total_seconds())
             
             logger.info(f"Cleaned up {deleted_count} expired local cache entries")
             return deleted_count
@@ -268,39 +813,19 @@ class LocalCache:
     def get_cache_stats(self) -> Dict:
         """Get cache statistics"""
         try:
-            screenshot_files = []
-            metadata_files = []
-            
-            # Count screenshot files and calculate sizes
-            total_size = 0
-            quality_counts = {}
-            
-            for filename in os.listdir(self.screenshots_dir):
-                filepath = os.path.join(self.screenshots_dir, filename)
-                if os.path.isfile(filepath):
-                    screenshot_files.append(filename)
-                    total_size += os.path.getsize(filepath)
-                    
-                    # Extract quality from filename
-                    parts = filename.split('_')
-                    if len(parts) >= 3:
-                        quality = parts[-1].split('.')[0]  # Remove .png extension
-                        quality_counts[quality] = quality_counts.get(quality, 0) + 1
-            
-            # Count metadata files
-            for filename in os.listdir(self.metadata_dir):
-                filepath = os.path.join(self.metadata_dir, filename)
-                if os.path.isfile(filepath):
-                    metadata_files.append(filename)
-                    total_size += os.path.getsize(filepath)
+            summary = self.index.summary()
             
             return {
-                "screenshot_count": len(screenshot_files),
-                "metadata_count": len(metadata_files),
-                "total_size_mb": round(total_size / (1024 * 1024), 2),
-                "quality_breakdown": quality_counts,
+                "screenshot_count": summary["counts"].get("screenshot", 0),
+                "metadata_count": summary["counts"].get("metadata", 0),
+                "total_size_mb": round(sum(summary["bytes"].values()) / (1024 * 1024), 2),
+                "quality_breakdown": summary["qualities"],
+                "indexed_entries": summary["counts"],
                 "cache_duration_hours": self.cache_duration.total_seconds() / 3600,
-                "cache_directory": self.cache_dir
+                "cache_directory": self.cache_dir,
+                "quota": self.quota_snapshot(),
+                "packstore": self.packs.snapshot() if self.packs else None,
+                "lookup_latency": self.lookup_latency.snapshot()
             }
             
         except Exception as e:
@@ -312,25 +837,15 @@ class LocalCache:
         try:
             deleted_count = 0
             
-            # Clear screenshot files
-            for filename in os.listdir(self.screenshots_dir):
-                filepath = os.path.join(self.screenshots_dir, filename)
-                try:
-                    if os.path.isfile(filepath):
-                        os.remove(filepath)
-                        deleted_count += 1
-                except Exception as e:
-                    logger.warning(f"Error removing file {filepath}: {e}")
+            while True:
+                paths = self.index.paths()
+                if not paths:
+                    break
+                self._delete_entries(paths)
+                deleted_count += len(paths)
             
-            # Clear metadata files
-            for filename in os.listdir(self.metadata_dir):
-                filepath = os.path.join(self.metadata_dir, filename)
-                try:
-                    if os.path.isfile(filepath):
-                        os.remove(filepath)
-                        deleted_count += 1
-                except Exception as e:
-                    logger.warning(f"Error removing file {filepath}: {e}")
+            if self.packs:
+                self.packs.clear()
             
             logger.info(f"Cleared all local cache: {deleted_count} files removed")
             return deleted_count
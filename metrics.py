@@ -0,0 +1,55 @@
+import threading
+from typing import Dict, List
+
+# Upper bounds (milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+class LatencyHistogram:
+    """Thread-safe fixed-bucket latency histogram"""
+    
+    def __init__(self, buckets_ms: List[float] = LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1)  # Last bucket is overflow
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, seconds: float):
+        """Record one duration"""
+        ms = seconds * 1000
+        index = len(self.buckets_ms)
+        for i, bound in enumerate(self.buckets_ms):
+            if ms <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+    
+    def percentile(self, fraction: float) -> float:
+        """Approximate percentile: upper bound of the bucket holding that rank"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets_ms[i] if i < len(self.buckets_ms) else round(self.max_ms, 2)
+        return round(self.max_ms, 2)
+    
+    def snapshot(self) -> Dict:
+        """Histogram summary for stats endpoints"""
+        buckets = {f"<={bound}ms": n for bound, n in zip(self.buckets_ms, self.counts)}
+        buckets[f">{self.buckets_ms[-1]}ms"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": round(self.max_ms, 2),
+            "buckets": buckets
+        }
@@ -0,0 +1,300 @@
+import os
+import mmap
+import struct
+import threading
+import time
+import zlib
+import logging
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Tuple, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Record layout: header, key (utf-8), data. crc32 covers key + data so torn
+# appends are detected when a segment is scanned.
+RECORD_MAGIC = b'YSPK'
+RECORD_HEADER = struct.Struct('<4sBHIId')  # magic, flags, key length, data length, crc32, written_at
+FLAG_PUT = 0
+FLAG_TOMBSTONE = 1
+
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+
+class PackStore:
+    """Append-only segment store for small blobs
+    
+    Values are appended to segment files (segment-000001.pack, ...) and
+    located through an in-memory index of key -> (segment, offset, length,
+    written_at). Reads are slices of a read-only mmap of the segment, so a
+    hit on a mapped segment is a dict lookup plus a memory copy. Deletes
+    append a tombstone; compact() rewrites sparse segments into the active
+    one and removes them.
+    
+    Appends and compaction take an flock on the store's lock file, so several
+    worker processes can share a directory. Each process learns about the
+    others' appends by rescanning segment tails on a lookup miss.
+    """
+    def __init__(self, directory: str, segment_max_bytes: int = SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        os.makedirs(directory, exist_ok=True)
+        
+        self.index: Dict[str, Tuple[int, int, int, float]] = {}  # key -> (segment, offset, length, written_at)
+        self.live_bytes: Dict[int, int] = {}  # Bytes of indexed values per segment
+        self._scanned: Dict[int, int] = {}  # Segment -> bytes already scanned
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._lock = threading.RLock()
+        self._lock_file = open(os.path.join(directory, "store.lock"), 'a+b')
+        self._last_refresh = 0.0
+        self.stats = {"reads": 0, "writes": 0, "compactions": 0, "reclaimed_bytes": 0}
+        
+        with self._locked():
+            self._refresh()
+    
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.pack")
+    
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[8:14]) for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".pack")
+        )
+    
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Exclusive across threads and, where flock exists, across processes"""
+        with self._lock:
+            if fcntl:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+    
+    def _records(self, segment: int, start: int = 0) -> Iterator[Tuple[int, int, str, int, int, float]]:
+        """Yield (record offset, flags, key, data offset, data length, written_at) from start onwards
+        
+        Stops at the first incomplete or corrupt record (an interrupted append).
+        """
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(start)
+            offset = start
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                magic, flags, key_length, data_length, crc, written_at = RECORD_HEADER.unpack(header)
+                body = f.read(key_length + data_length)
+                if magic != RECORD_MAGIC or len(body) < key_length + data_length or zlib.crc32(body) != crc:
+                    logger.warning(f"Pack segment {segment} has a bad record at offset {offset}; ignoring the rest")
+                    return
+                data_offset = offset + RECORD_HEADER.size + key_length
+                yield offset, flags, body[:key_length].decode('utf-8'), data_offset, data_length, written_at
+                offset = data_offset + data_length
+    
+    def _apply(self, segment: int, flags: int, key: str, data_offset: int, data_length: int, written_at: float):
+        """Update the index for one record"""
+        previous = self.index.pop(key, None)
+        if previous:
+            self.live_bytes[previous[0]] = self.live_bytes.get(previous[0], 0) - previous[2]
+        if flags == FLAG_PUT:
+            self.index[key] = (segment, data_offset, data_length, written_at)
+            self.live_bytes[segment] = self.live_bytes.get(segment, 0) + data_length
+    
+    def _refresh(self):
+        """Index records appended since the last scan, including other processes' appends"""
+        segments = self._segments()
+        
+        # Segments removed by another process's compaction
+        for segment in [s for s in self._scanned if s not in segments]:
+            self._scanned.pop(segment)
+            self.live_bytes.pop(segment, None)
+            mapped = self._maps.pop(segment, None)
+            if mapped:
+                mapped.close()
+            for key in [k for k, entry in self.index.items() if entry[0] == segment]:
+                del self.index[key]
+        
+        for segment in segments:
+            start = self._scanned.get(segment, 0)
+            try:
+                if os.path.getsize(self._segment_path(segment)) <= start:
+                    continue
+                end = start
+                for _, flags, key, data_offset, data_length, written_at in self._records(segment, start):
+                    self._apply(segment, flags, key, data_offset, data_length, written_at)
+                    end = data_offset + data_length
+                self._scanned[segment] = end
+            except FileNotFoundError:
+                continue
+        self._last_refresh = time.monotonic()
+    
+    def _active_segment(self) -> int:
+        """Segment new records are appended to, starting a new one when it is full"""
+        segments = self._segments()
+        if not segments:
+            return 1
+        active = segments[-1]
+        if os.path.getsize(self._segment_path(active)) >= self.segment_max_bytes:
+            return active + 1
+        return active
+    
+    def _append(self, flags: int, key: str, data: bytes, written_at: float) -> Tuple[int, int]:
+        """Append one record (caller holds the store lock); returns (segment, data offset)"""
+        encoded_key = key.encode('utf-8')
+        header = RECORD_HEADER.pack(RECORD_MAGIC, flags, len(encoded_key), len(data), zlib.crc32(encoded_key + data), written_at)
+        segment = self._active_segment()
+        
+        # Pick up other processes' appends first so offsets stay in step, and
+        # drop any torn record left by an interrupted append
+        self._refresh()
+        path = self._segment_path(segment)
+        scanned = self._scanned.get(segment, 0)
+        if os.path.exists(path) and os.path.getsize(path) > scanned:
+            os.truncate(path, scanned)
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            f.write(header + encoded_key + data)
+        
+        data_offset = offset + len(header) + len(encoded_key)
+        self._apply(segment, flags, key, data_offset, len(data), written_at)
+        self._scanned[segment] = data_offset + len(data)
+        return segment, data_offset
+    
+    def _map(self, segment: int, end: int) -> Optional[mmap.mmap]:
+        """Read-only mapping of a segment covering at least end bytes"""
+        mapped = self._maps.get(segment)
+        if mapped is not None and len(mapped) >= end:
+            return mapped
+        try:
+            with open(self._segment_path(segment), 'rb') as f:
+                remapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        if mapped is not None:
+            mapped.close()
+        self._maps[segment] = remapped
+        return remapped if len(remapped) >= end else None
+    
+    def put(self, key: str, data: bytes):
+        """Store a value, replacing any previous one"""
+        with self._locked():
+            self._append(FLAG_PUT, key, data, time.time())
+            self.stats["writes"] += 1
+    
+    def _lookup(self, key: str) -> Optional[Tuple[int, int, int, float]]:
+        """Index entry for key, rescanning (at most once a second) on a miss"""
+        entry = self.index.get(key)
+        if entry is None and time.monotonic() - self._last_refresh > 1.0:
+            self._refresh()  # Another worker may have written it
+            entry = self.index.get(key)
+        return entry
+    
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[bytes]:
+        """Value for key, or None if missing or older than max_age seconds"""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                return None
+            
+            segment, offset, length, written_at = entry
+            if max_age is not None and time.time() - written_at >= max_age:
+                return None
+            mapped = self._map(segment, offset + length)
+            if mapped is None:
+                return None
+            self.stats["reads"] += 1
+            return mapped[offset:offset + length]
+    
+    def contains(self, key: str, max_age: Optional[float] = None) -> bool:
+        """Whether a fresh value is indexed, without reading it"""
+        with self._lock:
+            entry = self._lookup(key)
+        return entry is not None and (max_age is None or time.time() - entry[3] < max_age)
+    
+    def delete(self, keys: List[str]):
+        """Remove values by appending tombstones"""
+        with self._locked():
+            for key in keys:
+                if key in self.index:
+                    self._append(FLAG_TOMBSTONE, key, b'', time.time())
+    
+    def compact(self, max_age: Optional[float] = None, min_dead_fraction: float = 0.5) -> int:
+        """Rewrite sealed segments that are mostly dead (deleted, replaced or older than max_age)
+        
+        Live records are re-appended to the active segment and the old
+        segment is removed. Returns the number of bytes reclaimed.
+        """
+        reclaimed = 0
+        with self._locked():
+            self._refresh()
+            now = time.time()
+            segments = self._segments()
+            for segment in segments[:-1]:  # The active segment is never compacted
+                size = os.path.getsize(self._segment_path(segment))
+                live = [
+                    (key, entry) for key, entry in self.index.items()
+                    if entry[0] == segment and (max_age is None or now - entry[3] < max_age)
+                ]
+                live_bytes = sum(entry[2] for _, entry in live)
+                if size and live_bytes / size > 1 - min_dead_fraction:
+                    continue
+                
+                mapped = self._map(segment, size)
+                if mapped is None:
+                    continue
+                for key, (_, offset, length, written_at) in live:
+                    self._append(FLAG_PUT, key, mapped[offset:offset + length], written_at)
+                
+                # Tombstones only matter while an older segment may still hold the value
+                if segment != segments[0]:
+                    for _, flags, key, _, _, written_at in self._records(segment):
+                        if flags == FLAG_TOMBSTONE and key not in self.index:
+                            self._append(FLAG_TOMBSTONE, key, b'', written_at)
+                
+                for key in [k for k, entry in self.index.items() if entry[0] == segment]:
+                    self._apply(segment, FLAG_TOMBSTONE, key, 0, 0, now)  # Expired values
+                self._maps.pop(segment).close()
+                os.remove(self._segment_path(segment))
+                self._scanned.pop(segment, None)
+                self.live_bytes.pop(segment, None)
+                reclaimed += size - live_bytes
+                logger.info(f"Compacted pack segment {segment}: kept {len(live)} values, reclaimed {size - live_bytes} bytes")
+        
+        self.stats["compactions"] += 1
+        self.stats["reclaimed_bytes"] += reclaimed
+        return reclaimed
+    
+    def clear(self):
+        """Remove every segment"""
+        with self._locked():
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+            for segment in self._segments():
+                os.remove(self._segment_path(segment))
+            self.index.clear()
+            self.live_bytes.clear()
+            self._scanned.clear()
+    
+    def snapshot(self) -> Dict:
+        segments = self._segments()
+        return {
+            "segments": len(segments),
+            "segment_bytes": sum(os.path.getsize(self._segment_path(s)) for s in segments),
+            "live_bytes": sum(self.live_bytes.values()),
+            "values": len(self.index),
+            **self.stats
+        }
+    
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+            self._lock_file.close()
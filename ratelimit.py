@@ -0,0 +1,162 @@
+import math
+import struct
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple, Callable
+
+from shmfile import fcntl, flocked, hash_key, open_shared_map, shm_path
+
+logger = logging.getLogger(__name__)
+
+# Shared store layout: header | slots
+SHARED_HEADER = struct.Struct('<8sIIdd')  # magic, version, slot count, rate, burst
+SHARED_MAGIC = b'YSRATE01'
+SHARED_VERSION = 1
+BUCKET_SLOT = struct.Struct('<Qdd')  # key hash, tokens, updated_at
+PROBE_LIMIT = 16
+
+class TokenBucketLimiter:
+    """Per-key token buckets held in process memory
+    
+    Each key refills at rate tokens per second up to burst. A request takes
+    its cost in tokens; charge() takes more after the fact (e.g. when the
+    request turned out to need a cold extraction) and may leave the bucket
+    in debt, down to -burst.
+    
+    A bucket idle for burst / rate seconds is full again, so forgetting it
+    loses nothing: idle keys are dropped from the least recently used end,
+    and max_keys caps memory under crawler traffic.
+    """
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate  # Tokens per second
+        self.burst = burst
+        self.max_keys = max_keys
+        self.idle_seconds = burst / rate
+        self.buckets: OrderedDict[str, List[float]] = OrderedDict()  # key -> [tokens, updated_at], least recently used first
+        self.stats = {"allowed": 0, "limited": 0, "charged_tokens": 0.0, "evicted_keys": 0}
+        self._lock = threading.Lock()
+    
+    def _refill(self, tokens: float, updated_at: float, now: float) -> float:
+        return min(self.burst, tokens + (now - updated_at) * self.rate)
+    
+    def _update(self, key: str, change: Callable[[float], float]) -> float:
+        """Refill key's bucket, apply change to its tokens and store the result"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self.buckets.pop(key, None)
+            tokens = self._refill(bucket[0], bucket[1], now) if bucket else self.burst
+            tokens = change(tokens)
+            self.buckets[key] = [tokens, now]
+            
+            # Oldest entries first: idle ones are full buckets, the rest are over the cap
+            while self.buckets:
+                oldest_key, (_, updated_at) = next(iter(self.buckets.items()))
+                if now - updated_at < self.idle_seconds and len(self.buckets) <= self.max_keys:
+                    break
+                del self.buckets[oldest_key]
+                if now - updated_at < self.idle_seconds:
+                    self.stats["evicted_keys"] += 1
+        return tokens
+    
+    def acquire(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """Take cost tokens if the bucket has them; returns (allowed, seconds until it would be)"""
+        result = {}
+        
+        def take(tokens: float) -> float:
+            result["allowed"] = tokens >= cost
+            return tokens - cost if result["allowed"] else tokens
+        
+        tokens = self._update(key, take)
+        if result["allowed"]:
+            self.stats["allowed"] += 1
+            return True, 0.0
+        self.stats["limited"] += 1
+        return False, (cost - tokens) / self.rate
+    
+    def charge(self, key: str, cost: float):
+        """Take extra tokens for work already done; the bucket may go into debt"""
+        self._update(key, lambda tokens: max(tokens - cost, -self.burst))
+        self.stats["charged_tokens"] += cost
+    
+    def key_count(self) -> int:
+        return len(self.buckets)
+    
+    def snapshot(self) -> Dict:
+        return {
+            "store": "memory",
+            "rate_per_second": round(self.rate, 4),
+            "burst": self.burst,
+            "keys": self.key_count(),
+            "max_keys": self.max_keys,
+            **self.stats
+        }
+
+class SharedTokenBucketLimiter(TokenBucketLimiter):
+    """Token buckets in a memory-mapped slot table shared by every worker on a host
+    
+    Slots are (key hash, tokens, updated_at) found by linear probing and
+    updated under an flock. A slot idle long enough to be full again is
+    reused; if a probe window has none, its least recently updated slot is
+    taken. The table has a fixed size, so memory stays bounded.
+    """
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000, path: Optional[str] = None):
+        if fcntl is None:
+            raise RuntimeError("Shared rate limiter requires fcntl (Linux/macOS)")
+        super().__init__(rate, burst, max_keys)
+        
+        self.path = path or shm_path("youtubesnapshots-ratelimit")
+        self.slot_count = 1 << math.ceil(math.log2(max(max_keys, PROBE_LIMIT)))
+        
+        self._fd, self._map, formatted = open_shared_map(
+            self.path, SHARED_HEADER, (SHARED_MAGIC, SHARED_VERSION, self.slot_count, float(rate), float(burst)),
+            SHARED_HEADER.size + self.slot_count * BUCKET_SLOT.size,
+            "holds buckets for different limits; "
+            "remove it once no worker is using it, or set another RATE_LIMIT_SHARED_PATH"
+        )
+        if formatted:
+            logger.info(f"Initialized shared rate limiter at {self.path} ({self.slot_count} slots)")
+    
+    def _slot_offset(self, index: int) -> int:
+        return SHARED_HEADER.size + (index & (self.slot_count - 1)) * BUCKET_SLOT.size
+    
+    def _update(self, key: str, change: Callable[[float], float]) -> float:
+        key_hash = hash_key(key)
+        now = time.time()  # Wall clock: comparable across processes
+        with self._lock, flocked(self._fd):
+            target = reusable = oldest = None
+            for probe in range(PROBE_LIMIT):
+                offset = self._slot_offset(key_hash + probe)
+                slot_hash, tokens, updated_at = BUCKET_SLOT.unpack_from(self._map, offset)
+                if slot_hash == key_hash:
+                    target = offset
+                    break
+                if reusable is None and (not slot_hash or now - updated_at >= self.idle_seconds):
+                    reusable = offset
+                if oldest is None or updated_at < oldest[1]:
+                    oldest = (offset, updated_at)
+            
+            if target is not None:
+                tokens = self._refill(tokens, updated_at, now)
+            else:
+                if reusable is None:
+                    reusable = oldest[0] #type: ignore
+                    self.stats["evicted_keys"] += 1
+                target = reusable
+                tokens = self.burst
+            
+            tokens = change(tokens)
+            BUCKET_SLOT.pack_into(self._map, target, key_hash, tokens, now)
+            return tokens
+    
+    def key_count(self) -> int:
+        """Keys whose buckets are not yet full again"""
+        now = time.time()
+        return sum(
+            1 for slot_hash, _, updated_at in BUCKET_SLOT.iter_unpack(self._map[SHARED_HEADER.size:])
+            if slot_hash and now - updated_at < self.idle_seconds
+        )
+    
+    def snapshot(self) -> Dict:
+        return {**super().snapshot(), "store": "shared", "path": self.path, "slots": self.slot_count}
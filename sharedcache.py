@@ -0,0 +1,182 @@
+import os
+import struct
+import threading
+import logging
+from typing import Optional, Dict
+
+from shmfile import fcntl, flocked, hash_key, open_shared_map, shm_path
+
+logger = logging.getLogger(__name__)
+
+# File layout: header | slot table | data ring
+HEADER = struct.Struct('<8sIQIQ')  # magic, version, ring size, slot count, write cursor
+HEADER_MAGIC = b'YSSHMC01'
+HEADER_VERSION = 1
+CURSOR_OFFSET = 8 + 4 + 8 + 4  # Byte offset of the write cursor in the header
+SLOT = struct.Struct('<QIQI')  # key hash, sequence, logical offset, record length
+RECORD = struct.Struct('<HI')  # key length, data length
+PROBE_LIMIT = 8
+
+class SharedMemoryCache:
+    """Fixed-size image cache shared by every worker process on a host
+    
+    Records (key + image) are appended to a ring buffer in a memory-mapped
+    file under /dev/shm; an open-addressing slot table maps key hashes to
+    record positions. Positions are logical (ever increasing), so a record
+    is intact while it lies within the last ring_size bytes written.
+    
+    Writers serialise on an flock, reserve space by advancing the cursor
+    before writing, then publish the slot under a sequence number (odd while
+    being written). Readers never lock: they read a consistent slot, copy
+    the record out of the ring, then re-read the cursor and discard the copy
+    if the writer may have overwritten it meanwhile.
+    """
+    def __init__(self, size_bytes: int, path: Optional[str] = None, slots: Optional[int] = None):
+        if fcntl is None:
+            raise RuntimeError("Shared memory cache requires fcntl (Linux/macOS)")
+        
+        self.path = path or shm_path("youtubesnapshots-cache")
+        # About one slot per 16 KB of ring, rounded up to a power of two
+        self.slot_count = slots or 1 << max(10, (size_bytes // (16 * 1024)).bit_length())
+        self.slots_offset = HEADER.size
+        self.ring_offset = self.slots_offset + self.slot_count * SLOT.size
+        self.ring_size = size_bytes
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "torn_reads": 0, "oversized": 0}
+        self._lock = threading.Lock()
+        
+        self._fd, self._map, formatted = open_shared_map(
+            self.path, HEADER, (HEADER_MAGIC, HEADER_VERSION, self.ring_size, self.slot_count),
+            self.ring_offset + self.ring_size,
+            "holds a shared cache with a different size or format; "
+            "remove it once no worker is using it, or set another SHARED_CACHE_PATH"
+        )
+        if formatted:
+            logger.info(f"Initialized shared memory cache at {self.path} ({self.ring_size} bytes, {self.slot_count} slots)")
+    
+    def _cursor(self) -> int:
+        return struct.unpack_from('<Q', self._map, CURSOR_OFFSET)[0]
+    
+    def _slot_offset(self, index: int) -> int:
+        return self.slots_offset + (index & (self.slot_count - 1)) * SLOT.size
+    
+    def _read_slot(self, index: int) -> Optional[tuple]:
+        """Consistent (hash, sequence, logical offset, length) or None while a writer holds it"""
+        offset = self._slot_offset(index)
+        slot = SLOT.unpack_from(self._map, offset)
+        if slot[1] & 1:
+            return None
+        if SLOT.unpack_from(self._map, offset)[1] != slot[1]:
+            return None
+        return slot
+    
+    def _intact(self, logical: int, cursor: int) -> bool:
+        """Whether the record at logical offset is still inside the ring"""
+        return logical >= cursor - self.ring_size
+    
+    def _find(self, key_hash: int) -> Optional[tuple]:
+        """Probe for a live slot with this key hash"""
+        cursor = self._cursor()
+        for probe in range(PROBE_LIMIT):
+            slot = self._read_slot(key_hash + probe)
+            if slot and slot[0] == key_hash and slot[3] and self._intact(slot[2], cursor):
+                return slot
+        return None
+    
+    def get(self, key: str) -> Optional[bytes]:
+        """Copy of the cached value, or None"""
+        key_hash = hash_key(key)
+        slot = self._find(key_hash)
+        if slot is None:
+            self.stats["misses"] += 1
+            return None
+        
+        _, _, logical, length = slot
+        start = logical % self.ring_size
+        if length < RECORD.size or start + length > self.ring_size:
+            self.stats["torn_reads"] += 1  # Slot fields from two different writes
+            self.stats["misses"] += 1
+            return None
+        start += self.ring_offset
+        record = self._map[start:start + length]
+        
+        # The writer reserves space before overwriting it, so a cursor that
+        # moved past this record means the copy may be torn
+        if not self._intact(logical, self._cursor()):
+            self.stats["torn_reads"] += 1
+            self.stats["misses"] += 1
+            return None
+        
+        key_length, data_length = RECORD.unpack_from(record, 0)
+        if RECORD.size + key_length + data_length != length:
+            self.stats["torn_reads"] += 1
+            self.stats["misses"] += 1
+            return None
+        if record[RECORD.size:RECORD.size + key_length] != key.encode('utf-8'):
+            self.stats["misses"] += 1  # Hash collision
+            return None
+        self.stats["hits"] += 1
+        return record[RECORD.size + key_length:RECORD.size + key_length + data_length]
+    
+    def contains(self, key: str) -> bool:
+        """Whether a live entry exists for the key's hash (no copy)"""
+        return self._find(hash_key(key)) is not None
+    
+    def put(self, key: str, data: bytes):
+        """Append a value to the ring and point the key's slot at it"""
+        encoded_key = key.encode('utf-8')
+        length = RECORD.size + len(encoded_key) + len(data)
+        if length > self.ring_size // 4:
+            self.stats["oversized"] += 1  # Would evict too much of the ring at once
+            return
+        
+        key_hash = hash_key(key)
+        with self._lock, flocked(self._fd):
+            # Reserve space; records never wrap around the end of the ring
+            logical = self._cursor()
+            if logical % self.ring_size + length > self.ring_size:
+                logical += self.ring_size - logical % self.ring_size
+            struct.pack_into('<Q', self._map, CURSOR_OFFSET, logical + length)
+            
+            start = self.ring_offset + logical % self.ring_size
+            RECORD.pack_into(self._map, start, len(encoded_key), len(data))
+            self._map[start + RECORD.size:start + length] = encoded_key + data
+            
+            # Same key, else an empty or overwritten slot, else the oldest entry in the probe window
+            cursor = logical + length
+            target = None
+            oldest = None
+            for probe in range(PROBE_LIMIT):
+                index = key_hash + probe
+                slot = SLOT.unpack_from(self._map, self._slot_offset(index))
+                if slot[0] == key_hash or not slot[3] or not self._intact(slot[2], cursor):
+                    target = index
+                    break
+                if oldest is None or slot[2] < oldest[1]:
+                    oldest = (index, slot[2])
+            if target is None:
+                target = oldest[0] #type: ignore
+            
+            # Odd sequence, then the fields, then the even sequence as its own
+            # final store, so a reader never pairs it with half-written fields
+            offset = self._slot_offset(target)
+            sequence = SLOT.unpack_from(self._map, offset)[1]
+            struct.pack_into('<I', self._map, offset + 8, sequence + 1)
+            struct.pack_into('<Q', self._map, offset, key_hash)
+            struct.pack_into('<QI', self._map, offset + 12, logical, length)
+            struct.pack_into('<I', self._map, offset + 8, sequence + 2)
+            self.stats["writes"] += 1
+    
+    def snapshot(self) -> Dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "path": self.path,
+            "ring_bytes": self.ring_size,
+            "slots": self.slot_count,
+            "bytes_written": self._cursor(),
+            "hit_rate_percentage": round(self.stats["hits"] / lookups * 100, 2) if lookups else 0,
+            **self.stats
+        }
+    
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
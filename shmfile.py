@@ -0,0 +1,58 @@
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process stores
+    fcntl = None
+
+def shm_path(name: str) -> str:
+    """Default path for a host-wide file: /dev/shm where it exists, else the temp dir"""
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(shm_dir, name)
+
+def hash_key(key: str) -> int:
+    """Non-zero 64-bit hash of a key (zero marks an empty slot)"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+@contextmanager
+def flocked(fd: int):
+    """Hold an exclusive flock on fd, shared with every other process on the host"""
+    fcntl.flock(fd, fcntl.LOCK_EX) #type: ignore
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN) #type: ignore
+
+def open_shared_map(path: str, header: struct.Struct, expected: tuple,
+                    total_size: int, mismatch: str) -> Tuple[int, mmap.mmap, bool]:
+    """Open and map a shared file, formatting it if no process has yet
+
+    The header's leading fields must equal expected; any fields after them
+    start at zero. A file formatted with another layout may be mapped by a
+    running worker, which truncating it would crash, so it raises
+    RuntimeError(mismatch) instead. Returns (fd, map, whether it was formatted).
+    """
+    if fcntl is None:
+        raise RuntimeError(f"{path} requires fcntl (Linux/macOS)")
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        with flocked(fd):
+            current = os.pread(fd, header.size, 0)
+            formatted = len(current) < header.size or not any(current)
+            if formatted:
+                os.ftruncate(fd, total_size)
+                padding = (0,) * (len(header.unpack(bytes(header.size))) - len(expected))
+                os.pwrite(fd, header.pack(*expected, *padding), 0)
+            elif header.unpack(current)[:len(expected)] != expected or os.fstat(fd).st_size != total_size:
+                raise RuntimeError(f"{path} {mismatch}")
+            return fd, mmap.mmap(fd, total_size), formatted
+    except Exception:
+        os.close(fd)
+        raise
@@ -0,0 +1,161 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py builds its caches at import time: keep them out of the working tree
+os.environ.setdefault("LOCAL_CACHE_DIR", tempfile.mkdtemp(prefix="ys-test-cache-"))
+os.environ.setdefault("RATE_LIMIT_SHARED", "false")
+os.environ.pop("GOOGLE_APPLICATION_CREDENTIALS", None)
+
+from google.api_core.exceptions import NotFound, PreconditionFailed  # noqa: E402
+
+
+class FakeBlob:
+    """Enough of google.cloud.storage.Blob for the cache backends"""
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+        self.time_created = None
+        self.updated = None
+        self.size = None
+
+    def _load(self):
+        stored = self.bucket.objects[self.name]
+        self.generation = stored["generation"]
+        self.time_created = self.updated = stored["updated"]
+        self.size = len(stored["data"])
+        return stored
+
+    def upload_from_string(self, data, content_type=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.bucket.generation += 1
+        self.bucket.objects[self.name] = {
+            "data": data,
+            "generation": self.bucket.generation,
+            "updated": datetime.now(timezone.utc)
+        }
+        self.bucket.uploads.append(self.name)
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None):
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        stored = self._load()
+        if if_generation_match is not None and stored["generation"] != if_generation_match:
+            raise PreconditionFailed(self.name)
+        self.bucket.downloads.append((self.name, start, end))
+        return stored["data"][start or 0:None if end is None else end + 1]
+
+    def delete(self):
+        self.bucket.objects.pop(self.name, None)
+
+
+class FakeBucket:
+    def __init__(self):
+        self.objects = {}
+        self.generation = 1000
+        self.uploads = []
+        self.downloads = []
+        self.metadata_requests = 0
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str):
+        self.metadata_requests += 1
+        if name not in self.objects:
+            return None
+        blob = FakeBlob(self, name)
+        blob._load()
+        return blob
+
+    def list_blobs(self, prefix: str = ""):
+        self.metadata_requests += 1
+        blobs = []
+        for name in sorted(self.objects):
+            if name.startswith(prefix):
+                blob = FakeBlob(self, name)
+                blob._load()
+                blobs.append(blob)
+        return blobs
+
+
+class FakeClient:
+    def __init__(self, *args, **kwargs):
+        self._bucket = FakeBucket()
+
+    def bucket(self, name: str) -> FakeBucket:
+        return self._bucket
+
+
+@pytest.fixture
+def gcs_cache(monkeypatch):
+    """GCSCache backed by an in-memory bucket"""
+    import gcscache
+    monkeypatch.setattr(gcscache.storage, "Client", FakeClient)
+    return gcscache.GCSCache("test-bucket")
+
+
+@pytest.fixture
+def local_cache(tmp_path):
+    from localcache import LocalCache
+    return LocalCache(str(tmp_path / "cache"))
+
+
+class FakeYouTube:
+    """Stands in for yt-dlp and ffmpeg; stream URLs carry a new signature per extraction"""
+    def __init__(self):
+        self.extractions = []
+        self.attempts = []  # (timestamp, quality, signature)
+        self.rejected = set()  # (quality, signature) answered with 403
+        self.release = None  # asyncio.Event holding extractions until set
+
+    def extract_video_info(self, url):
+        self.extractions.append(url)
+        signature = len(self.extractions)
+        return {'title': 'T', 'duration': 600, 'formats': [
+            {'height': 360, 'url': f'https://example.invalid/360.mp4?sig={signature}', 'ext': 'mp4', 'format_id': '18'},
+            {'height': 1080, 'url': f'https://example.invalid/1080.mp4?sig={signature}', 'ext': 'mp4', 'format_id': '137'}
+        ]}
+
+    async def generate_screenshot(self, stream_url, timestamp, video_id, quality):
+        import app
+        signature = int(stream_url.rsplit('=', 1)[1])
+        self.attempts.append((timestamp, quality, signature))
+        if self.release is not None:
+            await self.release.wait()
+        if (quality, signature) in self.rejected:
+            raise app.StreamExpiredError(f"{quality} stream returned 403 Forbidden")
+        image_data = app.PNG_SIGNATURE + bytes([timestamp % 256]) * 2000
+        return app.screenshot_info(video_id, timestamp, quality, image_data), image_data
+
+
+@pytest.fixture
+def youtube(monkeypatch, local_cache):
+    """app wired to a FakeYouTube, fresh per-process state and a local cache backend"""
+    import app
+    fake = FakeYouTube()
+    monkeypatch.setattr(app, "extract_video_info", fake.extract_video_info)
+    monkeypatch.setattr(app, "generate_screenshot", fake.generate_screenshot)
+    monkeypatch.setattr(app, "EXTRACTION_MODE", "per_stream")
+    monkeypatch.setattr(app.rate_limiter, "acquire", lambda key, cost=1.0: (True, 0.0))
+    monkeypatch.setattr(app, "fast_cache", app.FastCache(local_cache))
+    monkeypatch.setattr(app, "stream_cache", app.StreamCache(local_cache))
+    monkeypatch.setattr(app, "negative_cache", app.NegativeCache())
+    monkeypatch.setattr(app, "single_flight", app.SingleFlight())
+    return fake
+
+
+async def api(method, path, **kwargs):
+    """One request against the app, in process"""
+    import httpx
+    import app
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://test") as client:
+        return await client.request(method, path, **kwargs)
@@ -0,0 +1,12 @@
+import app
+
+
+def test_nearby_timestamps_share_a_run(monkeypatch):
+    monkeypatch.setattr(app, "BATCH_MAX_GAP", 60)
+
+    assert app.group_batch_timestamps([300, 10, 70, 10, 130, 191]) == [[10, 70, 130], [191], [300]]
+
+
+def test_single_timestamp_is_one_run():
+    assert app.group_batch_timestamps([42]) == [[42]]
+    assert app.group_batch_timestamps([]) == []
@@ -0,0 +1,40 @@
+import asyncio
+
+import httpx
+import pytest
+
+import app
+
+
+async def settled(write_queue):
+    """Wait for the queued bundle to reach the backend, leaving the queue running"""
+    if write_queue._changed is not None:
+        async with write_queue._changed:
+            await write_queue._changed.wait_for(lambda: not write_queue.pending and not write_queue.in_flight)
+
+
+@pytest.mark.parametrize("backend_name", ["local_cache", "gcs_cache"])
+def test_bundled_timestamp_is_a_hit_after_memory_eviction(request, monkeypatch, youtube, backend_name):
+    backend = request.getfixturevalue(backend_name)
+    fast_cache = app.FastCache(backend)
+    fast_cache.max_memory_bytes = 7000  # Room for one timestamp's images
+    monkeypatch.setattr(app, "BUNDLE_CACHE", True)
+    monkeypatch.setattr(app, "fast_cache", fast_cache)
+
+    async def run():
+        responses = []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://test") as client:
+            for seconds in (10, 20, 30, 10):
+                response = await client.post("/api/screenshots", json={
+                    "url": "https://youtu.be/bbbbbbbbbbb", "hours": 0, "minutes": 0, "seconds": seconds
+                })
+                responses.append(response.json())
+                await settled(fast_cache.write_queue)
+        return responses
+
+    responses = asyncio.run(run())
+
+    assert "bbbbbbbbbbb_10_low" not in fast_cache.memory_cache
+    assert responses[3]["cached"] is True
+    assert len(youtube.attempts) == 6
+    assert {screenshot['quality'] for screenshot in responses[3]["screenshots"]} == {"low", "ultra"}
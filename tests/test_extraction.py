@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+import pytest
+
+import app
+
+
+def test_expired_stream_retries_only_the_rejected_quality(youtube):
+    youtube.rejected.add(("ultra", 1))
+    request = app.VideoRequest(url="https://youtu.be/ccccccccccc", hours=0, minutes=0, seconds=42)
+
+    screenshots = asyncio.run(app.generate_and_cache_screenshots(request, "ccccccccccc", 42))
+
+    assert sorted(screenshot['quality'] for screenshot in screenshots) == ["low", "ultra"]
+    assert sorted(youtube.attempts) == [(42, "low", 1), (42, "ultra", 1), (42, "ultra", 2)]
+
+
+def test_cancelled_single_pass_closes_its_pipes(monkeypatch):
+    async def run_ffmpeg(cmd, owner, timeout=None, pass_fds=()):
+        # Cancelled while waiting for an extraction slot, before the readers ran
+        for fd in pass_fds:
+            os.close(fd)
+        raise asyncio.CancelledError()
+
+    monkeypatch.setattr(app, "run_ffmpeg", run_ffmpeg)
+    streams = {
+        "ultra": {"url": "https://example.invalid/1080.mp4", "height": 1080, "name": "Ultra"},
+        "low": {"url": "https://example.invalid/360.mp4", "height": 360, "name": "Low"}
+    }
+
+    async def run():
+        with pytest.raises(asyncio.CancelledError):
+            await app.generate_screenshots_single_pass(streams, 7, "ddddddddddd")
+
+    open_fds = len(os.listdir("/proc/self/fd"))
+    asyncio.run(run())
+    assert len(os.listdir("/proc/self/fd")) == open_fds
+
+
+@pytest.mark.parametrize("message, remembered", [
+    ("ERROR: [youtube] eeeeeeeeeee: Private video. Sign in if you've been granted access to this video", True),
+    ("ERROR: [youtube] eeeeeeeeeee: Sign in to confirm your age. This video may be inappropriate for some users.", True),
+    ("ERROR: [youtube] eeeeeeeeeee: Video unavailable. This video has been removed by the uploader", True),
+    ("ERROR: [youtube] eeeeeeeeeee: Unable to download API page: HTTP Error 429: Too Many Requests", False),
+    ("ERROR: [youtube] eeeeeeeeeee: Unable to download webpage: HTTP Error 503: Service Unavailable", False),
+    ("ERROR: [youtube] eeeeeeeeeee: Unable to download webpage: <urlopen error [Errno 101] Network is unreachable>", False),
+])
+def test_only_permanent_extraction_errors_are_remembered(monkeypatch, message, remembered):
+    def extract_video_info(url):
+        raise app.yt_dlp.utils.DownloadError(message)
+
+    monkeypatch.setattr(app, "extract_video_info", extract_video_info)
+    monkeypatch.setattr(app, "negative_cache", app.NegativeCache())
+
+    with pytest.raises(app.yt_dlp.utils.DownloadError):
+        asyncio.run(app.extract_video_info_async("https://youtu.be/eeeeeeeeeee"))
+
+    assert bool(app.negative_cache.get(("extract", "eeeeeeeeeee"))) is remembered
+
+
+@pytest.mark.parametrize("stderr, remembered", [
+    (b"[mov,mp4] moov atom not found\nInvalid data found when processing input", True),
+    (b"[tls] Error in the pull function.\nConnection reset by peer", False),
+    (b"[https] HTTP error 503 Service Unavailable\nServer returned 5XX Server Error reply", False),
+])
+def test_only_deterministic_ffmpeg_failures_are_remembered(monkeypatch, stderr, remembered):
+    async def run_ffmpeg(cmd, owner, timeout=None, pass_fds=()):
+        raise app.subprocess.CalledProcessError(1, cmd, b"", stderr)
+
+    monkeypatch.setattr(app, "run_ffmpeg", run_ffmpeg)
+    monkeypatch.setattr(app, "negative_cache", app.NegativeCache())
+
+    assert asyncio.run(app.generate_screenshot("https://example.invalid/v.mp4", 5, "ggggggggggg", "low")) is None
+    assert asyncio.run(app.generate_screenshot_run("https://example.invalid/v.mp4", [10, 20], "ggggggggggg", "low")) == {}
+
+    for timestamp in (5, 10, 20):
+        assert bool(app.negative_cache.get(("ffmpeg", "ggggggggggg", timestamp, "low"))) is remembered
@@ -0,0 +1,63 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import gcscache
+from bundle import pack_bundle
+
+
+def later(monkeypatch, hours):
+    now = time.time() + hours * 3600
+    monkeypatch.setattr(gcscache.time, "time", lambda: now)
+
+
+def test_read_is_one_request_with_freshness_inside_the_object(gcs_cache, monkeypatch):
+    gcs_cache.cache_screenshot("aaaaaaaaaaa", 5, "high", b"image")
+    assert gcs_cache.get_cached_screenshot("aaaaaaaaaaa", 5, "high") == b"image"
+    assert len(gcs_cache.bucket.downloads) == 1
+    assert gcs_cache.bucket.metadata_requests == 0
+
+    later(monkeypatch, 25)
+    assert gcs_cache.get_cached_screenshot("aaaaaaaaaaa", 5, "high") is None
+
+
+def test_unstamped_object_falls_back_to_last_modified(gcs_cache):
+    # Written before objects carried their write time
+    gcs_cache.bucket.blob("metadata/aaaaaaaaaaa_5.json").upload_from_string(b'[{"quality": "high"}]')
+    assert gcs_cache.get_cached_metadata("aaaaaaaaaaa", 5) == [{"quality": "high"}]
+    assert gcs_cache.bucket.metadata_requests == 1
+
+    stored = gcs_cache.bucket.objects["metadata/aaaaaaaaaaa_5.json"]
+    stored["updated"] = datetime.now(timezone.utc) - timedelta(hours=25)
+    assert gcs_cache.get_cached_metadata("aaaaaaaaaaa", 5) is None
+
+
+def test_bundle_reads_are_single_requests(gcs_cache, monkeypatch):
+    gcs_cache.cache_bundle("aaaaaaaaaaa", 5, [{"quality": "low"}], {"low": b"L" * 10})
+    assert gcs_cache.get_cached_bundle("aaaaaaaaaaa", 5) == ([{"quality": "low"}], {"low": b"L" * 10})
+    assert gcs_cache.get_cached_bundle_image("aaaaaaaaaaa", 5, "low") == b"L" * 10
+    assert len(gcs_cache.bucket.downloads) == 2
+    assert gcs_cache.bucket.metadata_requests == 0
+
+    gcs_cache._bundle_headers.clear()
+    later(monkeypatch, 25)
+    assert gcs_cache.get_cached_bundle("aaaaaaaaaaa", 5) is None
+    assert gcs_cache.get_cached_bundle_image("aaaaaaaaaaa", 5, "low") is None
+
+
+def test_bundle_image_is_one_ranged_read_once_header_is_known(gcs_cache):
+    gcs_cache.cache_bundle("aaaaaaaaaaa", 5, [{"quality": "low"}, {"quality": "high"}],
+                           {"low": b"L" * 10, "high": b"H" * 9000})
+    assert gcs_cache.get_cached_bundle_image("aaaaaaaaaaa", 5, "high") == b"H" * 9000
+
+    gcs_cache.bucket.downloads.clear()
+    assert gcs_cache.get_cached_bundle_image("aaaaaaaaaaa", 5, "high") == b"H" * 9000
+    assert len(gcs_cache.bucket.downloads) == 1
+
+
+def test_rewritten_bundle_rereads_header(gcs_cache):
+    gcs_cache.cache_bundle("aaaaaaaaaaa", 5, [], {"low": b"L" * 10, "high": b"H" * 9000})
+    assert gcs_cache.get_cached_bundle_image("aaaaaaaaaaa", 5, "high") == b"H" * 9000
+
+    # Another worker rewrites the bundle with different offsets
+    gcs_cache.bucket.blob("bundles/aaaaaaaaaaa_5.bin").upload_from_string(pack_bundle([], {"high": b"N" * 5000}))
+    assert gcs_cache.get_cached_bundle_image("aaaaaaaaaaa", 5, "high") == b"N" * 5000
@@ -0,0 +1,27 @@
+import app
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: now[0])
+    cache = app.NegativeCache(ttl=60, max_items=10)
+    cache.add(("extract", "v"), "Private video")
+    cache.add(("timestamp", "v", 900), "beyond the end", ttl=5)
+
+    now[0] += 10
+    assert cache.get(("extract", "v")) == "Private video"
+    assert cache.get(("timestamp", "v", 900)) is None
+
+    now[0] += 60
+    assert cache.get(("extract", "v")) is None
+    assert cache.snapshot()["size"] == 0
+
+
+def test_oldest_entries_are_dropped_at_the_cap():
+    cache = app.NegativeCache(ttl=60, max_items=2)
+    for video_id in ("a", "b", "c"):
+        cache.add(("extract", video_id), "Video unavailable")
+
+    assert cache.get(("extract", "a")) is None
+    assert cache.get(("extract", "c")) == "Video unavailable"
+    assert cache.snapshot()["by_kind"] == {"extract": 2}
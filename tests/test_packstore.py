@@ -0,0 +1,40 @@
+import packstore
+from packstore import PackStore
+
+
+def test_contains_sees_values_packed_by_another_worker(tmp_path, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(packstore.time, "monotonic", lambda: now[0])
+    first = PackStore(str(tmp_path))
+    second = PackStore(str(tmp_path))
+    first.put("x", b"value")
+
+    now[0] += 1.5
+    assert second.contains("x")
+    assert second.get("x") == b"value"
+
+
+
+def test_periodic_cleanup_compacts_packs_without_a_quota(tmp_path, monkeypatch):
+    import asyncio
+    import app
+    from localcache import LocalCache
+    local_cache = LocalCache(str(tmp_path / "cache"), pack_qualities=["low"])
+    local_cache.packs = PackStore(str(tmp_path / "packs"), segment_max_bytes=64)
+    monkeypatch.setattr(app, "cache_backend", local_cache)
+    for version in range(4):
+        local_cache.cache_screenshot("aaaaaaaaaaa", 5, "low", bytes([version]) * 40)  # One segment each
+
+    async def run():
+        cleanup = asyncio.create_task(app.local_cache_cleanup_loop(0.01))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if local_cache.packs.stats["compactions"]:
+                break
+        cleanup.cancel()
+
+    asyncio.run(run())
+
+    assert local_cache.packs.stats["reclaimed_bytes"] > 0
+    assert local_cache.packs.snapshot()["segments"] == 1
+    assert local_cache.get_cached_screenshot("aaaaaaaaaaa", 5, "low") == bytes([3]) * 40
@@ -0,0 +1,69 @@
+import asyncio
+
+import httpx
+
+import app
+from tieredcache import TieredCache, WRITE_THROUGH
+
+
+def test_gcs_presence_without_downloads(gcs_cache):
+    gcs_cache.cache_screenshot("aaaaaaaaaaa", 5, "high", b"high-image")
+    fast_cache = app.FastCache(gcs_cache)
+
+    presence = asyncio.run(fast_cache.has_screenshots("aaaaaaaaaaa", 5, ["high", "low"]))
+
+    assert presence == {"high": True, "low": False}
+    assert gcs_cache.bucket.downloads == []
+
+
+def test_tiered_presence_asks_gcs_for_what_local_lacks(local_cache, gcs_cache):
+    local_cache.cache_screenshot("aaaaaaaaaaa", 5, "low", b"low-image")
+    gcs_cache.cache_screenshot("aaaaaaaaaaa", 5, "high", b"high-image")
+    backend = TieredCache([("local", local_cache, WRITE_THROUGH), ("gcs", gcs_cache, WRITE_THROUGH)])
+    fast_cache = app.FastCache(backend)
+
+    presence = asyncio.run(fast_cache.has_screenshots("aaaaaaaaaaa", 5, ["high", "low", "ultra"]))
+
+    assert presence == {"high": True, "low": True, "ultra": False}
+    assert gcs_cache.bucket.downloads == []
+
+
+def test_batch_serves_cached_frames_without_downloading(monkeypatch, gcs_cache):
+    for timestamp in (10, 20):
+        gcs_cache.cache_screenshot("aaaaaaaaaaa", timestamp, "high", b"high-image")
+    monkeypatch.setattr(app, "fast_cache", app.FastCache(gcs_cache))
+    monkeypatch.setattr(app.rate_limiter, "acquire", lambda key, cost=1.0: (True, 0.0))
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://test") as client:
+            return await client.post("/api/screenshots/batch", json={
+                "url": "https://youtu.be/aaaaaaaaaaa", "timestamps": [20, 10], "quality": "high"
+            })
+
+    response = asyncio.run(run()).json()
+
+    assert [screenshot["timestamp"] for screenshot in response["screenshots"]] == [10, 20]
+    assert all(screenshot["cached"] for screenshot in response["screenshots"])
+    assert gcs_cache.bucket.downloads == []
+
+
+def test_recently_failed_quality_does_not_turn_a_hit_into_extraction(monkeypatch, youtube):
+    from conftest import api
+    video_id = "hhhhhhhhhhh"
+    image_data = app.PNG_SIGNATURE + b"ultra"
+    charges = []
+    monkeypatch.setattr(app.rate_limiter, "charge", lambda key, cost: charges.append(cost))
+
+    async def run():
+        await app.fast_cache.store_video_info(video_id, {'title': 'T', 'duration': 600, 'qualities': ['ultra', 'low']})
+        await app.fast_cache.store_screenshot(video_id, 10, "ultra", image_data)
+        await app.fast_cache.store_metadata(video_id, 10, [app.screenshot_info(video_id, 10, "ultra", image_data)])
+        app.negative_cache.add(("ffmpeg", video_id, 10, "low"), "no frame decoded")
+        return await api("POST", "/api/screenshots", json={"url": f"https://youtu.be/{video_id}", "seconds": 10})
+
+    response = asyncio.run(run()).json()
+
+    assert response["cached"] is True
+    assert [screenshot["quality"] for screenshot in response["screenshots"]] == ["ultra"]
+    assert youtube.extractions == [] and youtube.attempts == []
+    assert charges == []
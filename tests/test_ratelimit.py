@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from ratelimit import TokenBucketLimiter, SharedTokenBucketLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls both clocks the limiters read"""
+    import ratelimit
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(ratelimit.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture(params=["memory", "shared"])
+def limiter(request, tmp_path, clock):
+    if request.param == "memory":
+        return TokenBucketLimiter(rate=1.0, burst=3, max_keys=64)
+    return SharedTokenBucketLimiter(rate=1.0, burst=3, max_keys=64, path=str(tmp_path / "ratelimit"))
+
+
+def test_bucket_empties_and_refills(limiter, clock):
+    assert [limiter.acquire("client")[0] for _ in range(4)] == [True, True, True, False]
+    assert limiter.acquire("client") == (False, 1.0)
+
+    clock[0] += 2
+    assert limiter.acquire("client", 2) == (True, 0.0)
+    assert limiter.acquire("other")[0]
+
+
+def test_charge_goes_into_debt_down_to_minus_burst(limiter, clock):
+    limiter.charge("client", 100)
+
+    allowed, retry_after = limiter.acquire("client")
+    assert not allowed
+    assert retry_after == pytest.approx(4.0)  # From -3 tokens back to 1
+
+    clock[0] += 4
+    assert limiter.acquire("client")[0]
+
+
+def test_idle_keys_are_forgotten(clock):
+    limiter = TokenBucketLimiter(rate=1.0, burst=3, max_keys=64)
+    limiter.acquire("a")
+    clock[0] += 3
+    limiter.acquire("b")
+
+    assert list(limiter.buckets) == ["b"]
+    assert limiter.stats["evicted_keys"] == 0
+
+
+def test_max_keys_evicts_least_recently_used(clock):
+    limiter = TokenBucketLimiter(rate=1.0, burst=3, max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.acquire(key, 3)
+
+    assert list(limiter.buckets) == ["b", "c"]
+    assert limiter.stats["evicted_keys"] == 1
+
+
+def test_shared_limiter_is_one_budget_across_workers(tmp_path, clock):
+    path = str(tmp_path / "ratelimit")
+    first = SharedTokenBucketLimiter(1.0, 2, max_keys=64, path=path)
+    second = SharedTokenBucketLimiter(1.0, 2, max_keys=64, path=path)
+
+    assert first.acquire("client", 2)[0]
+    assert not second.acquire("client")[0]
+    assert second.key_count() == 1
+
+
+def test_shared_limiter_reuses_the_oldest_slot_of_a_full_window(tmp_path, clock, monkeypatch):
+    import ratelimit
+    limiter = SharedTokenBucketLimiter(1.0, 3, max_keys=16, path=str(tmp_path / "ratelimit"))
+    # Every key hashes to the same probe window
+    monkeypatch.setattr(ratelimit, "hash_key", lambda key: int(key[3:]) + 1 << 16)
+    for i in range(ratelimit.PROBE_LIMIT + 1):
+        clock[0] += 0.01
+        limiter.acquire(f"key{i}", 3)
+
+    assert limiter.stats["evicted_keys"] == 1
+    assert limiter.acquire("key0")[0]  # Its slot was taken: a full bucket again
+
+
+def test_shared_limiter_refuses_other_limits_on_live_file(tmp_path):
+    path = str(tmp_path / "ratelimit")
+    running = SharedTokenBucketLimiter(1.0, 2, max_keys=64, path=path)
+    assert running.acquire("client", 2)[0]
+    size = os.path.getsize(path)
+
+    with pytest.raises(RuntimeError):
+        SharedTokenBucketLimiter(1.0, 5, max_keys=64, path=path)
+
+    assert os.path.getsize(path) == size
+    assert not running.acquire("client")[0]
+    assert SharedTokenBucketLimiter(1.0, 2, max_keys=64, path=path).acquire("client")[0] is False
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+import app
+
+
+def test_configured_slots_override_detection(monkeypatch):
+    monkeypatch.setenv("FFMPEG_SLOTS", "3")
+    assert app.detect_cpu_slots() == 3
+    monkeypatch.setenv("FFMPEG_SLOTS", "0")
+    assert app.detect_cpu_slots() == 1
+
+
+def test_detected_slots_are_at_least_one(monkeypatch):
+    monkeypatch.delenv("FFMPEG_SLOTS", raising=False)
+    assert app.detect_cpu_slots() >= 1
+
+
+def test_slots_are_bounded_and_owners_take_turns():
+    scheduler = app.ExtractionScheduler(slots=1)
+    order = []
+
+    async def job(owner, name):
+        await scheduler.acquire(owner)
+        order.append(name)
+        await asyncio.sleep(0)
+        scheduler.release()
+
+    async def run():
+        await scheduler.acquire("holder")
+        # Video a queues three jobs before video b queues one
+        tasks = [asyncio.create_task(job("a", f"a{i}")) for i in range(3)]
+        tasks.append(asyncio.create_task(job("b", "b0")))
+        await asyncio.sleep(0)
+        assert scheduler.snapshot()["queue_depth"] == 4
+        assert scheduler.running == 1
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["a0", "b0", "a1", "a2"]
+    assert scheduler.running == 0
+    assert scheduler.queue_depth == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    scheduler = app.ExtractionScheduler(slots=1)
+
+    async def run():
+        await scheduler.acquire("holder")
+        waiter = asyncio.create_task(scheduler.acquire("a"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.queue_depth == 0 and not scheduler.waiting
+        scheduler.release()
+
+    asyncio.run(run())
+    assert scheduler.running == 0
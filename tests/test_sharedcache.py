@@ -0,0 +1,51 @@
+import os
+import struct
+
+import pytest
+
+from sharedcache import SharedMemoryCache
+from shmfile import hash_key
+
+
+def test_round_trip_and_overwrite(tmp_path):
+    cache = SharedMemoryCache(64 * 1024, str(tmp_path / "shm"))
+    cache.put("a", b"first")
+    cache.put("b", b"other")
+    cache.put("a", b"second")
+
+    assert cache.get("a") == b"second"
+    assert cache.get("b") == b"other"
+    assert cache.get("c") is None
+    cache.close()
+
+
+def test_different_size_refuses_to_reformat_live_file(tmp_path):
+    path = str(tmp_path / "shm")
+    running = SharedMemoryCache(64 * 1024, path)
+    running.put("a", b"image")
+    size = os.path.getsize(path)
+
+    with pytest.raises(RuntimeError):
+        SharedMemoryCache(128 * 1024, path)
+
+    assert os.path.getsize(path) == size
+    assert running.get("a") == b"image"
+    running.close()
+
+
+def test_slot_pointing_outside_ring_is_a_miss(tmp_path):
+    cache = SharedMemoryCache(64 * 1024, str(tmp_path / "shm"))
+    cache.put("a", b"image")
+    slot = cache._find(hash_key("a"))
+    offset = cache._slot_offset(hash_key("a"))  # First probe: the slot is empty
+
+    # A length the ring cannot hold, then one that disagrees with the record
+    struct.pack_into('<QI', cache._map, offset + 12, slot[2], cache.ring_size)
+    assert cache.get("a") is None
+    struct.pack_into('<QI', cache._map, offset + 12, slot[2], slot[3] + 1)
+    assert cache.get("a") is None
+    assert cache.stats["torn_reads"] == 2
+
+    struct.pack_into('<QI', cache._map, offset + 12, slot[2], slot[3])
+    assert cache.get("a") == b"image"
+    cache.close()
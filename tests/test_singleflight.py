@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+import app
+
+
+def test_concurrent_callers_share_one_job():
+    flight = app.SingleFlight()
+    runs = []
+
+    async def job():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(flight.run(("screenshots", "v", 1), job) for _ in range(3)))
+
+    assert asyncio.run(run()) == ["result"] * 3
+    assert runs == [1]
+    assert flight.stats == {"leaders": 1, "coalesced": 2}
+    assert flight.in_flight == {}
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_job():
+    flight = app.SingleFlight()
+    release = None
+
+    async def job():
+        await release.wait()
+        return "result"
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        leader = asyncio.create_task(flight.run(("cli", "v", 1, "low"), job))
+        follower = asyncio.create_task(flight.run(("cli", "v", 1, "low"), job))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "result"
+
+
+def test_failed_job_is_not_remembered():
+    flight = app.SingleFlight()
+    attempts = []
+
+    async def job():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("transient")
+        return "result"
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await flight.run(("extract", "v"), job)
+        return await flight.run(("extract", "v"), job)
+
+    assert asyncio.run(run()) == "result"
+    assert len(attempts) == 2
+
+
+def test_partial_hit_and_cli_request_do_not_share_a_job(youtube):
+    from conftest import api
+    video_id = "fffffffffff"
+    image_data = app.PNG_SIGNATURE + b"ultra"
+
+    async def run():
+        # Ultra is cached, low is missing: the partial hit regenerates exactly one quality
+        await app.fast_cache.store_video_info(video_id, {'title': 'T', 'duration': 600, 'qualities': ['ultra', 'low']})
+        await app.fast_cache.store_screenshot(video_id, 10, "ultra", image_data)
+        await app.fast_cache.store_metadata(video_id, 10, [
+            app.screenshot_info(video_id, 10, "ultra", image_data),
+            app.screenshot_info(video_id, 10, "low", image_data)
+        ])
+        youtube.release = asyncio.Event()
+        cli = asyncio.create_task(api("GET", "/api/cli/screenshot", params={
+            "url": f"https://youtu.be/{video_id}", "timestamp": 10, "quality": "low"
+        }))
+        screenshots = asyncio.create_task(api("POST", "/api/screenshots", json={
+            "url": f"https://youtu.be/{video_id}", "seconds": 10
+        }))
+        for _ in range(100):  # Both jobs start unless one joined the other
+            if len(youtube.attempts) == 2:
+                break
+            await asyncio.sleep(0.01)
+        youtube.release.set()
+        return await cli, await screenshots
+
+    cli, screenshots = asyncio.run(run())
+
+    assert cli.status_code == 200 and cli.content.startswith(app.PNG_SIGNATURE)
+    assert screenshots.status_code == 200
+    assert {s["quality"] for s in screenshots.json()["screenshots"]} == {"ultra", "low"}
@@ -0,0 +1,46 @@
+import time
+from datetime import datetime, timedelta
+
+import app
+
+
+def streams(*urls):
+    return {f"q{i}": {"url": url} for i, url in enumerate(urls)}
+
+
+def test_expiry_comes_from_the_earliest_signed_url():
+    cache = app.StreamCache()
+    now = int(time.time())
+    expires_at = cache._expires_at(streams(
+        f"https://rr1.googlevideo.com/videoplayback?expire={now + 3600}&sig=a",
+        f"https://rr2.googlevideo.com/videoplayback/expire/{now + 1800}/sig/b"
+    ))
+
+    assert expires_at == datetime.fromtimestamp(now + 1800) - cache.expiry_margin
+
+
+def test_unsigned_urls_get_the_default_duration():
+    cache = app.StreamCache()
+    expires_at = cache._expires_at(streams("https://example.invalid/video.mp4"))
+
+    assert abs(expires_at - (datetime.now() + cache.default_duration)) < timedelta(seconds=5)
+
+
+def test_expired_entries_are_dropped():
+    cache = app.StreamCache()
+    past = int(time.time()) - 60
+    cache.cache_streams("a", streams(f"https://example.invalid/v?expire={past}"))
+
+    assert cache.get_streams("a") is None
+    assert "a" not in cache.cache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = app.StreamCache()
+    cache.max_items = 2
+    cache.cache_streams("a", streams("https://example.invalid/a"))
+    cache.cache_streams("b", streams("https://example.invalid/b"))
+    cache.get_streams("a")
+    cache.cache_streams("c", streams("https://example.invalid/c"))
+
+    assert list(cache.cache) == ["a", "c"]
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import app
+
+
+def test_writes_to_a_queued_key_are_merged():
+    queue = app.WriteBehindQueue(workers=1, max_items=10, max_bytes=1000)
+    gate = threading.Event()
+    written = []
+
+    def write(key, value):
+        gate.wait(5)
+        written.append((key, value))
+
+    async def run():
+        await queue.put("busy", write, "busy", 0, size=1)
+        await asyncio.sleep(0.05)  # The worker is now blocked on "busy"
+        for value in range(3):
+            await queue.put("k", write, "k", value, size=10)
+        assert queue.snapshot()["depth"] == 1
+        assert queue.pending_bytes == 10
+        gate.set()
+        return await queue.drain(5)
+
+    assert asyncio.run(run()) == []
+    assert written == [("busy", 0), ("k", 2)]
+    assert queue.stats["enqueued"] == 2 and queue.stats["merged"] == 2 and queue.stats["written"] == 2
+
+
+def test_full_queue_applies_backpressure():
+    queue = app.WriteBehindQueue(workers=1, max_items=1, max_bytes=1000)
+    gate = threading.Event()
+
+    async def run():
+        await queue.put("busy", gate.wait, 5, size=1)
+        await asyncio.sleep(0.05)
+        await queue.put("a", lambda: None, size=1)
+        blocked = asyncio.create_task(queue.put("b", lambda: None, size=1))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        gate.set()
+        await asyncio.wait_for(blocked, 5)
+        return await queue.drain(5)
+
+    assert asyncio.run(run()) == []
+    assert queue.stats["backpressure_waits"] == 1
+    assert queue.stats["written"] == 3
+
+
+def test_failed_writes_are_counted():
+    queue = app.WriteBehindQueue(workers=1, max_items=10, max_bytes=1000)
+
+    def fail():
+        raise OSError("upload failed")
+
+    async def run():
+        await queue.put("a", fail, size=1)
+        return await queue.drain(5)
+
+    assert asyncio.run(run()) == []
+    assert queue.stats["failed"] == 1 and queue.stats["written"] == 0
+
+
+def test_drain_reports_writes_left_behind():
+    queue = app.WriteBehindQueue(workers=1, max_items=10, max_bytes=1000)
+    gate = threading.Event()
+
+    async def run():
+        await queue.put("slow", gate.wait, 5, size=1)
+        await queue.put("queued", lambda: None, size=1)
+        await asyncio.sleep(0.05)
+        left = await queue.drain(0.05)
+        gate.set()
+        return left
+
+    assert sorted(asyncio.run(run())) == ["queued", "slow"]
+
+
+def test_backend_write_failures_reach_the_counters(monkeypatch, gcs_cache, local_cache):
+    import conftest
+    from tieredcache import TieredCache, WRITE_THROUGH
+
+    def fail(self, data, content_type=None):
+        raise OSError("upload failed")
+
+    monkeypatch.setattr(conftest.FakeBlob, "upload_from_string", fail)
+    tiered = TieredCache([("local", local_cache, WRITE_THROUGH), ("gcs", gcs_cache, WRITE_THROUGH)])
+    tiered.cache_screenshot("vid", 10, "720p", b"jpeg")
+    assert tiered.stats["gcs"]["write_errors"] == 1
+    assert tiered.stats["local"]["writes"] == 1
+
+    fast = app.FastCache(gcs_cache)
+
+    async def run():
+        await fast.store_screenshot("vid", 10, "720p", b"jpeg")
+        return await fast.write_queue.drain(5)
+
+    assert asyncio.run(run()) == []
+    assert fast.write_queue.stats["failed"] == 1 and fast.write_queue.stats["written"] == 0
@@ -0,0 +1,197 @@
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple, Any, Callable
+from metrics import LatencyHistogram
+
+# Set up logging for better debugging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WRITE_THROUGH = "through"  # Written before the call returns
+WRITE_BEHIND = "behind"  # Queued on the tier's background writer
+
+class TieredCache:
+    """Chain of cache backends, fastest first (e.g. local disk -> GCS)
+    
+    Exposes the same synchronous interface as GCSCache and LocalCache.
+    Reads try each tier in order and promote hits into the faster tiers;
+    writes go to every tier using that tier's write policy. A write-behind
+    tier with max_pending_writes queued writes takes further writes inline,
+    pushing backpressure onto the caller.
+    """
+    def __init__(self, tiers: List[Tuple[str, Any, str]], max_pending_writes: int = 256):
+        self.tiers = tiers  # (name, backend, write policy)
+        self.max_pending_writes = max_pending_writes
+        self.lookup_latency = LatencyHistogram()  # End-to-end lookup latency across tiers
+        self.stats: Dict[str, Dict[str, int]] = {
+            name: {"hits": 0, "misses": 0, "writes": 0, "write_errors": 0, "pending_writes": 0, "inline_writes": 0}
+            for name, _, _ in tiers
+        }
+        self._stats_lock = threading.Lock()
+        self._writers = {
+            name: ThreadPoolExecutor(max_workers=4, thread_name_prefix=f"{name}-writer")
+            for name, _, policy in tiers if policy == WRITE_BEHIND
+        }
+    
+    def _count(self, name: str, stat: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[name][stat] += n
+    
+    def _write(self, name: str, backend: Any, policy: str, method: str, *args):
+        """Write to one tier, inline or on its background writer"""
+        def write(queued: bool):
+            try:
+                getattr(backend, method)(*args)
+                self._count(name, "writes")
+            except Exception as e:
+                self._count(name, "write_errors")
+                logger.error(f"{name} tier {method} error: {e}")
+            finally:
+                if queued:
+                    self._count(name, "pending_writes", -1)
+        
+        if policy == WRITE_BEHIND:
+            with self._stats_lock:
+                queued = self.stats[name]["pending_writes"] < self.max_pending_writes
+                self.stats[name]["pending_writes" if queued else "inline_writes"] += 1
+            if queued:
+                self._writers[name].submit(write, True)
+                return
+        write(False)
+    
+    def _write_all(self, method: str, *args, upto: Optional[int] = None):
+        """Write to every tier, or only to the tiers before index upto (promotion)"""
+        for name, backend, policy in self.tiers[:upto]:
+            self._write(name, backend, policy, method, *args)
+    
+    def _read(self, read: Callable[[Any], Any], promote: Callable[[int, Any], None]) -> Any:
+        """Return the first tier's hit, promoting it into the tiers in front of it"""
+        started = time.perf_counter()
+        try:
+            for i, (name, backend, _) in enumerate(self.tiers):
+                value = read(backend)
+                if value is None:
+                    self._count(name, "misses")
+                    continue
+                self._count(name, "hits")
+                if i:
+                    promote(i, value)
+                return value
+            return None
+        finally:
+            self.lookup_latency.observe(time.perf_counter() - started)
+    
+    def get_cached_screenshot(self, video_id: str, timestamp: int, quality: str) -> Optional[bytes]:
+        return self._read(
+            lambda backend: backend.get_cached_screenshot(video_id, timestamp, quality),
+            lambda i, data: self._write_all("cache_screenshot", video_id, timestamp, quality, data, upto=i)
+        )
+    
+    def has_cached_screenshots(self, video_id: str, timestamp: int, qualities: List[str]) -> Dict[str, bool]:
+        """Presence per quality, asking slower tiers only about what faster ones lack"""
+        presence = {quality: False for quality in qualities}
+        for _, backend, _ in self.tiers:
+            missing = [quality for quality, present in presence.items() if not present]
+            if not missing:
+                break
+            presence.update(backend.has_cached_screenshots(video_id, timestamp, missing))
+        return presence
+    
+    def cache_screenshot(self, video_id: str, timestamp: int, quality: str, image_data: bytes):
+        self._write_all("cache_screenshot", video_id, timestamp, quality, image_data)
+    
+    def get_cached_metadata(self, video_id: str, timestamp: int) -> Optional[List[Dict]]:
+        return self._read(
+            lambda backend: backend.get_cached_metadata(video_id, timestamp),
+            lambda i, metadata: self._write_all("cache_metadata", video_id, timestamp, metadata, upto=i)
+        )
+    
+    def cache_metadata(self, video_id: str, timestamp: int, metadata: List[Dict]):
+        self._write_all("cache_metadata", video_id, timestamp, metadata)
+    
+    def get_cached_video_info(self, video_id: str) -> Optional[Dict]:
+        return self._read(
+            lambda backend: backend.get_cached_video_info(video_id),
+            lambda i, video_info: self._write_all("cache_video_info", video_id, video_info, upto=i)
+        )
+    
+    def cache_video_info(self, video_id: str, video_info: Dict):
+        self._write_all("cache_video_info", video_id, video_info)
+    
+    def get_cached_streams(self, video_id: str) -> Optional[Dict]:
+        return self._read(
+            lambda backend: backend.get_cached_streams(video_id),
+            lambda i, entry: self._write_all("cache_streams", video_id, entry['streams'], entry['expires_at'], upto=i)
+        )
+    
+    def cache_streams(self, video_id: str, streams: Dict, expires_at: float):
+        self._write_all("cache_streams", video_id, streams, expires_at)
+    
+    def get_cached_bundle(self, video_id: str, timestamp: int) -> Optional[Tuple[List[Dict], Dict[str, bytes]]]:
+        return self._read(
+            lambda backend: backend.get_cached_bundle(video_id, timestamp),
+            lambda i, bundle: self._write_all("cache_bundle", video_id, timestamp, *bundle, upto=i)
+        )
+    
+    def get_cached_bundle_image(self, video_id: str, timestamp: int, quality: str) -> Optional[bytes]:
+        # A single image is not enough to rebuild the bundle in faster tiers
+        return self._read(
+            lambda backend: backend.get_cached_bundle_image(video_id, timestamp, quality),
+            lambda i, data: None
+        )
+    
+    def cache_bundle(self, video_id: str, timestamp: int, metadata: List[Dict], images: Dict[str, bytes]):
+        self._write_all("cache_bundle", video_id, timestamp, metadata, images)
+    
+    def cleanup_expired_cache(self) -> int:
+        return sum(backend.cleanup_expired_cache() for _, backend, _ in self.tiers)
+    
+    async def cleanup_expired_cache_async(self) -> int:
+        total = 0
+        for _, backend, _ in self.tiers:
+            total += await backend.cleanup_expired_cache_async()
+        return total
+    
+    def tier_stats(self) -> Dict[str, Dict]:
+        """Per-tier hit rates, write counters and lookup latency"""
+        result = {}
+        for name, backend, policy in self.tiers:
+            stats = dict(self.stats[name])
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate_percentage"] = round(stats["hits"] / lookups * 100, 2) if lookups else 0
+            stats["write_policy"] = policy
+            stats["lookup_latency"] = backend.lookup_latency.snapshot()
+            result[name] = stats
+        return result
+    
+    def drain(self, timeout: float) -> Dict[str, int]:
+        """Wait up to timeout seconds for write-behind tiers, then stop their writers
+        
+        Returns the number of writes per tier that did not complete.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and any(self.stats[name]["pending_writes"] for name in self._writers):
+            time.sleep(0.05)
+        for writer in self._writers.values():
+            writer.shutdown(wait=False, cancel_futures=True)
+        return {name: self.stats[name]["pending_writes"] for name in self._writers}
+    
+    def quota_snapshot(self) -> Optional[Dict]:
+        """Disk quota of the first tier that has one"""
+        for _, backend, _ in self.tiers:
+            if hasattr(backend, "quota_snapshot"):
+                return backend.quota_snapshot()
+        return None
+    
+    def get_cache_stats(self) -> Dict:
+        return {
+            "tiers": self.tier_stats(),
+            **{name: backend.get_cache_stats() for name, backend, _ in self.tiers}
+        }
+    
+    def __del__(self) -> None:
+        """Cleanup writer pools on destruction"""
+        for writer in getattr(self, '_writers', {}).values():
+            writer.shutdown(wait=False)